@@ -5,6 +5,19 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Async deployment mode
+---------------------
+By default the site runs under gunicorn's sync workers (myshop.wsgi), one request per
+worker at a time. For many concurrent AJAX cart/wishlist calls, run it under uvicorn
+workers instead and switch those endpoints to their async versions (shop/async_views.py):
+
+    SHOP_ASYNC_VIEWS=True gunicorn myshop.asgi:application -k uvicorn_worker.UvicornWorker --workers 4
+
+(or ``uvicorn myshop.asgi:application --workers 4`` without gunicorn). All middleware is
+async-capable, so async views never wait for a thread; the sync views still work, each
+running in a thread. Persistent connections (conn_max_age in settings) aren't reused
+between requests under ASGI, so each request opens its own; prefer a connection pool here.
 """
 
 import os
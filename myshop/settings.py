@@ -14,6 +14,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url # Import for database configuration
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -59,12 +60,17 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     # WhiteNoiseMiddleware must be placed directly after Django's SecurityMiddleware
-    'whitenoise.middleware.WhiteNoiseMiddleware', # Added for serving static files in production
+    'shop.static.AsyncWhiteNoiseMiddleware', # WhiteNoise, async-capable so ASGI requests stay off threads
+    'shop.metrics.MetricsMiddleware', # Per-view latency/query metrics, see SHOP_METRICS_* below
+    'shop.querylog.QueryInspectorMiddleware', # N+1 and slow query reports when SHOP_QUERY_INSPECTOR is set
+    'shop.routers.ReplicaPinMiddleware', # Keeps visitors who just wrote off the read replicas for a moment
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'shop.snapshots.SnapshotMiddleware', # Pre-rendered catalog pages for anonymous visitors when SHOP_SNAPSHOTS is set
+    'shop.cart.AnonymousCartMiddleware', # Saves the signed-cookie cart of visitors who aren't logged in
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -72,7 +78,7 @@ ROOT_URLCONF = 'myshop.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'shop.metrics.InstrumentedDjangoTemplates', # Django's own backend, plus render timing for /metrics/
         'DIRS': [os.path.join(BASE_DIR, 'templates')], # Add your project-wide templates directory
         'APP_DIRS': True,
         'OPTIONS': {
@@ -101,6 +107,67 @@ DATABASES = {
     )
 }
 
+# Read replicas: DATABASE_REPLICA_URLS is a comma-separated list of database URLs, added as
+# replica_0, replica_1, ... Catalog pages and order history read from them (shop/routers.py);
+# a visitor who just wrote stays on the primary for SHOP_REPLICA_PIN_SECONDS. To try it with
+# two SQLite files: migrate, copy db.sqlite3 to replica.sqlite3, then run with
+# DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3. Tests use the primary for every alias.
+SHOP_DATABASE_REPLICAS = []
+for index, url in enumerate(url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                            if url.strip()):
+    DATABASES[f'replica_{index}'] = {
+        **dj_database_url.parse(url, conn_max_age=600),
+        'TEST': {'MIRROR': 'default'},
+    }
+    SHOP_DATABASE_REPLICAS.append(f'replica_{index}')
+DATABASE_ROUTERS = ['shop.routers.ReplicaRouter']
+SHOP_REPLICA_PIN_SECONDS = int(os.environ.get('SHOP_REPLICA_PIN_SECONDS', 10)) # Longer than the replicas' usual lag
+
+# PostgreSQL connection pool: with DATABASE_POOL=True each worker keeps a psycopg 3 pool of
+# DATABASE_POOL_MIN_SIZE to DATABASE_POOL_MAX_SIZE connections, opened gradually and shared by
+# its threads, instead of a persistent connection per thread. Connections are checked before
+# being handed out, and a request waits up to DATABASE_POOL_TIMEOUT seconds for one when all
+# are busy. Pool stats are on /metrics/. SQLite, or DATABASE_POOL unset, keeps conn_max_age.
+SHOP_DATABASE_POOL = os.environ.get('DATABASE_POOL', 'False') == 'True'
+if SHOP_DATABASE_POOL:
+    for database in DATABASES.values():
+        if database['ENGINE'] != 'django.db.backends.postgresql':
+            continue
+        database['CONN_MAX_AGE'] = 0 # The pool keeps connections open; Django won't do both
+        database['CONN_HEALTH_CHECKS'] = True # With a pool: checked on borrow (ConnectionPool.check_connection)
+        database['OPTIONS'] = {
+            **database.get('OPTIONS', {}),
+            'connect_timeout': int(os.environ.get('DATABASE_CONNECT_TIMEOUT', 5)), # Seconds to open a connection
+            'pool': {
+                'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+                'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)), # Seconds to wait for a free connection
+                'max_idle': float(os.environ.get('DATABASE_POOL_MAX_IDLE', 5 * 60)), # Idle connections above min_size close after this
+                'max_lifetime': float(os.environ.get('DATABASE_POOL_MAX_LIFETIME', 60 * 60)), # Connections are replaced after this
+            },
+        }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# Local memory by default (per process, fine for development). Set CACHE_BACKEND=file so all
+# gunicorn workers share one on-disk cache and see each other's catalog invalidations.
+if os.environ.get('CACHE_BACKEND', 'locmem') == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(BASE_DIR, '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'myshop',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -138,7 +205,20 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') # Directory where static files will be collected for production
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage' # For serving compressed static files
+
+# collectstatic gives every file a content-hashed name, listed in a manifest, plus gzip and
+# Brotli copies; WhiteNoise serves hashed names as immutable, cached for good. The stylesheet
+# and script bundle are built first: run `manage.py build_assets` then `manage.py
+# collectstatic` before serving with DEBUG off (onrender.sh does). Until then pages fail
+# to render, or in production use plain file names and log an error (shop/static.py).
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'shop.static.ManifestStaticFilesStorage'},
+}
+# A file missing from the manifest fails the page (DEBUG, and CI, which sets CI) rather than falling back
+SHOP_STATIC_MANIFEST_STRICT = os.environ.get('SHOP_STATIC_MANIFEST_STRICT', str(DEBUG or 'CI' in os.environ)) == 'True'
+SHOP_TAILWINDCSS = os.environ.get('TAILWINDCSS_BIN', 'tailwindcss') # The Tailwind CLI build_assets runs (pytailwindcss installs one)
+SHOP_TAILWINDCSS_VERSION = os.environ.get('TAILWINDCSS_VERSION', 'v3.4.17') # Release pytailwindcss downloads; v4 drops tailwind.config.js
 
 
 # Media files (for user uploads like product images)
@@ -162,8 +242,97 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'shop.CustomUser'
 
 
+# Sessions: SHOP_SESSION_BACKEND 'db' is Django's default; 'cached_db' reads sessions through a
+# per-process memory cache and the Django cache before the table; 'hybrid' is cached_db for
+# logged-in users and a signed cookie for everyone else (see shop/sessions/). The cached modes
+# need a cache shared by all workers (CACHE_BACKEND=file) when there is more than one.
+# Purge expired rows with `manage.py purge_sessions`.
+SHOP_SESSION_BACKEND = os.environ.get('SHOP_SESSION_BACKEND', 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'shop.sessions.cached_db',
+    'hybrid': 'shop.sessions.hybrid',
+}[SHOP_SESSION_BACKEND]
+SHOP_SESSION_L1_TTL = int(os.environ.get('SHOP_SESSION_L1_TTL', 5)) # Seconds a session stays in a worker's memory; 0 disables
+SHOP_SESSION_L1_SIZE = 10000 # Sessions kept in each worker's memory
+
 # Django Messages Framework settings (if you want to customize)
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# Cookie first, falling back to the session only for messages too big for the cookie, so
+# showing a message doesn't write the session table
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
+
+# Shop catalog settings
+SHOP_PRODUCTS_PER_PAGE = int(os.environ.get('SHOP_PRODUCTS_PER_PAGE', 24)) # Products per page/infinite-scroll batch
+SHOP_ORDERS_PER_PAGE = int(os.environ.get('SHOP_ORDERS_PER_PAGE', 10)) # Orders per order-history page
+SHOP_ANONYMOUS_CART_AGE = 60 * 60 * 24 * 30 # Seconds a visitor's cookie cart is kept (30 days)
+SHOP_ANONYMOUS_CART_MAX_LINES = 50 # Keeps the signed cart cookie well under the 4KB browser limit
+SHOP_PRICE_BUCKETS = [500, 1000, 5000] # Price facet boundaries in BDT: under 500, 500-1000, 1000-5000, 5000 and above
+SHOP_CATALOG_CACHE_TIMEOUT = int(os.environ.get('SHOP_CATALOG_CACHE_TIMEOUT', 60 * 60)) # Seconds; changes invalidate earlier
+# Static HTML snapshots of the anonymous catalog pages (shop/snapshots.py); build them with
+# `manage.py snapshot_catalog`. Changes queue the pages they affect: keep
+# `manage.py snapshot_catalog --changed --every 30` running beside the web server, on the
+# same machine, to re-render them
+SHOP_SNAPSHOTS = os.environ.get('SHOP_SNAPSHOTS', 'False') == 'True'
+SHOP_SNAPSHOT_DIR = os.environ.get('SHOP_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'snapshots'))
+SHOP_RELEASE = os.environ.get('RENDER_GIT_COMMIT', '') # In page ETags, so browsers don't keep pages rendered by old templates
+SHOP_RESERVATION_TTL = int(os.environ.get('SHOP_RESERVATION_TTL', 15 * 60)) # Seconds a cart line holds its stock
+# Serve the AJAX cart/wishlist endpoints from shop/async_views.py; for ASGI deploys, see myshop/asgi.py
+SHOP_ASYNC_VIEWS = os.environ.get('SHOP_ASYNC_VIEWS', 'False') == 'True'
+
+# Image renditions generated on upload (see shop/images.py): name -> (width, height) at 1x,
+# cropped to fill. Each is also made at the extra densities, as WebP and as JPEG/PNG.
+SHOP_IMAGE_RENDITIONS = {
+    'product': {
+        'thumb': (80, 80), # Cart, order history and wishlist line thumbnails
+        'card': (400, 300), # Catalog and wishlist cards
+        'detail': (600, 450), # Product page
+    },
+    'slide': {
+        'banner': (1200, 400), # Homepage slideshow
+    },
+}
+SHOP_IMAGE_DENSITIES = (1, 2) # 2x for high-DPI screens; skipped when the upload is too small
+SHOP_IMAGE_QUALITY = 80 # WebP/JPEG quality
+
+# Request metrics, served to staff at /metrics/ in the Prometheus text format (see shop/metrics.py)
+SHOP_METRICS_ENABLED = os.environ.get('SHOP_METRICS_ENABLED', 'True') == 'True'
+# Shared by all gunicorn workers; in development a temporary directory, so the checkout stays clean
+SHOP_METRICS_DIR = os.environ.get('SHOP_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'myshop-metrics') if DEBUG
+                                  else os.path.join(BASE_DIR, '.metrics'))
+SHOP_METRICS_FLUSH_INTERVAL = 5 # Seconds between writes of a worker's totals to SHOP_METRICS_DIR
+SHOP_METRICS_RETENTION = 24 * 60 * 60 # Seconds an exited worker's totals stay in /metrics/ before its file is removed
+SHOP_METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10] # Seconds
+SHOP_METRICS_QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100] # Queries per request
+
+# Query inspector (see shop/querylog.py): 'off', 'log' to log likely N+1 queries and slow
+# queries, or 'raise' to make requests with likely N+1 queries fail (for tests)
+SHOP_QUERY_INSPECTOR = os.environ.get('SHOP_QUERY_INSPECTOR', 'off')
+SHOP_N_PLUS_ONE_THRESHOLD = 2 # Runs of the same query fingerprint in one request before it is reported
+SHOP_SLOW_QUERY_MS = int(os.environ.get('SHOP_SLOW_QUERY_MS', 200)) # Queries slower than this are logged
+SHOP_SLOW_QUERY_LOG = os.environ.get('SHOP_SLOW_QUERY_LOG', os.path.join(BASE_DIR, 'slow_queries.log'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {'format': '%(asctime)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SHOP_SLOW_QUERY_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True, # Only create the file once there is something to log
+            'formatter': 'timestamped',
+        },
+    },
+    'loggers': {
+        'shop.queries': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        'shop.slow_queries': {'handlers': ['slow_queries'], 'level': 'WARNING', 'propagate': False},
+    },
+}
 
 # Redirect to home URL after login (customize as needed)
 LOGIN_REDIRECT_URL = '/'
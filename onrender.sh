@@ -11,9 +11,21 @@ pip install -r requirements.txt
 # This applies any changes from your Django models to the PostgreSQL database.
 python manage.py migrate
 
+# Build the stylesheet and script bundle into shop/static/shop/dist (see shop/assets)
+# The first run downloads the Tailwind CLI pinned by TAILWINDCSS_VERSION in settings.
+python manage.py build_assets
+
 # Collect static files
 # This gathers all your CSS, JavaScript, and image files into a single directory
-# so WhiteNoise can serve them efficiently in production.
+# so WhiteNoise can serve them efficiently in production. Files get content-hashed names
+# and gzip/Brotli copies, so browsers can cache them for good.
 # --noinput: Prevents prompts, making it run automatically.
 # --clear: Clears existing static files before collecting new ones.
 python manage.py collectstatic --noinput --clear
+
+# Pre-render the anonymous catalog pages when static snapshots are enabled (see shop/snapshots.py).
+# The start command then also needs `python manage.py snapshot_catalog --changed --every 30 &`
+# ahead of gunicorn, so changes reach the pages; both use this service's disk.
+if [ "$SHOP_SNAPSHOTS" = "True" ]; then
+    python manage.py snapshot_catalog
+fi
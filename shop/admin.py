@@ -1,8 +1,10 @@
 # shop/admin.py
 
 from django.contrib import admin
-from .models import Category, Product, CustomUser, Slide, Order, OrderItem, Wishlist, WishlistItem, Cart, CartItem # <-- IMPORT NEW MODELS
+from .models import Category, Product, CustomUser, Slide, Order, OrderItem, Wishlist, WishlistItem, Cart, CartItem, StockReservation # <-- IMPORT NEW MODELS
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import F, Sum
+from . import stock
 
 # Register your models here.
 
@@ -18,6 +20,13 @@ class ProductAdmin(admin.ModelAdmin):
     list_editable = ['price', 'stock', 'available']
     prepopulated_fields = {'slug': ('name',)}
 
+    def save_model(self, request, obj, form, change):
+        # With sharded stock the form's stock is the cached total: only lay it out over the
+        # shards when it was edited, otherwise reshape the shards around their live total
+        super().save_model(request, obj, form, change)
+        if obj.stock_shards or 'stock_shards' in form.changed_data:
+            stock.set_stock(obj, obj.stock if 'stock' in form.changed_data or not change else None)
+
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (
@@ -38,20 +47,28 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'first_name', 'email', 'address', 'paid', 'status', 'created', 'updated']
+    list_display = ['id', 'first_name', 'email', 'address', 'total_cost', 'item_count', 'paid', 'status', 'created', 'updated']
     list_filter = ['paid', 'status', 'created', 'updated']
     search_fields = ['id', 'first_name', 'last_name', 'email']
     inlines = [OrderItemInline]
     list_editable = ['status', 'paid']
+    readonly_fields = ['total_cost', 'item_count']
+
+    # Keep the stored totals in step when items are edited through the inline
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).refresh_totals()
 
 @admin.register(Wishlist)
 class WishlistAdmin(admin.ModelAdmin):
     list_display = ['user', 'created_at']
+    list_select_related = ['user']
     search_fields = ['user__username']
 
 @admin.register(WishlistItem)
 class WishlistItemAdmin(admin.ModelAdmin):
     list_display = ['wishlist', 'product', 'added_at']
+    list_select_related = ['wishlist__user', 'product'] # Both __str__ methods follow these
     list_filter = ['added_at']
     search_fields = ['wishlist__user__username', 'product__name']
 
@@ -65,13 +82,25 @@ class CartItemInline(admin.TabularInline):
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ['user', 'created_at', 'updated_at', 'get_total_price_display']
+    list_select_related = ['user']
     search_fields = ['user__username']
     inlines = [CartItemInline]
     readonly_fields = ['created_at', 'updated_at']
 
+    # Totals come from one grouped query instead of a query per cart
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(total_price=Sum(F('items__price') * F('items__quantity')))
+
     # Custom method to display total price in list view
     def get_total_price_display(self, obj):
-        return f"&#x09F3;{obj.get_total_price():.2f}"
+        total = obj.total_price if hasattr(obj, 'total_price') else obj.get_total_price()
+        return f"&#x09F3;{total or 0:.2f}"
     get_total_price_display.short_description = 'Total Price'
-    get_total_price_display.admin_order_field = 'id' # Allow sorting by ID
+    get_total_price_display.admin_order_field = 'total_price'
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'holder', 'quantity', 'expires_at']
+    list_select_related = ['product']
+    search_fields = ['holder', 'product__name']
+    raw_id_fields = ['product']
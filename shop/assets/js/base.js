@@ -0,0 +1,167 @@
+// shop/assets/js/base.js
+
+// Shared by every page (shop/templates/shop/base.html): the header menu, scroll to top,
+// the chatbot and flash messages. Loaded first in the bundle, so the helpers here
+// (csrftoken, displayFrontendMessage) are there for the page scripts after it.
+
+// JavaScript for mobile menu toggle
+const menuToggle = document.getElementById('menu-toggle');
+const navMenuMobile = document.getElementById('nav-menu-mobile');
+menuToggle.addEventListener('click', () => { navMenuMobile.classList.toggle('hidden'); navMenuMobile.classList.toggle('flex'); navMenuMobile.classList.toggle('flex-col'); });
+
+// JavaScript for scroll to top button
+const scrollToTopBtn = document.getElementById('scrollToTopBtn');
+window.addEventListener('scroll', () => { if (window.scrollY > 300) { scrollToTopBtn.style.display = 'block'; } else { scrollToTopBtn.style.display = 'none'; } });
+scrollToTopBtn.addEventListener('click', () => { window.scrollTo({ top: 0, behavior: 'smooth' }); });
+
+// Chatbot JavaScript
+const chatbotToggleBtn = document.getElementById('chatbotToggleBtn');
+const chatbotContainer = document.getElementById('chatbotContainer');
+const closeChatbotBtn = document.getElementById('closeChatbotBtn');
+const chatbotInput = document.getElementById('chatbotInput');
+const chatbotSendBtn = document.getElementById('chatbotSendBtn');
+const chatbotMessages = document.getElementById('chatbotMessages');
+const chatbotQuickReplies = document.getElementById('chatbotQuickReplies');
+
+chatbotToggleBtn.addEventListener('click', () => { chatbotContainer.style.display = chatbotContainer.style.display === 'flex' ? 'none' : 'flex'; });
+closeChatbotBtn.addEventListener('click', () => { chatbotContainer.style.display = 'none'; });
+
+function displayChatMessage(message, sender) {
+    const messageDiv = document.createElement('div');
+    messageDiv.classList.add('chat-message', sender);
+    messageDiv.textContent = message;
+    chatbotMessages.appendChild(messageDiv);
+    chatbotMessages.scrollTop = chatbotMessages.scrollHeight;
+}
+
+async function sendChatMessageToGemini(userMessage) {
+    displayChatMessage(userMessage, 'user');
+    chatbotInput.value = '';
+
+    let chatHistory = [];
+    chatHistory.push({ role: "user", parts: [{ text: userMessage }] });
+
+    const payload = { contents: chatHistory };
+    const apiKey = "";
+    const apiUrl = `https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key=${apiKey}`;
+
+    const loadingDiv = document.createElement('div');
+    loadingDiv.classList.add('chat-message', 'bot', 'loading-indicator');
+    loadingDiv.textContent = 'Typing...';
+    chatbotMessages.appendChild(loadingDiv);
+    chatbotMessages.scrollTop = chatbotMessages.scrollHeight;
+
+
+    let retries = 0;
+    const maxRetries = 5;
+    const baseDelay = 1000;
+
+    while (retries < maxRetries) {
+        try {
+            const response = await fetch(apiUrl, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload)
+            });
+
+            if (response.status === 429) {
+                const delay = baseDelay * Math.pow(2, retries) + Math.random() * 500;
+                retries++;
+                await new Promise(res => setTimeout(res, delay));
+                continue;
+            }
+
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            const result = await response.json();
+
+            if (chatbotMessages.contains(loadingDiv)) {
+               chatbotMessages.removeChild(loadingDiv);
+            }
+
+            if (result.candidates && result.candidates.length > 0 &&
+                result.candidates[0].content && result.candidates[0].content.parts &&
+                result.candidates[0].content.parts.length > 0) {
+                const text = result.candidates[0].content.parts[0].text;
+                displayChatMessage(text, 'bot');
+            } else {
+                displayChatMessage("Sorry, I couldn't get a response from the AI. Please try again.", 'bot');
+            }
+            break;
+        } catch (error) {
+            if (chatbotMessages.contains(loadingDiv)) {
+               chatbotMessages.removeChild(loadingDiv);
+            }
+            console.error('Error calling Gemini API:', error);
+            if (retries < maxRetries - 1) {
+                const delay = baseDelay * Math.pow(2, retries) + Math.random() * 500;
+                retries++;
+                await new Promise(res => setTimeout(res, delay));
+            } else {
+                displayChatMessage("দুঃখিত, আমি আপনার অনুরোধটি প্রক্রিয়া করতে পারিনি। পরে আবার চেষ্টা করুন। (Sorry, I couldn't process your request. Please try again later.)", 'bot');
+            }
+        }
+    }
+}
+
+chatbotSendBtn.addEventListener('click', () => sendChatMessageToGemini(chatbotInput.value));
+chatbotInput.addEventListener('keypress', (e) => { if (e.key === 'Enter') { sendChatMessageToGemini(chatbotInput.value); } });
+chatbotQuickReplies.querySelectorAll('.quick-reply-btn').forEach(button => {
+    button.addEventListener('click', () => { sendChatMessageToGemini(button.dataset.reply); });
+});
+
+// Function to get CSRF token from cookies
+function getCookie(name) {
+    let cookieValue = null;
+    if (document.cookie && document.cookie !== '') {
+        const cookies = document.cookie.split(';');
+        for (let i = 0; i < cookies.length; i++) {
+            const cookie = cookies[i].trim();
+            // Does this cookie string begin with the name we want?
+            if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                break;
+            }
+        }
+    }
+    return cookieValue;
+}
+
+const csrftoken = getCookie('csrftoken');
+
+// Function to display messages from Django backend
+function displayFrontendMessage(message, type) {
+    const messageContainer = document.getElementById('message-container');
+    const alertDiv = document.createElement('div');
+    alertDiv.classList.add('alert', `alert-${type}`);
+    alertDiv.textContent = message;
+    messageContainer.appendChild(alertDiv);
+
+    // Automatically remove message after 5 seconds
+    setTimeout(() => {
+        alertDiv.style.animation = 'none'; // Stop slide-in animation
+        alertDiv.style.opacity = '0';
+        alertDiv.style.transform = 'translateY(-20px)';
+        setTimeout(() => alertDiv.remove(), 500); // Wait for transition out
+    }, 5000);
+}
+
+// Loop through existing messages rendered by Django and display them using the new function
+document.addEventListener('DOMContentLoaded', () => {
+    const djangoMessages = document.querySelectorAll('.message-container .alert');
+    djangoMessages.forEach(msg => {
+        const messageText = msg.textContent.trim();
+        const messageType = msg.classList.contains('alert-success') ? 'success' :
+                            msg.classList.contains('alert-error') ? 'error' :
+                            msg.classList.contains('alert-info') ? 'info' :
+                            msg.classList.contains('alert-warning') ? 'warning' : 'info'; // Default to info if no specific type
+
+        // Remove the original Django-rendered message after capturing its content
+        msg.remove();
+
+        // Display it using the new frontend function
+        displayFrontendMessage(messageText, messageType);
+    });
+});
@@ -0,0 +1,172 @@
+// shop/assets/js/catalog.js
+
+// Add to cart / wishlist forms (product list, product page, wishlist), the slideshow and
+// infinite scroll. Each part only acts on pages that have its elements.
+
+// Handle Add to Cart forms via AJAX (delegated, so cards loaded by infinite scroll work too)
+document.addEventListener('submit', async (e) => {
+    const form = e.target.closest('.add-to-cart-form');
+    if (!form) return;
+    e.preventDefault(); // Prevent default form submission
+
+    const productId = form.dataset.productId;
+    const quantityInput = form.querySelector('input[name="quantity"]');
+    const quantity = quantityInput ? quantityInput.value : 1; // Get quantity, default to 1
+
+    try {
+        const response = await fetch(form.action, {
+            method: 'POST',
+            headers: {
+                'Accept': 'application/json',
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'X-CSRFToken': csrftoken
+            },
+            body: new URLSearchParams({
+                'product_id': productId,
+                'quantity': quantity
+            })
+        });
+
+        if (response.status === 403) {
+            displayFrontendMessage('You must be logged in to add items to your cart.', 'error');
+            return;
+        }
+
+        const data = await response.json();
+        if (data.status === 'success') {
+            displayFrontendMessage(data.message, 'success');
+        } else if (data.status === 'info') {
+            displayFrontendMessage(data.message, 'info');
+        } else {
+            displayFrontendMessage(data.message, 'error');
+        }
+    } catch (error) {
+        console.error('Error adding to cart:', error);
+        displayFrontendMessage('An error occurred while adding to cart.', 'error');
+    }
+});
+
+// Handle Add to Wishlist forms via AJAX (delegated, like the cart forms above)
+document.addEventListener('submit', async (e) => {
+    const form = e.target.closest('.add-to-wishlist-form');
+    if (!form) return;
+    e.preventDefault(); // Prevent default form submission
+
+    const productId = form.dataset.productId; // Get product ID from data attribute
+
+    try {
+        const response = await fetch(form.action, {
+            method: 'POST',
+            headers: {
+                'Accept': 'application/json',
+                'X-CSRFToken': csrftoken,
+                'Content-Type': 'application/x-www-form-urlencoded'
+            },
+            body: new URLSearchParams({
+                'product_id': productId
+            })
+        });
+
+        const data = await response.json();
+        if (data.status === 'success') {
+            displayFrontendMessage(data.message, 'success');
+        } else if (data.status === 'info') {
+            displayFrontendMessage(data.message, 'info');
+        } else {
+            displayFrontendMessage(data.message, 'error');
+        }
+    } catch (error) {
+        console.error('Error adding to wishlist:', error);
+        displayFrontendMessage('An error occurred while adding to wishlist.', 'error');
+    }
+});
+
+// Slideshow JavaScript (plusSlides and currentSlide are called from the slideshow's onclick attributes)
+let slideIndex = 1;
+let slideTimer;
+
+function showSlides(n) {
+    let i;
+    let slides = document.getElementsByClassName("mySlides");
+    let dots = document.getElementsByClassName("dot");
+
+    if (slides.length === 0) {
+        clearTimeout(slideTimer);
+        const prevButton = document.querySelector('.prev');
+        const nextButton = document.querySelector('.next');
+        if (prevButton) prevButton.style.display = 'none';
+        if (nextButton) nextButton.style.display = 'none';
+        return;
+    }
+
+    if (dots.length === 0 && slides.length === 1) {
+         slides[0].style.display = "block";
+         return;
+    } else if (dots.length === 0 && slides.length > 1) {
+        console.error("Slides exist but no dots are rendered. Check your Django template loop for slideshow-dots.");
+        clearTimeout(slideTimer);
+        return;
+    }
+
+    if (n > slides.length) { slideIndex = 1 }
+    if (n < 1) { slideIndex = slides.length }
+
+    for (i = 0; i < slides.length; i++) {
+        slides[i].style.display = "none";
+    }
+    for (i = 0; i < dots.length; i++) {
+        dots[i].className = dots[i].className.replace(" active-dot", "");
+    }
+
+    slides[slideIndex - 1].style.display = "block";
+    dots[slideIndex - 1].className += " active-dot";
+
+    clearTimeout(slideTimer);
+    slideTimer = setTimeout(() => plusSlides(1), 5000);
+}
+
+function plusSlides(n) {
+    showSlides(slideIndex += n);
+}
+
+function currentSlide(n) {
+    showSlides(slideIndex = n);
+}
+
+window.addEventListener('load', () => {
+    showSlides(slideIndex);
+});
+
+// Infinite scroll: fetch the next batch of cards as a fragment when the "Load More" link comes into view
+const loadMoreLink = document.getElementById('load-more');
+if (loadMoreLink && 'IntersectionObserver' in window) {
+    const productGrid = document.getElementById('product-grid');
+    let loading = false;
+    const loadNextPage = async () => {
+        if (loading || !loadMoreLink.getAttribute('href')) return;
+        loading = true;
+        try {
+            const url = new URL(loadMoreLink.href);
+            url.searchParams.set('fragment', '1');
+            const response = await fetch(url);
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            productGrid.insertAdjacentHTML('beforeend', await response.text());
+            const nextPage = response.headers.get('X-Next-Page');
+            if (nextPage) {
+                loadMoreLink.setAttribute('href', nextPage);
+            } else {
+                observer.disconnect();
+                loadMoreLink.parentElement.remove();
+            }
+        } catch (error) {
+            console.error('Error loading more products:', error);
+        } finally {
+            loading = false;
+        }
+    };
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+    }, { rootMargin: '600px' });
+    observer.observe(loadMoreLink);
+    loadMoreLink.addEventListener('click', (e) => { e.preventDefault(); loadNextPage(); });
+}
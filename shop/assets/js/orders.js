@@ -0,0 +1,47 @@
+// shop/assets/js/orders.js
+
+// Order history in summary mode (?view=summary).
+
+// Summary mode: load an order's lines on demand from the JSON endpoint
+document.querySelectorAll('.show-order-lines').forEach(button => {
+    button.addEventListener('click', async () => {
+        const list = document.getElementById(`order-lines-${button.dataset.orderId}`);
+        if (!list.dataset.loaded) {
+            try {
+                const response = await fetch(button.dataset.url, { headers: { 'Accept': 'application/json' } });
+                if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+                const data = await response.json();
+                data.items.forEach(item => {
+                    const li = document.createElement('li');
+                    li.className = 'flex items-center space-x-4';
+                    const img = document.createElement('img');
+                    img.src = item.image_url || 'https://placehold.co/80x80/e0e0e0/000000?text=No+Image';
+                    img.alt = item.product_name;
+                    img.className = 'w-16 h-16 object-cover rounded-md shadow-sm';
+                    const details = document.createElement('div');
+                    details.className = 'flex-grow';
+                    const name = document.createElement('p');
+                    name.className = 'font-medium text-gray-800';
+                    name.textContent = item.product_name;
+                    const quantity = document.createElement('p');
+                    quantity.className = 'text-gray-600 text-sm';
+                    quantity.textContent = `Quantity: ${item.quantity} x \u09F3${item.price}`;
+                    details.append(name, quantity);
+                    const cost = document.createElement('span');
+                    cost.className = 'font-semibold text-gray-800';
+                    cost.textContent = `\u09F3${item.cost}`;
+                    li.append(img, details, cost);
+                    list.appendChild(li);
+                });
+                list.dataset.loaded = '1';
+            } catch (error) {
+                console.error('Error loading order items:', error);
+                return;
+            }
+        }
+        list.classList.toggle('hidden');
+        button.innerHTML = list.classList.contains('hidden')
+            ? 'Show items <i class="fas fa-chevron-down ml-1 text-xs"></i>'
+            : 'Hide items <i class="fas fa-chevron-up ml-1 text-xs"></i>';
+    });
+});
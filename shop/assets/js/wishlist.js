@@ -0,0 +1,49 @@
+// shop/assets/js/wishlist.js
+
+// The wishlist page: removing items.
+
+// Handle Remove from Wishlist forms via AJAX
+document.querySelectorAll('.remove-from-wishlist-form').forEach(form => {
+    form.addEventListener('submit', async (e) => {
+        e.preventDefault(); // Prevent default form submission
+
+        const productId = form.dataset.productId;
+
+        try {
+            const response = await fetch(form.action, {
+                method: 'POST',
+                headers: {
+                    'Accept': 'application/json',
+                    'X-CSRFToken': csrftoken,
+                    'Content-Type': 'application/x-www-form-urlencoded'
+                },
+                body: new URLSearchParams({
+                    'product_id': productId
+                })
+            });
+
+            if (response.status === 403) { // Forbidden - likely not logged in
+                displayFrontendMessage('You must be logged in to modify your wishlist.', 'error');
+                return;
+            }
+            if (!response.ok) {
+                const errorText = await response.text();
+                throw new Error(`Server responded with status ${response.status}: ${errorText}`);
+            }
+
+            const data = await response.json();
+            if (data.status === 'success') {
+                displayFrontendMessage(data.message, 'success');
+                // Remove the product card from the DOM
+                e.target.closest('.product-card').remove();
+            } else if (data.status === 'info') {
+                displayFrontendMessage(data.message, 'info');
+            } else {
+                displayFrontendMessage(data.message, 'error');
+            }
+        } catch (error) {
+            console.error('Error removing from wishlist:', error);
+            displayFrontendMessage('An unexpected error occurred while removing from wishlist.', 'error');
+        }
+    });
+});
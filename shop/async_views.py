@@ -0,0 +1,98 @@
+# shop/async_views.py
+
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.db.models import Count, F, Sum
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.http import require_POST
+
+from . import reservations
+from .cart import aget_cart
+from .models import CartItem, Product, Wishlist, WishlistItem
+from .views import add_to_cart, feedback, update_cart_quantity
+
+# Async versions of the cart and wishlist AJAX endpoints in views.py. shop/urls.py routes to
+# these when SHOP_ASYNC_VIEWS is set, for deploys on an ASGI server (see myshop/asgi.py):
+# while one request waits on the database the worker serves others, instead of one request
+# per worker at a time. Plain reads and writes use the async ORM. Adding to the cart and
+# changing a quantity lock the product and hold its stock in one transaction, which the
+# async ORM can't do, so that part runs in a thread (the same code as the sync views).
+
+
+@require_POST
+async def cart_add(request, product_id):
+    quantity = int(request.POST.get('quantity', 1))
+    cart = await aget_cart(request)
+    return await sync_to_async(add_to_cart)(request, cart, product_id, quantity)
+
+
+@require_POST
+async def cart_remove(request, product_id, status='success'):
+    product = await aget_object_or_404(Product, id=product_id)
+    cart = await aget_cart(request)
+    if cart.is_anonymous:
+        if product.id not in cart.get_lines([product.id]):
+            raise Http404('Product is not in the cart.')
+        cart.save_lines({}, [product.id])
+    else:
+        deleted, _ = await CartItem.objects.filter(cart=cart.cart, product=product).adelete()
+        if not deleted:
+            raise Http404('Product is not in the cart.')
+
+    await reservations.arelease(cart.holder, [product.id])
+    return feedback(request, status, f'"{product.name}" removed from cart.')
+
+
+@require_POST
+async def cart_update_quantity(request, product_id):
+    new_quantity = int(request.POST.get('quantity', 1))
+    if new_quantity <= 0:
+        return await cart_remove(request, product_id, status='removed')
+    cart = await aget_cart(request)
+    return await sync_to_async(update_cart_quantity)(request, cart, product_id, new_quantity)
+
+
+# Item count and total for the navbar badge and mini-cart; a visitor's cookie cart needs no
+# database at all, a user's Cart one aggregate query
+async def cart_summary(request):
+    cart = await aget_cart(request)
+    if cart.is_anonymous:
+        lines = cart.lines.values()
+        summary = {
+            'line_count': len(lines),
+            'item_count': sum(quantity for quantity, price in lines),
+            'total_price': sum((price * quantity for quantity, price in lines), Decimal('0.00')),
+        }
+    else:
+        summary = await CartItem.objects.filter(cart=cart.cart).aaggregate(
+            line_count=Count('id'),
+            item_count=Sum('quantity', default=0),
+            total_price=Sum(F('price') * F('quantity'), default=Decimal('0.00')),
+        )
+        summary['total_price'] = summary['total_price'].quantize(Decimal('0.01'))
+    return JsonResponse({'status': 'success', **summary})
+
+
+@login_required
+@require_POST
+async def wishlist_add(request, product_id):
+    product = await aget_object_or_404(Product, id=product_id)
+    wishlist, created = await Wishlist.objects.aget_or_create(user=await request.auser())
+    wishlist_item, item_created = await WishlistItem.objects.aget_or_create(wishlist=wishlist, product=product)
+    if item_created:
+        return feedback(request, 'success', f'"{product.name}" added to your wishlist.', product_name=product.name)
+    return feedback(request, 'info', f'"{product.name}" is already in your wishlist.', product_name=product.name)
+
+
+@login_required
+@require_POST
+async def wishlist_remove(request, product_id):
+    product = await aget_object_or_404(Product, id=product_id)
+    wishlist = await aget_object_or_404(Wishlist, user=await request.auser())
+    deleted_count, _ = await WishlistItem.objects.filter(wishlist=wishlist, product=product).adelete()
+    if deleted_count > 0:
+        return feedback(request, 'success', f'"{product.name}" removed from your wishlist.', product_name=product.name)
+    return feedback(request, 'info', f'"{product.name}" was not found in your wishlist.', product_name=product.name)
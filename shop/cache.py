@@ -0,0 +1,101 @@
+# shop/cache.py
+
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .routers import replica_in_use
+
+# Catalog data that cached pages and fragments depend on. Each namespace has a version
+# token in the cache; saving or deleting a model bumps its token (see shop/signals.py),
+# which orphans every key built from the old one instead of deleting keys one by one.
+CATALOG_NAMESPACES = ('product', 'category', 'slide')
+
+# Cached HTML is shared by every anonymous visitor, so it is rendered with this marker
+# in place of the per-visitor CSRF token and the real token is swapped in on each hit.
+CSRF_PLACEHOLDER = '__shop_csrf_token__'
+
+# Response headers worth keeping alongside the cached body (e.g. the infinite-scroll cursor)
+CACHED_HEADERS = ('Content-Type', 'X-Next-Page')
+
+
+def _version_key(namespace):
+    return f'shop:version:{namespace}'
+
+
+def _new_version():
+    return format(time.time_ns(), 'x')
+
+
+def get_versions(*namespaces):
+    # One get_many round trip for all namespaces; unknown ones get a fresh token
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    versions = {}
+    for key, namespace in keys.items():
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+            found[key] = cache.get(key)
+        versions[namespace] = found[key]
+    return versions
+
+
+def bump_version(namespace):
+    # Writing a new token (rather than incrementing) keeps this safe on backends
+    # without atomic incr, such as the file-based cache shared between workers.
+    cache.set(_version_key(namespace), _new_version(), timeout=None)
+
+
+def bump_version_on_commit(namespace):
+    # Bumping before commit would let a concurrent request cache the old rows under the new token
+    transaction.on_commit(lambda: bump_version(namespace))
+
+
+def page_cache_key(request, namespaces):
+    versions = get_versions(*namespaces)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    token = '.'.join(str(versions[namespace]) for namespace in namespaces)
+    return f'shop:page:{path}:{token}'
+
+
+def cache_catalog_page(*namespaces):
+    # Whole-page cache for anonymous catalog views returning a TemplateResponse.
+    # Logged-in users, POSTs and requests with pending flash messages bypass it.
+    namespaces = namespaces or CATALOG_NAMESPACES
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD') or request.user.is_authenticated
+                    or len(messages.get_messages(request))):
+                return view_func(request, *args, **kwargs)
+
+            key = page_cache_key(request, namespaces)
+            cached = cache.get(key)
+            if cached is None:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code != 200 or not hasattr(response, 'context_data'):
+                    return response
+                response.context_data['csrf_token'] = CSRF_PLACEHOLDER
+                response.render()
+                cached = {
+                    'content': response.content.decode(response.charset),
+                    'headers': {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+                }
+                # A lagging replica's page would be stored under the new token
+                if not replica_in_use():
+                    cache.set(key, cached, settings.SHOP_CATALOG_CACHE_TIMEOUT)
+
+            response = HttpResponse(cached['content'].replace(CSRF_PLACEHOLDER, get_token(request)))
+            for name, value in cached['headers'].items():
+                response[name] = value
+            return response
+        return wrapper
+    return decorator
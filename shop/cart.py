@@ -0,0 +1,301 @@
+# shop/cart.py
+
+import json
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+
+from . import reservations
+from .models import Cart, CartItem, Product
+
+CART_OPERATIONS = ('add', 'update', 'remove')
+# Largest quantity or id a batch operation may name; anything bigger is rejected up front
+# rather than overflowing the database's integer columns
+MAX_OPERATION_INTEGER = 2 ** 31 - 1
+
+# Visitors who aren't logged in keep their cart in this signed cookie, so browsing and
+# filling a cart costs no database writes. It is merged into their Cart on login.
+ANONYMOUS_CART_COOKIE = 'cart'
+ANONYMOUS_CART_SALT = 'shop.cart'
+
+
+class CartOperationError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(errors))
+
+
+class CartLine:
+    # Stands in for a CartItem when rendering an anonymous cart
+    def __init__(self, product, quantity, price):
+        self.product = product
+        self.product_id = product.id
+        self.quantity = quantity
+        self.price = price
+
+    def get_cost(self):
+        return self.price * self.quantity
+
+
+# Both cart kinds expose the same small interface: get_lines() returns
+# {product_id: (quantity, price)} for the given products, save_lines() upserts lines
+# and removes others, and items() returns CartItem-like objects with their products.
+# `holder` names the cart's stock reservations (shop/reservations.py), None for a cart
+# that holds no stock.
+class DatabaseCart:
+    is_anonymous = False
+
+    def __init__(self, cart):
+        self.cart = cart
+        self.holder = reservations.cart_holder(cart)
+
+    def get_lines(self, product_ids, lock=False):
+        items = CartItem.objects.filter(cart=self.cart, product_id__in=product_ids)
+        if lock:
+            items = items.select_for_update()
+        return {item.product_id: (item.quantity, item.price) for item in items}
+
+    def save_lines(self, lines, removed=()):
+        if lines:
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart=self.cart, product_id=product_id, quantity=quantity, price=price)
+                    for product_id, (quantity, price) in lines.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'price'],
+            )
+        if removed:
+            CartItem.objects.filter(cart=self.cart, product_id__in=removed).delete()
+
+    def items(self):
+        return list(self.cart.items.select_related('product').order_by('id'))
+
+
+class AnonymousCart:
+    is_anonymous = True
+    # Holding stock means writing StockReservation rows, which this cart exists to avoid.
+    # Its lines are checked against other carts' holds when added and start holding
+    # stock once merged into a Cart on login, which checkout requires anyway.
+    holder = None
+
+    def __init__(self, request):
+        self.lines = {}
+        self.modified = False
+        try:
+            data = json.loads(request.get_signed_cookie(ANONYMOUS_CART_COOKIE, salt=ANONYMOUS_CART_SALT,
+                                                        max_age=settings.SHOP_ANONYMOUS_CART_AGE))
+            self.lines = {int(product_id): (int(quantity), Decimal(price))
+                          for product_id, (quantity, price) in data['lines'].items()}
+        except (KeyError, signing.BadSignature, ValueError, TypeError, InvalidOperation):
+            # No cookie, or one that is expired, tampered with or malformed: start empty
+            self.lines = {}
+
+    def get_lines(self, product_ids, lock=False):
+        return {product_id: self.lines[product_id] for product_id in product_ids if product_id in self.lines}
+
+    def save_lines(self, lines, removed=()):
+        updated = {**self.lines, **lines}
+        for product_id in removed:
+            updated.pop(product_id, None)
+        if len(updated) > settings.SHOP_ANONYMOUS_CART_MAX_LINES:
+            raise CartOperationError(['Your cart is full. Please log in to add more products.'])
+        self.lines = updated
+        self.modified = True
+
+    def items(self):
+        products = Product.objects.in_bulk(self.lines)
+        return [CartLine(products[product_id], quantity, price)
+                for product_id, (quantity, price) in self.lines.items() if product_id in products]
+
+    def clear(self):
+        self.lines = {}
+        self.modified = True
+
+    def update_response(self, response):
+        if self.lines:
+            data = json.dumps({
+                'lines': {str(product_id): [quantity, str(price)] for product_id, (quantity, price) in self.lines.items()},
+            }, separators=(',', ':'))
+            response.set_signed_cookie(ANONYMOUS_CART_COOKIE, data, salt=ANONYMOUS_CART_SALT,
+                                       max_age=settings.SHOP_ANONYMOUS_CART_AGE, httponly=True, samesite='Lax',
+                                       secure=settings.SESSION_COOKIE_SECURE)
+        else:
+            response.delete_cookie(ANONYMOUS_CART_COOKIE, samesite='Lax')
+
+
+def get_anonymous_cart(request):
+    # One instance per request, so the middleware sees every change made to it
+    if not hasattr(request, '_anonymous_cart'):
+        request._anonymous_cart = AnonymousCart(request)
+    return request._anonymous_cart
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        return DatabaseCart(cart)
+    return get_anonymous_cart(request)
+
+
+async def aget_cart(request):
+    # get_cart() for async views
+    user = await request.auser()
+    if user.is_authenticated:
+        cart, created = await Cart.objects.aget_or_create(user=user)
+        return DatabaseCart(cart)
+    return get_anonymous_cart(request)
+
+
+class AnonymousCartMiddleware:
+    # Writes the anonymous cart cookie back when a view changed the cart
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        cart = getattr(request, '_anonymous_cart', None)
+        if cart is not None and cart.modified:
+            cart.update_response(response)
+        return response
+
+
+def merge_anonymous_cart(request, user):
+    # Folds the visitor's cookie cart into the user's Cart on login: one product fetch,
+    # one locked fetch of the matching lines and one bulk upsert. Quantities add up,
+    # capped at the available stock; lines already in the Cart keep their price.
+    anonymous_cart = get_anonymous_cart(request)
+    if not anonymous_cart.lines:
+        return
+    cart, created = Cart.objects.get_or_create(user=user)
+    database_cart = DatabaseCart(cart)
+    products = Product.objects.in_bulk(anonymous_cart.lines)
+    with transaction.atomic():
+        existing = database_cart.get_lines(list(products), lock=True)
+        merged = {}
+        for product_id, (quantity, price) in anonymous_cart.lines.items():
+            if product_id not in products:
+                continue
+            if product_id in existing:
+                quantity += existing[product_id][0]
+                price = existing[product_id][1]
+            quantity = min(quantity, products[product_id].stock)
+            if quantity > 0:
+                merged[product_id] = (quantity, price)
+        database_cart.save_lines(merged)
+        # The visitor's lines held no stock until now
+        reservations.hold(database_cart.holder, {product_id: quantity for product_id, (quantity, price) in merged.items()})
+    anonymous_cart.clear()
+
+
+def _parse_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError(['"operations" must be a non-empty list.'])
+    parsed, errors = [], []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            errors.append(f'Operation {index}: "op" must be one of {", ".join(CART_OPERATIONS)}.')
+            continue
+        try:
+            product_id = int(operation.get('product_id'))
+            quantity = int(operation.get('quantity', 1))
+        except (TypeError, ValueError, OverflowError):  # OverflowError: 1e400 and Infinity parse as floats
+            errors.append(f'Operation {index}: "product_id" and "quantity" must be integers.')
+            continue
+        if not 0 < product_id <= MAX_OPERATION_INTEGER or abs(quantity) > MAX_OPERATION_INTEGER:
+            errors.append(f'Operation {index}: "product_id" or "quantity" is out of range.')
+            continue
+        if operation['op'] == 'add' and quantity <= 0:
+            errors.append(f'Operation {index}: quantity must be at least 1.')
+            continue
+        parsed.append((operation['op'], product_id, quantity))
+    if errors:
+        raise CartOperationError(errors)
+    return parsed
+
+
+def apply_cart_operations(cart, operations):
+    # Applies a list of {"op": "add"|"update"|"remove", "product_id": ..., "quantity": ...}
+    # to a DatabaseCart or AnonymousCart in order, all or nothing. Whatever the list
+    # length this is one locked product fetch, one fetch of the affected cart lines, one
+    # of other carts' reservations, then one bulk upsert and one delete each for the lines
+    # and their reservations. An "update" to a quantity of 0 or less removes the line and,
+    # like cart_update_quantity and cart_remove, "update" and "remove" need the line to exist.
+    parsed = _parse_operations(operations)
+    product_ids = {product_id for _, product_id, _ in parsed}
+
+    with transaction.atomic():
+        products = reservations.lock_products(product_ids)
+        missing = sorted(product_ids - products.keys())
+        if missing:
+            raise CartOperationError([f'Product {product_id} does not exist.' for product_id in missing])
+
+        existing = cart.get_lines(product_ids, lock=True)
+        quantities = {product_id: quantity for product_id, (quantity, price) in existing.items()}
+        errors = []
+        for index, (op, product_id, quantity) in enumerate(parsed):
+            if op == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            elif product_id not in quantities:
+                errors.append(f'Operation {index}: "{products[product_id].name}" is not in the cart.')
+            elif op == 'update' and quantity > 0:
+                quantities[product_id] = quantity
+            else:
+                del quantities[product_id]
+        if errors:
+            raise CartOperationError(errors)
+
+        # Stock held by other carts is off limits
+        available = reservations.available_stock(list(products.values()), cart.holder)
+        errors = [
+            f'Not enough stock for "{products[product_id].name}". Available: {available[product_id]}'
+            for product_id, quantity in quantities.items()
+            if available[product_id] < quantity
+        ]
+        if errors:
+            raise CartOperationError(errors)
+
+        # Existing lines keep the price they were added at; new lines take the current price
+        changed = {
+            product_id: (quantity, existing[product_id][1] if product_id in existing else products[product_id].price)
+            for product_id, quantity in quantities.items()
+            if product_id not in existing or existing[product_id][0] != quantity
+        }
+        cart.save_lines(changed, existing.keys() - quantities.keys())
+        reservations.hold(cart.holder, {product_id: quantities.get(product_id, 0) for product_id in product_ids})
+
+    return cart_state(cart)
+
+
+def cart_state(cart):
+    # The whole cart as a JSON-ready dict, from a single query
+    items = cart.items()
+    return {
+        'items': [{
+            'product_id': item.product_id,
+            'product_name': item.product.name,
+            'quantity': item.quantity,
+            'price': item.price,
+            'cost': item.get_cost(),
+            'stock': item.product.stock,
+        } for item in items],
+        'item_count': sum(item.quantity for item in items),
+        'total_price': sum((item.get_cost() for item in items), 0),
+    }
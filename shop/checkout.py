@@ -0,0 +1,78 @@
+# shop/checkout.py
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from .cache import bump_version_on_commit
+from .facets import record_stock_changes
+from . import reservations, snapshots, stock
+from .models import Order, OrderItem, Product
+
+
+def place_order(cart, user, shipping):
+    # Turns the cart into an Order with a fixed number of queries however many lines it
+    # has: one locked fetch of every product, one bulk insert of the OrderItems and one
+    # conditional UPDATE of the stock (plus a few per product with sharded stock, which
+    # is taken from its shards instead). Raises ValueError (rolling everything back) if
+    # any line cannot be fulfilled.
+    with transaction.atomic():
+        cart_items = list(cart.items.all())
+        if not cart_items:
+            raise ValueError("Your cart is empty.")
+        quantities = {item.product_id: item.quantity for item in cart_items}
+
+        # Lock in id order so two checkouts sharing products can't deadlock each other
+        products = reservations.lock_products(quantities)
+        # Stock other carts are holding isn't ours to sell
+        holder = reservations.cart_holder(cart)
+        available = reservations.available_stock(list(products.values()), holder)
+        for product_id, quantity in quantities.items():
+            product = products[product_id]
+            if available[product_id] < quantity:
+                raise ValueError(f"Not enough stock for {product.name}. Only {available[product_id]} available.")
+
+        order = Order.objects.create(
+            user=user,
+            status='Pending',
+            total_cost=sum(item.get_cost() for item in cart_items),
+            item_count=sum(quantities.values()),
+            **shipping
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=item.product_id, price=item.price, quantity=item.quantity)
+            for item in cart_items
+        ])
+
+        # Each row only matches while it still has enough stock, so a short row count
+        # means another checkout got there first (on databases without row locks too)
+        unsharded = {product_id: quantity for product_id, quantity in quantities.items()
+                     if not products[product_id].stock_shards}
+        if unsharded:
+            enough_stock = Q()
+            for product_id, quantity in unsharded.items():
+                enough_stock |= Q(id=product_id, stock__gte=quantity)
+            updated = Product.objects.filter(enough_stock).update(
+                stock=Case(*[When(id=product_id, then=F('stock') - quantity) for product_id, quantity in unsharded.items()]),
+                updated=timezone.now(),  # update() skips auto_now
+            )
+            if updated != len(unsharded):
+                raise ValueError("Some items in your cart just sold out. Please review your cart.")
+        for product_id, quantity in quantities.items():
+            if product_id not in unsharded:
+                try:
+                    stock.take(products[product_id], quantity)
+                except ValueError:
+                    raise ValueError("Some items in your cart just sold out. Please review your cart.")
+
+        cart.items.all().delete()
+        reservations.release(holder)
+        # update() doesn't send post_save, so move products that sold out to their
+        # out-of-stock facet and retire cached catalog pages still offering them.
+        # Pages show no stock counts, so other orders leave the cache alone.
+        new_stock = {product_id: products[product_id].stock - quantity for product_id, quantity in quantities.items()}
+        record_stock_changes(products.values(), new_stock)
+        snapshots.schedule_stock_changes(products.values(), new_stock)
+        if any(stock <= 0 for stock in new_stock.values()):
+            bump_version_on_commit('product')
+    return order
@@ -0,0 +1,83 @@
+# shop/conditional.py
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .cache import CATALOG_NAMESPACES, get_versions
+from .routers import replica_in_use
+from .models import Product
+
+# Conditional GET for catalog pages. Before the view runs, a freshness function finds the
+# newest change to the data the page shows, from the catalog cache's version tokens or a
+# single product's row. That becomes a weak ETag (with who is asking) and, where the data
+# has a timestamp, Last-Modified, so a browser revalidating a page it already has gets a
+# 304 without the page being queried or rendered. Pages carry the visitor's CSRF token, so the ETag covers the user and the
+# CSRF cookie (rotated on login) and the response is private; no-cache makes browsers
+# revalidate every time rather than guess how long a page stays fresh.
+
+
+def _newest(*timestamps):
+    return max((timestamp for timestamp in timestamps if timestamp is not None), default=None)
+
+
+def catalog_freshness(request, category_slug=None):
+    # product_list, with or without a category: its facets count products across the whole
+    # catalog, so any change counts. The version tokens change on every catalog write,
+    # deletions included, as the page cache relies on too. They carry no time, so the
+    # listing goes without Last-Modified and revalidating it runs no query at all.
+    return None, sorted(get_versions(*CATALOG_NAMESPACES).items())
+
+
+def product_freshness(request, id, slug):
+    row = (Product.objects.filter(id=id, slug=slug, available=True)
+           .values_list('updated', 'category__updated').first())
+    if row is None:
+        return None  # The view answers 404
+    return _newest(*row), row
+
+
+def etag(request, version):
+    user = request.user.pk if request.user.is_authenticated else None
+    # CsrfViewMiddleware keeps the visitor's CSRF secret here, or the new one a page just
+    # made for a first-time visitor (and sent as their cookie)
+    key = repr((version, user, request.META.get('CSRF_COOKIE'), settings.SHOP_RELEASE))
+    return f'W/"{hashlib.md5(key.encode()).hexdigest()}"'
+
+
+def conditional_page(freshness):
+    # freshness(request, *args, **kwargs) returns (last modified, anything that changes
+    # whenever the page would), or None to skip the check
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            # A page with flash messages to show is rendered whatever the browser has
+            if request.method not in ('GET', 'HEAD') or len(messages.get_messages(request)):
+                return view_func(request, *args, **kwargs)
+            fresh = freshness(request, *args, **kwargs)
+            if fresh is None:
+                return view_func(request, *args, **kwargs)
+
+            last_modified, version = fresh
+            page_etag = etag(request, version)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=page_etag, last_modified=timestamp)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+                page_etag = etag(request, version)
+            if response.status_code in (200, 304):
+                # A page from a replica may predate the version it would be tagged with;
+                # the browser revalidates it untagged next time
+                if response.status_code == 304 or not replica_in_use():
+                    response.headers.setdefault('ETag', page_etag)
+                    if timestamp is not None:
+                        response.headers.setdefault('Last-Modified', http_date(timestamp))
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
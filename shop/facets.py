@@ -0,0 +1,207 @@
+# shop/facets.py
+
+from bisect import bisect_right
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, Count, F, IntegerField, Value, When
+from django.urls import reverse
+
+from .cache import bump_version_on_commit, get_versions
+from .models import Category, Product, ProductFacetCount
+from .routers import replica_in_use
+
+# Facet counts for the product listing come from ProductFacetCount, kept up to date
+# incrementally: shop/signals.py records each product save/delete and place_order
+# records stock that runs out. `manage.py rebuild_facets` recomputes the table.
+
+
+def price_bucket(price):
+    return bisect_right(settings.SHOP_PRICE_BUCKETS, price)
+
+
+def price_bucket_bounds(bucket):
+    bounds = settings.SHOP_PRICE_BUCKETS
+    low = bounds[bucket - 1] if bucket > 0 else None
+    high = bounds[bucket] if bucket < len(bounds) else None
+    return low, high
+
+
+def price_bucket_label(bucket):
+    low, high = price_bucket_bounds(bucket)
+    if low is None:
+        return f'Under ৳{high:,}'
+    if high is None:
+        return f'৳{low:,} & above'
+    return f'৳{low:,} - ৳{high:,}'
+
+
+def price_bucket_expression():
+    # SQL equivalent of price_bucket(), for the full rebuild
+    whens = [When(price__lt=bound, then=Value(index)) for index, bound in enumerate(settings.SHOP_PRICE_BUCKETS)]
+    return Case(*whens, default=Value(len(settings.SHOP_PRICE_BUCKETS)), output_field=IntegerField())
+
+
+def in_stock_expression():
+    return Case(When(stock__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField())
+
+
+def facet_key(category_id, price, stock, available):
+    # The ProductFacetCount row a product counts towards, or None if it isn't listed
+    if not available:
+        return None
+    return category_id, price_bucket(price), stock > 0
+
+
+def product_facet_key(product):
+    return facet_key(product.category_id, product.price, product.stock, product.available)
+
+
+def apply_deltas(deltas):
+    # deltas: {facet key: change in count}. Each key is one UPDATE ... SET count = count + n,
+    # plus an INSERT the first time a combination appears.
+    for key, delta in deltas.items():
+        if key is None or not delta:
+            continue
+        category_id, bucket, in_stock = key
+        rows = ProductFacetCount.objects.filter(category_id=category_id, price_bucket=bucket, in_stock=in_stock)
+        if rows.update(count=F('count') + delta) or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                ProductFacetCount.objects.create(category_id=category_id, price_bucket=bucket, in_stock=in_stock,
+                                                 count=delta)
+        except IntegrityError:
+            # Another transaction created the row first
+            rows.update(count=F('count') + delta)
+
+
+def record_change(old_key, new_key):
+    if old_key != new_key:
+        apply_deltas(Counter({old_key: -1, new_key: 1}))
+
+
+def record_stock_changes(products, new_stock):
+    # For bulk stock updates that bypass post_save, e.g. place_order.
+    # new_stock: {product id: stock after the update}
+    deltas = Counter()
+    for product in products:
+        old_key = product_facet_key(product)
+        new_key = facet_key(product.category_id, product.price, new_stock[product.id], product.available)
+        if old_key != new_key:
+            deltas[old_key] -= 1
+            deltas[new_key] += 1
+    apply_deltas(deltas)
+
+
+def rebuild():
+    # One GROUP BY over the available products, swapped in within a transaction
+    counts = (
+        Product.objects.filter(available=True).order_by()
+        .values('category_id', bucket=price_bucket_expression(), has_stock=in_stock_expression())
+        .annotate(total=Count('id'))
+    )
+    rows = [
+        ProductFacetCount(category_id=row['category_id'], price_bucket=row['bucket'], in_stock=row['has_stock'],
+                          count=row['total'])
+        for row in counts
+    ]
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create(rows, batch_size=1000)
+        bump_version_on_commit('product')
+    return len(rows)
+
+
+def _facet_data():
+    # The whole facet table plus category names: small, and cached until the catalog changes
+    versions = get_versions('product', 'category')
+    key = f"shop:facets:{versions['product']}.{versions['category']}"
+    data = cache.get(key)
+    if data is None:
+        data = {
+            'categories': list(Category.objects.order_by('name').values_list('id', 'name', 'slug')),
+            'rows': list(ProductFacetCount.objects.filter(count__gt=0)
+                         .values_list('category_id', 'price_bucket', 'in_stock', 'count')),
+        }
+        if not replica_in_use():  # Same as cache_catalog_page
+            cache.set(key, data, settings.SHOP_CATALOG_CACHE_TIMEOUT)
+    return data
+
+
+def build_facets(request, category, bucket, in_stock_only):
+    # Facet options for the listing template. Each facet's counts honour the other
+    # selected facets but not its own, so every option shows what selecting it would give.
+    data = _facet_data()
+    rows = data['rows']
+
+    def count(category_id=None, price=None, stock=None):
+        return sum(
+            total for row_category, row_bucket, row_in_stock, total in rows
+            if (category_id is None or row_category == category_id)
+            and (price is None or row_bucket == price)
+            and (not stock or row_in_stock)
+        )
+
+    def url(category_slug, **params):
+        path = reverse('shop:product_list_by_category', args=[category_slug]) if category_slug \
+            else reverse('shop:product_list')
+        query = request.GET.copy()
+        for name in ('cursor', 'fragment'):
+            query.pop(name, None)
+        for name, value in params.items():
+            if value is None:
+                query.pop(name, None)
+            else:
+                query[name] = value
+        return f'{path}?{query.urlencode()}' if query else path
+
+    category_id = category.id if category else None
+    category_slug = category.slug if category else None
+    return {
+        'all_categories': {
+            'url': url(None),
+            'count': count(price=bucket, stock=in_stock_only),
+            'active': category is None,
+        },
+        'categories': [
+            {'name': name, 'url': url(slug), 'count': count(pk, bucket, in_stock_only), 'active': pk == category_id}
+            for pk, name, slug in data['categories']
+        ],
+        'prices': [
+            {
+                'label': price_bucket_label(index),
+                'url': url(category_slug, price=None if index == bucket else str(index)),
+                'count': count(category_id, index, in_stock_only),
+                'active': index == bucket,
+            }
+            for index in range(len(settings.SHOP_PRICE_BUCKETS) + 1)
+        ],
+        'in_stock': {
+            'url': url(category_slug, in_stock=None if in_stock_only else '1'),
+            'count': count(category_id, bucket, True),
+            'active': in_stock_only,
+        },
+    }
+
+
+def parse_price_bucket(value):
+    try:
+        bucket = int(value)
+    except (TypeError, ValueError):
+        return None
+    return bucket if 0 <= bucket <= len(settings.SHOP_PRICE_BUCKETS) else None
+
+
+def filter_products(products, bucket, in_stock_only):
+    if bucket is not None:
+        low, high = price_bucket_bounds(bucket)
+        if low is not None:
+            products = products.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+    if in_stock_only:
+        products = products.filter(stock__gt=0)
+    return products
@@ -0,0 +1,135 @@
+# shop/images.py
+
+import logging
+import posixpath
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Resized copies ("renditions") of Product and Slide images, cut to the sizes in
+# settings.SHOP_IMAGE_RENDITIONS when an image is uploaded (shop/signals.py) or by
+# `manage.py generate_renditions`. Their storage names live in the model's renditions
+# field, so templates build <picture> tags without touching the filesystem:
+#   {'source': <image name they were made from>,
+#    <spec>: {'width': 400, 'height': 300,
+#             'webp': [[name, width], ...], 'fallback': [[name, width], ...]}}
+RENDITIONS_DIR = 'renditions'
+
+
+def specs_for(instance):
+    return settings.SHOP_IMAGE_RENDITIONS[instance._meta.model_name]
+
+
+def _rendition_name(source, spec, size, extension):
+    directory, filename = posixpath.split(source)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(RENDITIONS_DIR, directory, f'{stem}_{spec}_{size[0]}x{size[1]}.{extension}')
+
+
+def _save(image, name, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.SHOP_IMAGE_QUALITY, **options)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_renditions(source, specs):
+    # Renders every spec of the stored image `source` and returns the renditions dict.
+    # A module-level function of plain arguments so the backfill can run it in a process pool.
+    renditions = {'source': source}
+    try:
+        with default_storage.open(source, 'rb') as file, Image.open(file) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (OSError, UnidentifiedImageError) as error:
+        # Missing or unreadable upload: templates fall back to the original URL
+        logger.warning("Could not make renditions of %s: %s", source, error)
+        return renditions
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    fallback_format, fallback_extension = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+
+    for spec, (width, height) in specs.items():
+        rendition = {'width': width, 'height': height, 'webp': [], 'fallback': []}
+        for density in settings.SHOP_IMAGE_DENSITIES:
+            size = (width * density, height * density)
+            # Upscaling adds bytes but no detail, so extra densities need a big enough upload
+            if density > 1 and (image.width < size[0] or image.height < size[1]):
+                continue
+            resized = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+            rendition['webp'].append(
+                [_save(resized, _rendition_name(source, spec, size, 'webp'), 'WEBP', method=4), size[0]])
+            rendition['fallback'].append(
+                [_save(resized, _rendition_name(source, spec, size, fallback_extension), fallback_format,
+                       optimize=True), size[0]])
+        renditions[spec] = rendition
+    return renditions
+
+
+def rendition_names(renditions):
+    return [name for spec, rendition in renditions.items() if spec != 'source'
+            for variant in ('webp', 'fallback') for name, width in rendition[variant]]
+
+
+def delete_renditions(renditions):
+    for name in rendition_names(renditions):
+        default_storage.delete(name)
+
+
+def update_renditions(instance):
+    # Brings instance.renditions in line with its current image; a no-op when it already is
+    source = instance.image.name if instance.image else None
+    old = instance.renditions or {}
+    if old.get('source') == source:
+        return
+    renditions = generate_renditions(source, specs_for(instance)) if source else {}
+    # update() rather than save(), so this doesn't fire post_save again
+    type(instance).objects.filter(pk=instance.pk).update(renditions=renditions)
+    instance.renditions = renditions
+    stale = set(rendition_names(old)) - set(rendition_names(renditions))
+    transaction.on_commit(lambda: [default_storage.delete(name) for name in stale])
+
+
+def rendition_url(instance, spec):
+    # URL of the smallest rendition of `spec`, falling back to the original image
+    rendition = (instance.renditions or {}).get(spec)
+    if rendition and rendition['fallback']:
+        return default_storage.url(rendition['fallback'][0][0])
+    return instance.image.url if instance.image else None
+
+
+def backfill(queryset, workers=None, force=False):
+    # Generates renditions for every object in `queryset` whose renditions are missing
+    # or out of date, spreading the image work over a process pool. Yields each pk done.
+    specs = specs_for(queryset.model)
+    pending, previous = {}, {}
+    for pk, source, renditions in queryset.exclude(image='').exclude(image=None).values_list(
+            'pk', 'image', 'renditions').iterator():
+        renditions = renditions or {}
+        if force or renditions.get('source') != source or any(spec not in renditions for spec in specs):
+            pending[pk] = source
+            previous[pk] = renditions
+    if not pending:
+        return
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        futures = {pool.submit(generate_renditions, source, specs): pk for pk, source in pending.items()}
+        for future in as_completed(futures):
+            pk = futures[future]
+            renditions = future.result()
+            queryset.model.objects.filter(pk=pk).update(renditions=renditions)
+            for name in set(rendition_names(previous[pk])) - set(rendition_names(renditions)):
+                default_storage.delete(name)
+            yield pk
@@ -0,0 +1,135 @@
+# shop/management/commands/benchmark_shop.py
+
+import json
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+
+from shop.models import CartItem, CustomUser, Order, Product
+
+SCENARIOS = ('product_list', 'product_detail', 'cart_add', 'checkout_view', 'order_history')
+SHIPPING = {
+    'first_name': 'Bench', 'last_name': 'Mark', 'email': 'bench@example.com',
+    'address': '1 Benchmark Road', 'postal_code': '1000', 'city': 'Dhaka',
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    return sorted_values[max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ("Time the main shop views in-process with Django's test client and print p50/p95/p99 "
+            "latency and throughput as JSON. Run `manage.py seed_shop` first. Everything the "
+            "benchmark writes (cart lines, orders, stock) is rolled back at the end.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per scenario first.")
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the JSON report to this file as well.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.products = list(
+            Product.objects.filter(available=True, stock__gt=0, stock_shards=0).order_by('?')
+            .values_list('id', 'slug')[:500]
+        )
+        if not self.products:
+            raise CommandError("No products in stock to benchmark with. Run `manage.py seed_shop` first.")
+
+        report = {'database': connection.vendor, 'products': Product.objects.count(),
+                  'orders': Order.objects.count(), 'scenarios': {}}
+        try:
+            with transaction.atomic():
+                user = self.benchmark_user()
+                # Start from an empty cart: seeded carts can hold lines that are out of stock
+                CartItem.objects.filter(cart__user=user).delete()
+                self.client = Client(HTTP_HOST='localhost')
+                self.client.force_login(user)
+                for name in options['scenarios']:
+                    request = getattr(self, f'request_{name}')
+                    for _ in range(options['warmup']):
+                        request()
+                    report['scenarios'][name] = self.run(request, options['requests'])
+                    self.stderr.write(f"{name}: p95 {report['scenarios'][name]['p95_ms']} ms")
+                raise Rollback
+        except Rollback:
+            pass
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+
+    def benchmark_user(self):
+        # The customer with the most recent order, so order_history has something to page
+        user_id = Order.objects.filter(user__isnull=False).order_by('-id').values_list('user', flat=True).first()
+        if user_id:
+            return CustomUser.objects.get(pk=user_id)
+        return CustomUser.objects.create_user(username='benchmark', password=None)
+
+    def run(self, request, count):
+        timings, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(count):
+            elapsed, ok = request()
+            timings.append(elapsed)
+            errors += not ok
+        wall = time.perf_counter() - started
+        timings.sort()
+        return {
+            'requests': count,
+            'errors': errors,
+            'p50_ms': round(percentile(timings, 50) * 1000, 2),
+            'p95_ms': round(percentile(timings, 95) * 1000, 2),
+            'p99_ms': round(percentile(timings, 99) * 1000, 2),
+            'mean_ms': round(sum(timings) / count * 1000, 2),
+            'throughput_rps': round(count / wall, 1),
+        }
+
+    def timed(self, method, path, data=None, expected=None, json_reply=False):
+        headers = {'HTTP_ACCEPT': 'application/json'} if json_reply else {}
+        start = time.perf_counter()
+        response = getattr(self.client, method)(path, data, **headers)
+        elapsed = time.perf_counter() - start
+        if json_reply:
+            # The JSON endpoints answer 200 even when they refuse, with {"status": "error"}
+            return elapsed, response.status_code == 200 and response.json().get('status') != 'error'
+        return elapsed, response.status_code == expected if expected else response.status_code < 400
+
+    def random_product(self):
+        return self.random.choice(self.products)
+
+    def request_product_list(self):
+        return self.timed('get', reverse('shop:product_list'))
+
+    def request_product_detail(self):
+        product_id, slug = self.random_product()
+        return self.timed('get', reverse('shop:product_detail', args=[product_id, slug]))
+
+    def request_cart_add(self):
+        product_id, slug = self.random_product()
+        return self.timed('post', reverse('shop:cart_add', args=[product_id]), {'quantity': 1}, json_reply=True)
+
+    def request_checkout_view(self):
+        # Fill the cart untimed, then time placing the order
+        product_id, slug = self.random_product()
+        self.client.post(reverse('shop:cart_add', args=[product_id]), {'quantity': 1})
+        # A placed order redirects to the order history; a failed one renders the form again
+        return self.timed('post', reverse('shop:checkout_view'), SHIPPING, expected=302)
+
+    def request_order_history(self):
+        return self.timed('get', reverse('shop:order_history'))
@@ -0,0 +1,53 @@
+# shop/management/commands/build_assets.py
+
+import os
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+ASSETS_DIR = os.path.join(settings.BASE_DIR, 'shop', 'assets')
+DIST_DIR = os.path.join(settings.BASE_DIR, 'shop', 'static', 'shop', 'dist')
+
+# Bundled in this order: base.js defines the helpers the others use
+SCRIPTS = ('base.js', 'catalog.js', 'cart.js', 'wishlist.js', 'orders.js')
+
+
+class Command(BaseCommand):
+    help = ("Build the site's stylesheet with the Tailwind CLI, keeping only the classes the templates "
+            "and scripts use, and bundle its scripts, into shop/static/shop/dist. Run before collectstatic, "
+            "which hashes and compresses them.")
+
+    def handle(self, *args, **options):
+        os.makedirs(DIST_DIR, exist_ok=True)
+        self.build_css(os.path.join(DIST_DIR, 'app.css'))
+        self.build_js(os.path.join(DIST_DIR, 'app.js'))
+        self.stdout.write(self.style.SUCCESS("Built assets; run collectstatic to publish them."))
+
+    def build_css(self, output):
+        command = [
+            settings.SHOP_TAILWINDCSS,
+            '--config', os.path.join(settings.BASE_DIR, 'tailwind.config.js'),
+            '--input', os.path.join(ASSETS_DIR, 'css', 'app.css'),
+            '--output', output,
+            '--minify',
+        ]
+        env = {**os.environ, 'TAILWINDCSS_VERSION': settings.SHOP_TAILWINDCSS_VERSION}
+        try:
+            # The content globs in tailwind.config.js are relative to the project root
+            result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        except FileNotFoundError:
+            raise CommandError(f"Tailwind CLI not found: {settings.SHOP_TAILWINDCSS}. "
+                               "Install pytailwindcss (requirements.txt) or set TAILWINDCSS_BIN.")
+        if result.returncode:
+            raise CommandError(f"Tailwind CLI failed:\n{result.stderr}")
+        self.stdout.write(f"  {os.path.relpath(output, settings.BASE_DIR)}: {os.path.getsize(output)} bytes")
+
+    def build_js(self, output):
+        parts = []
+        for name in SCRIPTS:
+            with open(os.path.join(ASSETS_DIR, 'js', name), encoding='utf-8') as file:
+                parts.append(file.read())
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(parts))
+        self.stdout.write(f"  {os.path.relpath(output, settings.BASE_DIR)}: {os.path.getsize(output)} bytes")
@@ -0,0 +1,30 @@
+# shop/management/commands/generate_renditions.py
+
+from django.core.management.base import BaseCommand
+
+from shop import images
+from shop.cache import bump_version
+from shop.models import Product, Slide
+
+
+class Command(BaseCommand):
+    help = "Generate missing or outdated image renditions for products and slides."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of worker processes (default: one per CPU).")
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate every rendition, e.g. after changing SHOP_IMAGE_RENDITIONS.")
+
+    def handle(self, *args, **options):
+        for model in (Product, Slide):
+            done = 0
+            for pk in images.backfill(model.objects.all(), workers=options['workers'], force=options['force']):
+                done += 1
+                if done % 100 == 0:
+                    self.stdout.write(f"  {done} {model._meta.verbose_name_plural}...")
+            self.stdout.write(self.style.SUCCESS(
+                f"Generated renditions for {done} {model._meta.verbose_name_plural}."))
+        # update() skips post_save, so retire cached pages still pointing at the originals
+        bump_version('product')
+        bump_version('slide')
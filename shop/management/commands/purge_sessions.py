@@ -0,0 +1,31 @@
+# shop/management/commands/purge_sessions.py
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.sessions.cleanup import purge_expired
+
+
+class Command(BaseCommand):
+    help = ("Delete expired sessions from the django_session table in batches. With --shards N, "
+            "run one process per --shard 0..N-1 to purge in parallel. Safe to run from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of sessions deleted per statement (default: 1000).")
+        parser.add_argument('--shard', type=int, default=0, help="Which shard to purge (default: 0).")
+        parser.add_argument('--shards', type=int, default=1, help="Number of shards the keys are split into.")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to wait between batches, to go easy on a busy database.")
+
+    def handle(self, *args, **options):
+        purged = 0
+        try:
+            for deleted in purge_expired(options['batch_size'], options['shard'], options['shards']):
+                purged += deleted
+                if options['pause']:
+                    time.sleep(options['pause'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired session(s)."))
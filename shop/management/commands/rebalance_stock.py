@@ -0,0 +1,27 @@
+# shop/management/commands/rebalance_stock.py
+
+from django.core.management.base import BaseCommand
+
+from shop import stock
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Even out the stock shards of products with sharded stock and refresh their cached "
+            "Product.stock. Run every few minutes during sales.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('products', nargs='*', type=int, help="Product ids (default: every sharded product).")
+
+    def handle(self, *args, **options):
+        products = Product.objects.filter(stock_shards__gt=0).order_by('pk')
+        if options['products']:
+            products = products.filter(pk__in=options['products'])
+        count = 0
+        for product in products.iterator():
+            cached = product.stock
+            total = stock.set_stock(product)
+            count += 1
+            if total != cached:
+                self.stdout.write(f"  {product.name}: {cached} -> {total}")
+        self.stdout.write(self.style.SUCCESS(f"Rebalanced {count} product(s)."))
@@ -0,0 +1,13 @@
+# shop/management/commands/rebuild_facets.py
+
+from django.core.management.base import BaseCommand
+
+from shop import facets
+
+
+class Command(BaseCommand):
+    help = "Recompute the product listing facet counts from the catalog."
+
+    def handle(self, *args, **options):
+        rows = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} facet count row(s)."))
@@ -0,0 +1,20 @@
+# shop/management/commands/rebuild_search_index.py
+
+from django.core.management.base import BaseCommand
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of products indexed per batch (default: 1000).")
+
+    def handle(self, *args, **options):
+        if search.vendor() is None:
+            self.stdout.write("This database has no search index; searches use icontains instead.")
+            return
+        indexed = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} product(s)."))
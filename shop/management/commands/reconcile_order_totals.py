@@ -0,0 +1,33 @@
+# shop/management/commands/reconcile_order_totals.py
+
+from django.core.management.base import BaseCommand
+
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = "Recompute Order.total_cost and Order.item_count from the order items using database aggregation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of orders recomputed per UPDATE statement (default: 1000).")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many orders have stale totals.")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            stale = Order.objects.out_of_sync().count()
+            self.stdout.write(f"{stale} order(s) have stale totals.")
+            return
+
+        # Walk the table in primary-key batches so a large backlog never holds one long write lock
+        batch_size = options['batch_size']
+        last_pk = 0
+        total = 0
+        while True:
+            pks = list(Order.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            total += Order.objects.filter(pk__in=pks).refresh_totals()
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f"Recomputed totals for {total} order(s)."))
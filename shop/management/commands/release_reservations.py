@@ -0,0 +1,17 @@
+# shop/management/commands/release_reservations.py
+
+from django.core.management.base import BaseCommand
+
+from shop import reservations
+
+
+class Command(BaseCommand):
+    help = "Delete expired stock reservations in batches. Safe to run from cron every few minutes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of reservations deleted per statement (default: 1000).")
+
+    def handle(self, *args, **options):
+        released = sum(reservations.release_expired(batch_size=options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservation(s)."))
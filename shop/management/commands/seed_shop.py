@@ -0,0 +1,170 @@
+# shop/management/commands/seed_shop.py
+
+import random
+import secrets
+from array import array
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop import facets, search
+from shop.cache import CATALOG_NAMESPACES, bump_version
+from shop.models import (
+    Cart, CartItem, Category, CustomUser, Order, OrderItem, Product, Wishlist, WishlistItem,
+)
+
+WORDS = ('classic', 'cotton', 'leather', 'silk', 'denim', 'linen', 'wool', 'summer', 'winter', 'travel',
+         'handmade', 'premium', 'everyday', 'vintage', 'organic', 'slim', 'casual', 'formal', 'kids', 'sport')
+NOUNS = ('shirt', 'saree', 'panjabi', 'kurta', 'bag', 'wallet', 'scarf', 'shoe', 'sandal', 'watch',
+         'belt', 'jacket', 'cap', 'lamp', 'mug', 'notebook', 'bottle', 'cushion', 'mat', 'basket')
+CITIES = ('Dhaka', 'Chattogram', 'Khulna', 'Rajshahi', 'Sylhet', 'Barishal', 'Rangpur', 'Mymensingh')
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with a synthetic catalog, customers, carts, wishlists and orders for load "
+            "testing. Rows are inserted with bulk_create in batches, so millions of rows are fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--carts', type=int, default=500, help="Users (of --users) who get a cart.")
+        parser.add_argument('--cart-items', type=int, default=5, help="Maximum lines per cart.")
+        parser.add_argument('--wishlists', type=int, default=500, help="Users (of --users) who get a wishlist.")
+        parser.add_argument('--wishlist-items', type=int, default=10, help="Maximum items per wishlist.")
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--order-items', type=int, default=4, help="Maximum lines per order.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for repeatable data.")
+        parser.add_argument('--skip-indexes', action='store_true',
+                            help="Don't rebuild the search index and facet counts afterwards.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Unique per run, so seeding twice adds rows instead of colliding on slugs/usernames
+        self.run = secrets.token_hex(3)
+
+        categories = self.seed_categories(options['categories'])
+        product_ids, product_cents = self.seed_products(options['products'], categories)
+        user_ids = self.seed_users(options['users'])
+        if product_ids and user_ids:
+            self.seed_carts(user_ids[:options['carts']], product_ids, product_cents, options['cart_items'])
+            self.seed_wishlists(user_ids[:options['wishlists']], product_ids, options['wishlist_items'])
+            self.seed_orders(options['orders'], user_ids, product_ids, product_cents, options['order_items'])
+
+        # bulk_create skips the signals that keep these up to date
+        if not options['skip_indexes']:
+            self.stdout.write("Rebuilding facet counts and the search index...")
+            facets.rebuild()
+            search.rebuild_index(batch_size=self.batch_size)
+        for namespace in CATALOG_NAMESPACES:
+            bump_version(namespace)
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield start, min(start + self.batch_size, total)
+
+    def insert(self, model, objects):
+        with transaction.atomic():
+            created = model.objects.bulk_create(objects, batch_size=self.batch_size)
+        return created
+
+    def progress(self, label, done, total):
+        self.stdout.write(f"  {label}: {done}/{total}")
+
+    def seed_categories(self, count):
+        categories = self.insert(Category, [
+            Category(name=f'{self.random.choice(WORDS).title()} {self.random.choice(NOUNS).title()}s {self.run}-{i}',
+                     slug=f'seed-{self.run}-{i}')
+            for i in range(count)
+        ])
+        self.progress('categories', len(categories), count)
+        return [category.id for category in categories] or list(Category.objects.values_list('id', flat=True))
+
+    def seed_products(self, count, category_ids):
+        # Ids and prices (in poisha) of the new products, kept compactly for picking lines later
+        ids, cents = array('q'), array('q')
+        if not category_ids:
+            return ids, cents
+        for start, end in self.batches(count):
+            products = []
+            for i in range(start, end):
+                name = f'{self.random.choice(WORDS).title()} {self.random.choice(NOUNS)} {i}'
+                products.append(Product(
+                    category_id=self.random.choice(category_ids),
+                    name=name,
+                    slug=f'seed-{self.run}-{i}',
+                    description=f'{name}, {self.random.choice(WORDS)} and {self.random.choice(WORDS)}.',
+                    price=Decimal(self.random.randint(50, 20000)),
+                    stock=self.random.choice((0, 5, 20, 100, 1000)),
+                    available=self.random.random() > 0.05,
+                ))
+            for product in self.insert(Product, products):
+                ids.append(product.id)
+                cents.append(int(product.price * 100))
+            self.progress('products', end, count)
+        return ids, cents
+
+    def seed_users(self, count):
+        # One hash for everyone: hashing per user would take longer than the inserts
+        password = make_password('password')
+        ids = array('q')
+        for start, end in self.batches(count):
+            users = self.insert(CustomUser, [
+                CustomUser(username=f'seed-{self.run}-{i}', email=f'seed-{self.run}-{i}@example.com',
+                           password=password, first_name='Seed', last_name=f'User {i}')
+                for i in range(start, end)
+            ])
+            ids.extend(user.id for user in users)
+            self.progress('users', end, count)
+        return ids
+
+    def pick_products(self, product_ids, most):
+        return self.random.sample(range(len(product_ids)), self.random.randint(1, min(most, len(product_ids))))
+
+    def seed_carts(self, user_ids, product_ids, product_cents, most):
+        for start, end in self.batches(len(user_ids)):
+            carts = self.insert(Cart, [Cart(user_id=user_id) for user_id in user_ids[start:end]])
+            self.insert(CartItem, [
+                CartItem(cart_id=cart.id, product_id=product_ids[index],
+                         price=Decimal(product_cents[index]) / 100, quantity=self.random.randint(1, 3))
+                for cart in carts for index in self.pick_products(product_ids, most)
+            ])
+            self.progress('carts', end, len(user_ids))
+
+    def seed_wishlists(self, user_ids, product_ids, most):
+        for start, end in self.batches(len(user_ids)):
+            wishlists = self.insert(Wishlist, [Wishlist(user_id=user_id) for user_id in user_ids[start:end]])
+            self.insert(WishlistItem, [
+                WishlistItem(wishlist_id=wishlist.id, product_id=product_ids[index])
+                for wishlist in wishlists for index in self.pick_products(product_ids, most)
+            ])
+            self.progress('wishlists', end, len(user_ids))
+
+    def seed_orders(self, count, user_ids, product_ids, product_cents, most):
+        for start, end in self.batches(count):
+            orders, lines = [], []
+            for i in range(start, end):
+                order_lines = [(index, self.random.randint(1, 3)) for index in self.pick_products(product_ids, most)]
+                lines.append(order_lines)
+                orders.append(Order(
+                    user_id=self.random.choice(user_ids),
+                    first_name='Seed', last_name=f'Customer {i}', email=f'order-{self.run}-{i}@example.com',
+                    address=f'{self.random.randint(1, 200)} Road {self.random.randint(1, 30)}',
+                    postal_code=str(self.random.randint(1000, 9999)), city=self.random.choice(CITIES),
+                    paid=self.random.random() > 0.3,
+                    status=self.random.choice(('Pending', 'Processing', 'Shipped', 'Delivered')),
+                    total_cost=Decimal(sum(product_cents[index] * quantity for index, quantity in order_lines)) / 100,
+                    item_count=sum(quantity for index, quantity in order_lines),
+                ))
+            orders = self.insert(Order, orders)
+            self.insert(OrderItem, [
+                OrderItem(order_id=order.id, product_id=product_ids[index],
+                          price=Decimal(product_cents[index]) / 100, quantity=quantity)
+                for order, order_lines in zip(orders, lines) for index, quantity in order_lines
+            ])
+            self.progress('orders', end, count)
@@ -0,0 +1,40 @@
+# shop/management/commands/snapshot_catalog.py
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from shop import snapshots
+
+
+class Command(BaseCommand):
+    help = ("Pre-render the product list, category pages and product pages to SHOP_SNAPSHOT_DIR, "
+            "served to anonymous visitors when SHOP_SNAPSHOTS is set. With --changed, only re-render "
+            "the pages changes have queued since. Run on the machine whose disk the snapshots are on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of worker processes (default: one per CPU).")
+        parser.add_argument('--changed', action='store_true',
+                            help="Re-render the pages queued by catalog and stock changes instead of every page.")
+        parser.add_argument('--every', type=float, default=None,
+                            help="With --changed: keep running, checking the queue every this many seconds.")
+
+    def handle(self, *args, **options):
+        if options['every'] is not None and not options['changed']:
+            raise CommandError("--every only applies to --changed.")
+        if options['changed']:
+            while True:
+                changes = snapshots.refresh_queued()
+                if changes or options['every'] is None:
+                    self.stdout.write(self.style.SUCCESS(f"Refreshed the pages of {changes} queued change(s)."))
+                if options['every'] is None:
+                    return
+                time.sleep(options['every'])
+                close_old_connections()  # A long-running loop, like a request cycle
+        written = 0
+        for batch, written in enumerate(snapshots.rebuild(workers=options['workers']), 1):
+            if batch % 20 == 0:
+                self.stdout.write(f"  {written} pages...")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} page snapshot(s)."))
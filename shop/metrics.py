@@ -0,0 +1,324 @@
+# shop/metrics.py
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+# Per-view request metrics in the Prometheus text format, served at /metrics/ to staff.
+#
+# MetricsMiddleware times each request and, through a database execute wrapper and the
+# InstrumentedDjangoTemplates backend, the queries and template rendering it did. Totals
+# are kept in a dict per process and written every SHOP_METRICS_FLUSH_INTERVAL seconds
+# to SHOP_METRICS_DIR/<pid>.json, along with the worker's database pool stats when
+# DATABASE_POOL is set; the endpoint adds up every worker's file. The directory must be
+# local to the machine: a file whose pid is no longer running belongs to a worker that has
+# exited, so its pool gauges are left out (its connections are gone) while its counters
+# still count, until the file is SHOP_METRICS_RETENTION seconds old and removed.
+
+_current = ContextVar('shop_request_metrics', default=None)
+
+# (metric, type, help, psycopg_pool stat, scale). Counter stats are missing until nonzero.
+POOL_METRICS = [
+    ('shop_db_pool_connections', 'gauge', 'Connections open in the pool.', 'pool_size', 1),
+    ('shop_db_pool_idle_connections', 'gauge', 'Open connections not in use.', 'pool_available', 1),
+    ('shop_db_pool_max_connections', 'gauge', 'Most connections the pool may open.', 'pool_max', 1),
+    ('shop_db_pool_waiting_requests', 'gauge', 'Requests waiting for a connection right now.', 'requests_waiting', 1),
+    ('shop_db_pool_requests_total', 'counter', 'Connections handed out.', 'requests_num', 1),
+    ('shop_db_pool_queued_requests_total', 'counter', 'Requests that had to wait for a connection.',
+     'requests_queued', 1),
+    ('shop_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.', 'requests_wait_ms', 0.001),
+    ('shop_db_pool_timeouts_total', 'counter', 'Requests that gave up waiting for a connection.', 'requests_errors', 1),
+    ('shop_db_pool_opened_connections_total', 'counter', 'Connections opened.', 'connections_num', 1),
+    ('shop_db_pool_connection_errors_total', 'counter', 'Failed attempts to open a connection.',
+     'connections_errors', 1),
+    ('shop_db_pool_lost_connections_total', 'counter', 'Broken connections caught by the health check.',
+     'connections_lost', 1),
+]
+POOL_GAUGES = {stat for name, kind, help_text, stat, scale in POOL_METRICS if kind == 'gauge'}
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_time', 'template_time', 'template_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = time.monotonic()
+
+    def _new_entry(self):
+        return {
+            'count': 0,
+            'duration_sum': 0.0,
+            'duration_buckets': [0] * (len(settings.SHOP_METRICS_LATENCY_BUCKETS) + 1),
+            'queries': 0,
+            'query_buckets': [0] * (len(settings.SHOP_METRICS_QUERY_BUCKETS) + 1),
+            'db_time': 0.0,
+            'template_time': 0.0,
+            'statuses': {},
+        }
+
+    def record(self, view, method, status, duration, request_metrics):
+        key = f'{view} {method}'
+        with self.lock:
+            entry = self.views.get(key)
+            if entry is None:
+                entry = self.views[key] = self._new_entry()
+            entry['count'] += 1
+            entry['duration_sum'] += duration
+            # Buckets are stored non-cumulative here and summed when rendered
+            entry['duration_buckets'][bisect_left(settings.SHOP_METRICS_LATENCY_BUCKETS, duration)] += 1
+            entry['queries'] += request_metrics.queries
+            entry['query_buckets'][bisect_left(settings.SHOP_METRICS_QUERY_BUCKETS, request_metrics.queries)] += 1
+            entry['db_time'] += request_metrics.db_time
+            entry['template_time'] += request_metrics.template_time
+            status = str(status)
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+        if time.monotonic() - self.last_flush >= settings.SHOP_METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        pools = pool_stats()
+        with self.lock:
+            data = json.dumps({'views': self.views, 'pools': pools})
+            self.last_flush = time.monotonic()
+        directory = settings.SHOP_METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        # Write then rename, so readers never see half a file
+        with open(f'{path}.tmp', 'w') as file:
+            file.write(data)
+        os.replace(f'{path}.tmp', path)
+
+
+registry = Registry()
+
+
+def pool_stats():
+    # {alias: stats} of this worker's connection pools. Django keeps them on the PostgreSQL
+    # backend class and opens one on first use, so only pools that are already open are read.
+    stats = {}
+    for connection in connections.all():
+        pool = getattr(type(connection), '_connection_pools', {}).get(connection.alias)
+        if pool is not None:
+            stats[connection.alias] = pool.get_stats()
+    return stats
+
+
+def _record_query(execute, sql, params, many, context):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.db_time += time.perf_counter() - start
+        request_metrics.queries += 1
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.SHOP_METRICS_ENABLED:
+            return self.get_response(request)
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, start, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        # The same under ASGI; queries from async views run in threads but see this request's
+        # context, so _record_query still finds its RequestMetrics
+        if not settings.SHOP_METRICS_ENABLED:
+            return await self.get_response(request)
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_record_query))
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, start, request_metrics)
+        return response
+
+    def record(self, request, response, start, request_metrics):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.record(view, request.method, response.status_code, time.perf_counter() - start, request_metrics)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        request_metrics = _current.get()
+        if request_metrics is None:
+            return self.template.render(context, request)
+        # Only the outermost render counts, so templates rendered inside others aren't added twice
+        request_metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            request_metrics.template_depth -= 1
+            if not request_metrics.template_depth:
+                request_metrics.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    # The standard Django template backend, timing each render for MetricsMiddleware
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def is_running(pid):
+    if pid == os.getpid():
+        return True
+    if os.name != 'posix':
+        return True  # No signal 0 to probe with; the Windows dev server is one process anyway
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running, as another user
+    return True
+
+
+def collect():
+    # Every worker's totals added together
+    registry.flush()
+    merged = {}
+    pools = {}
+    directory = settings.SHOP_METRICS_DIR
+    now = time.time()
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        if extension != '.json' or not name.isdigit():
+            continue
+        path = os.path.join(directory, filename)
+        running = is_running(int(name))
+        try:
+            if not running and now - os.path.getmtime(path) > settings.SHOP_METRICS_RETENTION:
+                os.remove(path)
+                continue
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for alias, stats in data.get('pools', {}).items():
+            total = pools.setdefault(alias, {})
+            for stat, value in stats.items():
+                if running or stat not in POOL_GAUGES:
+                    total[stat] = total.get(stat, 0) + value
+        for key, entry in data.get('views', {}).items():
+            total = merged.get(key)
+            if total is None:
+                merged[key] = entry
+                continue
+            for field in ('count', 'duration_sum', 'queries', 'db_time', 'template_time'):
+                total[field] += entry[field]
+            for field in ('duration_buckets', 'query_buckets'):
+                # Lists can differ in length if the bucket settings changed between deploys
+                if len(total[field]) == len(entry[field]):
+                    total[field] = [a + b for a, b in zip(total[field], entry[field])]
+            for status, count in entry['statuses'].items():
+                total['statuses'][status] = total['statuses'].get(status, 0) + count
+    return {'views': merged, 'pools': pools}
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels.items())
+
+
+def _histogram(lines, name, labels, bounds, buckets, total, count):
+    cumulative = 0
+    for bound, bucket in zip(bounds, buckets):
+        cumulative += bucket
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+    lines.append(f'{name}_sum{{{labels}}} {total}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+
+
+def render_prometheus(collected):
+    merged = collected['views']
+    sections = {
+        'shop_request_duration_seconds': ('histogram', 'Time to build the response, per view.'),
+        'shop_requests_total': ('counter', 'Responses per view and status code.'),
+        'shop_db_queries_per_request': ('histogram', 'Database queries per request, per view.'),
+        'shop_db_query_seconds_total': ('counter', 'Time spent in database queries, per view.'),
+        'shop_template_render_seconds_total': ('counter', 'Time spent rendering templates, per view.'),
+    }
+    if collected['pools']:
+        sections.update({name: (kind, help_text) for name, kind, help_text, stat, scale in POOL_METRICS})
+    lines = {name: [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+             for name, (kind, help_text) in sections.items()}
+    for key in sorted(merged):
+        entry = merged[key]
+        view, method = key.rsplit(' ', 1)
+        labels = _labels(view=view, method=method)
+        _histogram(lines['shop_request_duration_seconds'], 'shop_request_duration_seconds', labels,
+                   settings.SHOP_METRICS_LATENCY_BUCKETS, entry['duration_buckets'], entry['duration_sum'],
+                   entry['count'])
+        for status, count in sorted(entry['statuses'].items()):
+            lines['shop_requests_total'].append(
+                f'shop_requests_total{{{_labels(view=view, method=method, status=status)}}} {count}')
+        _histogram(lines['shop_db_queries_per_request'], 'shop_db_queries_per_request', labels,
+                   settings.SHOP_METRICS_QUERY_BUCKETS, entry['query_buckets'], entry['queries'], entry['count'])
+        lines['shop_db_query_seconds_total'].append(f'shop_db_query_seconds_total{{{labels}}} {entry["db_time"]}')
+        lines['shop_template_render_seconds_total'].append(
+            f'shop_template_render_seconds_total{{{labels}}} {entry["template_time"]}')
+    # Summed over running workers: the gauges give the whole deployment's connections
+    for alias in sorted(collected['pools']):
+        stats = collected['pools'][alias]
+        labels = _labels(database=alias)
+        for name, kind, help_text, stat, scale in POOL_METRICS:
+            lines[name].append(f'{name}{{{labels}}} {stats.get(stat, 0) * scale}')
+    return '\n'.join(line for section in lines.values() for line in section) + '\n'
@@ -0,0 +1,28 @@
+# Creates the product full-text search index (see shop/search.py) and fills it
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from shop import search
+    search.create_index(schema_editor)
+    Product = apps.get_model('shop', 'Product')
+    products = Product.objects.using(schema_editor.connection.alias).select_related('category').filter(available=True)
+    for start in range(0, products.count(), 1000):
+        search.index_products(products.order_by('pk')[start:start + 1000])
+
+
+def drop_search_index(apps, schema_editor):
+    from shop import search
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
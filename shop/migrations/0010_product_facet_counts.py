@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_facets(apps, schema_editor):
+    from shop.facets import in_stock_expression, price_bucket_expression
+    Product = apps.get_model('shop', 'Product')
+    ProductFacetCount = apps.get_model('shop', 'ProductFacetCount')
+    db = schema_editor.connection.alias
+    counts = (
+        Product.objects.using(db).filter(available=True).order_by()
+        .values('category_id', bucket=price_bucket_expression(), has_stock=in_stock_expression())
+        .annotate(total=Count('id'))
+    )
+    ProductFacetCount.objects.using(db).bulk_create([
+        ProductFacetCount(category_id=row['category_id'], price_bucket=row['bucket'], in_stock=row['has_stock'],
+                          count=row['total'])
+        for row in counts
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField(help_text='Index into settings.SHOP_PRICE_BUCKETS.')),
+                ('in_stock', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='shop.category')),
+            ],
+            options={
+                'unique_together': {('category', 'price_bucket', 'in_stock')},
+            },
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,10 @@
 # shop/models.py
 
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import AbstractUser
 
 # Custom User Model (Recommended for future flexibility)
@@ -17,6 +21,7 @@ class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     slug = models.SlugField(unique=True, help_text="A short label for URLs, containing only letters, numbers, underscores or hyphens.") # For clean URLs
+    updated = models.DateTimeField(auto_now=True) # Last-Modified of pages showing the category, see shop/conditional.py
 
     class Meta:
         verbose_name_plural = "Categories" # Correct plural name for admin interface
@@ -31,7 +36,9 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/%Y/%m/%d/', blank=True, null=True) # Images will go into media/products/year/month/day/
+    renditions = models.JSONField(default=dict, blank=True, editable=False) # Resized copies of image, see shop/images.py
     stock = models.PositiveIntegerField(default=0)
+    stock_shards = models.PositiveSmallIntegerField(default=0, help_text="Spread stock over this many counters so concurrent checkouts don't queue on one row (for best-sellers during sales). 0 keeps stock in this row; see shop/stock.py.")
     available = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
@@ -41,6 +48,13 @@ class Product(models.Model):
         ordering = ('name',) # Order products by name by default
         indexes = [
             models.Index(fields=['id', 'slug']),
+            # product_list: available products, optionally of one category, in name order (keyset
+            # pagination walks these, so a plain ('name', 'id') index is not needed). Partial
+            # rather than leading with `available`: Django filters booleans as a bare `WHERE available`,
+            # which SQLite can't match to an index column but does match to an index condition
+            models.Index(fields=['name', 'id'], condition=Q(available=True), name='product_available_name_idx'),
+            models.Index(fields=['category', 'name', 'id'], condition=Q(available=True),
+                         name='product_category_name_idx'),
         ]
 
     def __str__(self):
@@ -51,11 +65,40 @@ class Product(models.Model):
         from django.urls import reverse
         return reverse('shop:product_detail', args=[self.id, self.slug])
 
+# Precomputed facet counts for the product listing (maintained by shop/facets.py).
+# One row per (category, price bucket, in stock) combination of available products, so
+# any facet count is a sum over this small table instead of a GROUP BY over Product.
+class ProductFacetCount(models.Model):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facet_counts')
+    price_bucket = models.PositiveSmallIntegerField(help_text="Index into settings.SHOP_PRICE_BUCKETS.")
+    in_stock = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('category', 'price_bucket', 'in_stock')
+
+    def __str__(self):
+        return f"{self.category_id}/{self.price_bucket}/{'in' if self.in_stock else 'out'}: {self.count}"
+
+# One slice of a sharded product's stock (see shop/stock.py). While a product has shards,
+# its stock is their sum and Product.stock is a cached copy of it for display.
+class StockShard(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_counters')
+    index = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'index')
+
+    def __str__(self):
+        return f"{self.product_id}#{self.index}: {self.quantity}"
+
 # Slideshow Slide Model
 class Slide(models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='slides/%Y/%m/%d/') # Images for slides
+    renditions = models.JSONField(default=dict, blank=True, editable=False) # Resized copies of image, see shop/images.py
     link_url = models.URLField(max_length=500, blank=True, null=True, help_text="Optional URL for the slide's call-to-action button.")
     order = models.PositiveIntegerField(default=0, help_text="Order in which slides appear (lower number first).")
     is_active = models.BooleanField(default=True, help_text="Whether this slide should be displayed in the slideshow.")
@@ -64,12 +107,39 @@ class Slide(models.Model):
 
     class Meta:
         ordering = ['order', '-created_at'] # Order by custom 'order', then by creation time
+        indexes = [
+            models.Index(fields=['order'], condition=Q(is_active=True), name='slide_active_order_idx'), # The slideshow
+        ]
         verbose_name = "Slide"
         verbose_name_plural = "Slides"
 
     def __str__(self):
         return self.title
 
+class OrderQuerySet(models.QuerySet):
+    # Totals recomputed in the database from OrderItem rows, one correlated subquery per
+    # column, so reconciling a batch of orders is a single statement
+    def _computed_totals(self):
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        cost = items.annotate(
+            total=Cast(Sum(F('price') * F('quantity')), DecimalField(max_digits=12, decimal_places=2))
+        ).values('total')
+        count = items.annotate(count=Sum('quantity')).values('count')
+        return {
+            'total_cost': Coalesce(Subquery(cost), Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            'item_count': Coalesce(Subquery(count), 0),
+        }
+
+    def out_of_sync(self):
+        computed = self._computed_totals()
+        return self.annotate(
+            computed_total_cost=computed['total_cost'],
+            computed_item_count=computed['item_count'],
+        ).exclude(total_cost=F('computed_total_cost'), item_count=F('computed_item_count'))
+
+    def refresh_totals(self):
+        return self.update(**self._computed_totals())
+
 # Order Model
 class Order(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='orders', null=True, blank=True)
@@ -92,16 +162,24 @@ class Order(models.Model):
         ('Cancelled', 'Cancelled'),
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    # Denormalized from the order's items: written at checkout, repaired by `manage.py reconcile_order_totals`
+    total_cost = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    item_count = models.PositiveIntegerField(default=0, help_text="Total number of units across all items.")
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created',) # Order by most recent orders
+        indexes = [
+            models.Index(fields=['user', '-created', '-id']), # A customer's order history, newest first
+        ]
 
     def __str__(self):
         return f'Order {self.id}'
 
     def get_total_cost(self):
-        # Calculate total cost by summing up cost of all order items
-        return sum(item.get_cost() for item in self.items.all())
+        # Stored total, so listing orders doesn't load every order's items
+        return self.total_cost
 
 # Order Item Model
 class OrderItem(models.Model):
@@ -135,6 +213,9 @@ class WishlistItem(models.Model):
     class Meta:
         unique_together = ('wishlist', 'product') # A product can only be in a wishlist once
         ordering = ['-added_at']
+        indexes = [
+            models.Index(fields=['wishlist', '-added_at']), # The wishlist page, newest first
+        ]
 
     def __str__(self):
         return f"{self.product.name} in {self.wishlist.user.username}'s wishlist"
@@ -150,8 +231,12 @@ class Cart(models.Model):
         return f"Cart of {self.user.username if self.user else 'Anonymous'}"
 
     def get_total_price(self):
-        # Calculate total price of all items in the cart
-        return sum(item.get_cost() for item in self.items.all())
+        # Calculate total price of all items in the cart: from prefetched items if there are
+        # any, else with one SUM query rather than loading every item
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            return sum((item.get_cost() for item in self.items.all()), Decimal('0.00'))
+        total = self.items.aggregate(total=Sum(F('price') * F('quantity')))['total']
+        return total or Decimal('0.00')
 
 # NEW: Cart Item Model
 class CartItem(models.Model):
@@ -168,3 +253,22 @@ class CartItem(models.Model):
 
     def get_cost(self):
         return self.price * self.quantity
+
+
+# A short-lived hold on stock for a cart line (see shop/reservations.py). Stock a product can
+# still promise is its stock minus the unexpired holds of every other cart.
+class StockReservation(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    holder = models.CharField(max_length=64, help_text="The cart holding the stock, e.g. cart:12.")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('holder', 'product') # One hold per cart line
+        indexes = [
+            models.Index(fields=['product', 'expires_at']), # Active holds per product
+            models.Index(fields=['expires_at']), # Sweeping expired holds
+        ]
+
+    def __str__(self):
+        return f"{self.holder}: {self.quantity} x {self.product_id} until {self.expires_at}"
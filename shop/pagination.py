@@ -0,0 +1,99 @@
+# shop/pagination.py
+
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds; a cursor needs the exact value
+    # or rows created within the same millisecond would be skipped
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    # One page of a keyset-paginated queryset. Unlike Django's Paginator this never
+    # runs a COUNT(*) or an OFFSET, so page 1 and page 10,000 cost the same.
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    # Returns the list of key values stored in the cursor, or None if the cursor is
+    # missing or garbled (a bad cursor simply starts from the first page).
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    position = []
+    for name, value in zip(ordering, values):
+        field = model._meta.get_field(name.lstrip('-'))
+        try:
+            value = field.to_python(value)
+            # Range checks too: an id too big for the column would fail in the database
+            field.run_validators(value)
+        except ValidationError:
+            return None
+        if value is None:
+            return None
+        position.append(value)
+    return position
+
+
+def _after(ordering, values):
+    # Builds "(a, b) > (x, y)" for the given ordering. The leading a >= x term is
+    # redundant logically but keeps the predicate a plain range scan on the index.
+    lookups = [('%s__lt' if field.startswith('-') else '%s__gt') % field.lstrip('-') for field in ordering]
+    first = ordering[0].lstrip('-')
+    condition = Q()
+    for i, lookup in enumerate(lookups):
+        equal = {field.lstrip('-'): value for field, value in zip(ordering[:i], values[:i])}
+        condition |= Q(**equal, **{lookup: values[i]})
+    leading = '%s__lte' % first if ordering[0].startswith('-') else '%s__gte' % first
+    return Q(**{leading: values[0]}) & condition
+
+
+def paginate_keyset(queryset, ordering, cursor=None, per_page=24):
+    # `ordering` must end in a unique column (normally 'id') so every row has a
+    # distinct position, and should match an index on the filtered queryset.
+    queryset = queryset.order_by(*ordering)
+    position = decode_cursor(cursor, queryset.model, ordering)
+    if position is not None:
+        queryset = queryset.filter(_after(ordering, position))
+
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,132 @@
+# shop/querylog.py
+
+import logging
+import re
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+# Opt-in query inspector (SHOP_QUERY_INSPECTOR = 'log' or 'raise'). Within a request, or a
+# `with inspect_queries():` block, it groups queries by fingerprint (the SQL with literals
+# and placeholders replaced by ?) and reports any fingerprint run SHOP_N_PLUS_ONE_THRESHOLD
+# or more times: usually a lazy relation loaded once per row of a loop. Each report names
+# the template line or the shop code that ran the query. Queries slower than
+# SHOP_SLOW_QUERY_MS go to the 'shop.slow_queries' logger (a rotating file, see LOGGING).
+
+logger = logging.getLogger('shop.queries')
+slow_logger = logging.getLogger('shop.slow_queries')
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+_IGNORED = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+SHOP_DIR = str(Path(__file__).resolve().parent)
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(...)', sql)  # IN lists of any length are the same query
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def query_origin():
+    # Where the running query came from: the innermost template node being rendered, else
+    # the innermost frame of shop code (other than this module)
+    frame = sys._getframe(2)
+    code_origin = None
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        if isinstance(node, Node) and getattr(node, 'token', None) is not None and node.origin is not None:
+            return f'template {node.origin.template_name or node.origin.name}, line {node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if code_origin is None and filename.startswith(SHOP_DIR) and filename != __file__:
+            code_origin = f'{Path(filename).relative_to(Path(SHOP_DIR).parent)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return code_origin or 'unknown'
+
+
+class QueryInspector:
+    def __init__(self, label=''):
+        self.label = label
+        self.threshold = settings.SHOP_N_PLUS_ONE_THRESHOLD
+        self.counts = {}
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            if duration >= settings.SHOP_SLOW_QUERY_MS:
+                slow_logger.warning('%.1f ms %s: %s %r', duration, self.label, sql, params)
+            if not sql.lstrip().upper().startswith(_IGNORED):
+                key = fingerprint(sql)
+                count = self.counts[key] = self.counts.get(key, 0) + 1
+                if count == self.threshold:
+                    # Only reported queries pay for the stack walk
+                    self.origins[key] = query_origin()
+
+    def repeated(self):
+        return [(key, count, self.origins[key]) for key, count in self.counts.items() if count >= self.threshold]
+
+    def report(self, raise_errors=False):
+        repeated = self.repeated()
+        for key, count, origin in repeated:
+            logger.warning('Possible N+1 in %s: %d x %s (from %s)', self.label, count, key, origin)
+        if repeated and raise_errors:
+            raise NPlusOneError('Possible N+1 queries in %s:\n%s' % (self.label, '\n'.join(
+                f'  {count} x {key}\n    from {origin}' for key, count, origin in repeated)))
+
+
+@contextmanager
+def inspect_queries(label='', raise_errors=True):
+    # For tests: with inspect_queries('cart page'): client.get(...)
+    inspector = QueryInspector(label)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(inspector))
+        yield inspector
+    inspector.report(raise_errors)
+
+
+class QueryInspectorMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode = settings.SHOP_QUERY_INSPECTOR
+        if mode not in ('log', 'raise'):
+            return self.get_response(request)
+        with inspect_queries(f'{request.method} {request.path}', raise_errors=mode == 'raise'):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        mode = settings.SHOP_QUERY_INSPECTOR
+        if mode not in ('log', 'raise'):
+            return await self.get_response(request)
+        with inspect_queries(f'{request.method} {request.path}', raise_errors=mode == 'raise'):
+            return await self.get_response(request)
@@ -0,0 +1,81 @@
+# shop/queryplan.py
+
+import re
+from contextlib import contextmanager
+
+from django.db import connections
+
+# Query plans for tests. capture_queries() records the SELECTs run inside it, explain() asks
+# the database how it would run one, and full_scans() picks out the plan steps that read a
+# whole table or sort rows in memory instead of walking an index. On PostgreSQL sequential
+# scans and sorts are switched off while explaining, so even tiny test tables show whether
+# an index the planner would use on a full-sized table exists.
+
+_FROM_RE = re.compile(r'\bFROM "(\w+)"')
+
+# Databases explain() can read plans from; plan tests skip on others
+SUPPORTED_VENDORS = ('postgresql', 'sqlite')
+
+
+@contextmanager
+def capture_queries(using='default'):
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(record):
+        yield queries
+
+
+def main_table(sql):
+    match = _FROM_RE.search(sql)
+    return match.group(1) if match else None
+
+
+def _postgresql_steps(node):
+    relation = node.get('Relation Name')
+    index = node.get('Index Name')
+    step = node['Node Type']
+    if index:
+        step += f' using {index}'
+    if relation:
+        step += f' on {relation}'
+    yield step
+    for child in node.get('Plans', ()):
+        yield from _postgresql_steps(child)
+
+
+def explain(sql, params=None, using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('SET enable_sort = off')
+            try:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+                cursor.execute('RESET enable_sort')
+            return list(_postgresql_steps(plan[0]['Plan']))
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)  # SQLite
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(steps, tables):
+    # The steps of a plan that read all of one of `tables`, or sort rows instead of reading
+    # them in index order
+    problems = []
+    for step in steps:
+        if step.startswith('SCAN ') and ' USING ' not in step and step.split()[1] in tables:
+            problems.append(step)  # SQLite
+        elif step.startswith('USE TEMP B-TREE FOR ORDER BY'):
+            problems.append(step)  # SQLite
+        elif step.startswith('Seq Scan on ') and step.rsplit(' ', 1)[1] in tables:
+            problems.append(step)  # PostgreSQL
+        elif step in ('Sort', 'Incremental Sort'):
+            problems.append(step)  # PostgreSQL
+    return problems
@@ -0,0 +1,120 @@
+# shop/reservations.py
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Product, StockReservation
+from .stock import load_live_stock
+
+# Cart lines hold their stock for SHOP_RESERVATION_TTL seconds, renewed whenever the line
+# changes or its cart enters checkout. A product can promise its stock minus other carts'
+# unexpired holds, so during a rush buyers are told "sold out" when adding to the cart
+# instead of at the end of checkout. Callers lock the products (select_for_update, in id
+# order) before checking and placing holds, so two carts can't both take the last unit.
+# Expired holds are ignored right away and deleted by `manage.py release_reservations`.
+# Visitors' cookie carts (shop/cart.py) hold nothing until they log in: their holder is
+# None, which hold() and release() skip.
+
+
+def cart_holder(cart):
+    # Holder name for a logged-in user's Cart
+    return f'cart:{cart.pk}'
+
+
+def reserved_by_others(product_ids, holder):
+    # {product_id: quantity held by carts other than `holder`}, from the (product, expires_at) index
+    rows = (
+        StockReservation.objects
+        .filter(product_id__in=product_ids, expires_at__gt=timezone.now())
+        .exclude(holder=holder)
+        .order_by().values('product_id')
+        .annotate(total=Sum('quantity'))
+    )
+    return {row['product_id']: row['total'] for row in rows}
+
+
+def available_stock(products, holder):
+    # {product_id: stock `holder` may still take}
+    reserved = reserved_by_others([product.id for product in products], holder)
+    return {product.id: max(product.stock - reserved.get(product.id, 0), 0) for product in products}
+
+
+def lock_products(product_ids):
+    # {product_id: product} with each product's live stock. Products with sharded stock
+    # (shop/stock.py) are read without a lock: locking their row would bring back the queue
+    # sharding removes, and their conditional shard updates can't oversell anyway.
+    products = list(Product.objects.select_for_update().filter(id__in=product_ids, stock_shards=0).order_by('id'))
+    products += Product.objects.filter(id__in=product_ids, stock_shards__gt=0)
+    return {product.id: product for product in load_live_stock(products)}
+
+
+def hold(holder, quantities):
+    # Sets holder's hold on each product to the given quantity with a fresh expiry;
+    # a quantity of 0 drops the hold
+    if holder is None:
+        return
+    expires_at = timezone.now() + timedelta(seconds=settings.SHOP_RESERVATION_TTL)
+    held = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if held:
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(holder=holder, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in held.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['holder', 'product'],
+            update_fields=['quantity', 'expires_at'],
+        )
+    dropped = quantities.keys() - held.keys()
+    if dropped:
+        release(holder, dropped)
+
+
+def _holds(holder, product_ids=None):
+    holds = StockReservation.objects.filter(holder=holder)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=product_ids)
+    return holds
+
+
+def release(holder, product_ids=None):
+    if holder is not None:
+        _holds(holder, product_ids).delete()
+
+
+async def arelease(holder, product_ids=None):
+    if holder is not None:
+        await _holds(holder, product_ids).adelete()
+
+
+def hold_cart(cart, items=None):
+    # Renews the holds on every line of a DatabaseCart or AnonymousCart (whose items() the
+    # caller may pass in), e.g. on entering checkout. Lines that no longer fit in the
+    # unreserved stock hold what is left; they are returned as [(product, available)] so
+    # the buyer can be told.
+    if items is None:
+        items = cart.items()
+    if not items:
+        return []
+    with transaction.atomic():
+        products = lock_products([item.product_id for item in items])
+        available = available_stock(list(products.values()), cart.holder)
+        hold(cart.holder, {item.product_id: min(item.quantity, available[item.product_id]) for item in items})
+    return [(products[item.product_id], available[item.product_id])
+            for item in items if item.quantity > available[item.product_id]]
+
+
+def release_expired(batch_size=1000):
+    # Deletes expired holds a batch at a time so no single statement locks many rows.
+    # Yields the number deleted per batch.
+    while True:
+        ids = list(StockReservation.objects.filter(expires_at__lte=timezone.now())
+                   .order_by('expires_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        deleted, _ = StockReservation.objects.filter(id__in=ids).delete()
+        yield deleted
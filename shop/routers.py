@@ -0,0 +1,144 @@
+# shop/routers.py
+
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.template.response import SimpleTemplateResponse
+
+# Read replicas (DATABASE_REPLICA_URLS, see settings). Views wrapped in @read_from_replica
+# (the catalog pages and order history) send their reads to a replica picked at random once
+# per request, so its pages see one replica's data; all other reads, and every write, go to
+# the primary ('default'). Replicas lag the primary a little,
+# so once a request has written, ReplicaPinMiddleware sets a cookie that keeps that visitor
+# on the primary for SHOP_REPLICA_PIN_SECONDS: they see their new order, login or review
+# straight away. Anything that asks the router for the primary counts as a write,
+# get_or_create() lookups included.
+#
+# Cached catalog pages, facets, template fragments and ETags are keyed on version tokens
+# that writes bump on the primary (shop/cache.py). A replica may not have those writes yet,
+# so what is rendered from one is served but never cached or tagged (see replica_in_use).
+
+PIN_COOKIE = 'primary_pin'
+
+_read_from_replica = ContextVar('shop_read_from_replica', default=None)  # The replica alias in use
+_request_state = ContextVar('shop_replica_state', default=None)
+
+
+class RequestState:
+    # Shared with the threads an async view runs queries in, so it is mutated, never replaced
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+def replica_aliases():
+    # Replicas that are really the primary are left out: under tests every replica mirrors
+    # the test database, and a second connection to it wouldn't see the test's transaction
+    primary = connections['default'].settings_dict
+    return [
+        alias for alias in settings.SHOP_DATABASE_REPLICAS
+        if any(connections[alias].settings_dict[key] != primary[key] for key in ('HOST', 'PORT', 'NAME'))
+    ]
+
+
+def choose_replica():
+    # The request's replica, picked on its first @read_from_replica view; outside a request
+    # (no ReplicaPinMiddleware) one per read_from_replica call
+    state = _request_state.get()
+    if state is not None and state.replica is not None:
+        return state.replica
+    replicas = replica_aliases() if settings.SHOP_DATABASE_REPLICAS else []
+    replica = random.choice(replicas) if replicas else 'default'
+    if state is not None:
+        state.replica = replica
+    return replica
+
+
+def replica_in_use():
+    # Whether reads go to a replica right now
+    replica = _read_from_replica.get()
+    if replica is None or replica == 'default':
+        return False
+    state = _request_state.get()
+    return state is None or not (state.pinned or state.wrote)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_from_replica.get() if replica_in_use() else 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema by replicating the primary
+        return db == 'default'
+
+
+def read_from_replica(view_func):
+    # Lets a sync view read from a replica. A TemplateResponse is rendered here, while the
+    # replica is still in use, rather than lazily after the view returns.
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        token = _read_from_replica.set(choose_replica())
+        try:
+            response = view_func(request, *args, **kwargs)
+            if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+                response.render()
+            return response
+        finally:
+            _read_from_replica.reset(token)
+    return wrapper
+
+
+class ReplicaPinMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.SHOP_DATABASE_REPLICAS:
+            return self.get_response(request)
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.process_response(state, response)
+
+    async def __acall__(self, request):
+        if not settings.SHOP_DATABASE_REPLICAS:
+            return await self.get_response(request)
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.process_response(state, response)
+
+    def process_response(self, state, response):
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.SHOP_REPLICA_PIN_SECONDS, httponly=True,
+                                samesite='Lax', secure=settings.SESSION_COOKIE_SECURE)
+        return response
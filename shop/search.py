@@ -0,0 +1,146 @@
+# shop/search.py
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+# Product search index, maintained next to shop_product by shop/signals.py and rebuilt by
+# `manage.py rebuild_search_index`. Only available products are indexed.
+#   SQLite:     an FTS5 virtual table (rowid = product id) ranked with bm25()
+#   PostgreSQL: a tsvector column with a GIN index ranked with ts_rank()
+# Other databases fall back to an unindexed icontains search.
+SQLITE_TABLE = 'shop_product_fts'
+POSTGRES_TABLE = 'shop_product_search'
+
+# Relative weight of each field: name, then category, then description
+SQLITE_WEIGHTS = (10.0, 1.0, 5.0)  # bm25() weights in column order: name, description, category
+
+MAX_QUERY_TERMS = 10
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5(
+        name, description, category, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+]
+POSTGRES_SCHEMA = [
+    f"""CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} (
+        product_id bigint PRIMARY KEY REFERENCES shop_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL
+    )""",
+    f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_idx ON {POSTGRES_TABLE} USING GIN (document)",
+]
+
+
+def vendor(using=None):
+    vendor = (using or connection).vendor
+    return vendor if vendor in ('sqlite', 'postgresql') else None
+
+
+def create_index(schema_editor):
+    # Called from the migration, so it works on whichever database is being migrated
+    statements = {'sqlite': SQLITE_SCHEMA, 'postgresql': POSTGRES_SCHEMA}.get(vendor(schema_editor.connection), [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_index(schema_editor):
+    table = {'sqlite': SQLITE_TABLE, 'postgresql': POSTGRES_TABLE}.get(vendor(schema_editor.connection))
+    if table:
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+def _terms(query):
+    return _TERM_RE.findall(query.lower())[:MAX_QUERY_TERMS]
+
+
+def index_products(products):
+    # (Re)indexes the given products; unavailable ones are dropped from the index.
+    # Products should come with their category loaded (select_related('category')).
+    backend = vendor()
+    if backend is None:
+        return
+    products = list(products)
+    remove_products([product.id for product in products])
+    rows = [(product.id, product.name, product.description or '', product.category.name)
+            for product in products if product.available]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.executemany(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)', rows)
+        else:
+            cursor.executemany(
+                f"""INSERT INTO {POSTGRES_TABLE} (product_id, document) VALUES (
+                    %s,
+                    setweight(to_tsvector('simple', %s), 'A') ||
+                    setweight(to_tsvector('simple', %s), 'C') ||
+                    setweight(to_tsvector('simple', %s), 'B')
+                )""", rows)
+
+
+def remove_products(product_ids):
+    backend = vendor()
+    if backend is None or not product_ids:
+        return
+    with connection.cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.executemany(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+        else:
+            cursor.execute(f'DELETE FROM {POSTGRES_TABLE} WHERE product_id = ANY(%s)', [list(product_ids)])
+
+
+def clear_index():
+    backend = vendor()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SQLITE_TABLE if backend == "sqlite" else POSTGRES_TABLE}')
+
+
+def search_product_ids(query, limit=24, offset=0):
+    # Product ids matching every term of `query` (each as a prefix), best match first
+    terms = _terms(query)
+    if not terms:
+        return []
+    backend = vendor()
+    if backend is None:
+        condition = Q()
+        for term in terms:
+            condition &= Q(name__icontains=term) | Q(description__icontains=term) | Q(category__name__icontains=term)
+        return list(Product.objects.filter(condition, available=True)
+                    .values_list('id', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        if backend == 'sqlite':
+            match = ' '.join(f'"{term}"*' for term in terms)
+            cursor.execute(
+                f"""SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s
+                    ORDER BY bm25({SQLITE_TABLE}, %s, %s, %s), rowid LIMIT %s OFFSET %s""",
+                [match, *SQLITE_WEIGHTS, limit, offset])
+        else:
+            tsquery = ' & '.join(f'{term}:*' for term in terms)
+            cursor.execute(
+                f"""SELECT product_id FROM {POSTGRES_TABLE}, to_tsquery('simple', %s) AS query
+                    WHERE document @@ query
+                    ORDER BY ts_rank(document, query) DESC, product_id LIMIT %s OFFSET %s""",
+                [tsquery, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def rebuild_index(batch_size=1000):
+    clear_index()
+    indexed = 0
+    last_pk = 0
+    while True:
+        batch = list(Product.objects.select_related('category').filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            break
+        index_products(batch)
+        indexed += sum(1 for product in batch if product.available)
+        last_pk = batch[-1].pk
+    return indexed
@@ -0,0 +1,90 @@
+# shop/sessions/cached_db.py
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+# Django's cached_db sessions (the cache in front of the django_session table) with one
+# more layer in front: a per-process LRU of recently used sessions, so a busy user's
+# requests read their session from memory. Entries are kept SHOP_SESSION_L1_TTL seconds,
+# which is also how late this worker notices a change made by another one (a logout,
+# say). Writes go through to the cache and the table as usual.
+
+
+class LocalSessionCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, session_key):
+        with self.lock:
+            entry = self.entries.get(session_key)
+            if entry is None:
+                return None
+            data, expires = entry
+            if expires < time.monotonic():
+                del self.entries[session_key]
+                return None
+            self.entries.move_to_end(session_key)
+        # Copies both ways, so a request changing its session doesn't change the cached one
+        return copy.deepcopy(data)
+
+    def set(self, session_key, data):
+        if settings.SHOP_SESSION_L1_TTL <= 0:
+            return
+        data = copy.deepcopy(data)
+        with self.lock:
+            self.entries[session_key] = (data, time.monotonic() + settings.SHOP_SESSION_L1_TTL)
+            self.entries.move_to_end(session_key)
+            while len(self.entries) > settings.SHOP_SESSION_L1_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, session_key):
+        with self.lock:
+            self.entries.pop(session_key, None)
+
+
+local_cache = LocalSessionCache()
+
+
+class SessionStore(CachedDBStore):
+    def load(self):
+        data = local_cache.get(self.session_key)
+        if data is None:
+            data = super().load()
+            # An unknown or expired key comes back empty, with session_key reset
+            if data and self.session_key:
+                local_cache.set(self.session_key, data)
+        return data
+
+    async def aload(self):
+        data = local_cache.get(self.session_key)
+        if data is None:
+            data = await super().aload()
+            if data and self.session_key:
+                local_cache.set(self.session_key, data)
+        return data
+
+    def save(self, must_create=False):
+        super().save(must_create)
+        local_cache.set(self.session_key, self._session)
+
+    async def asave(self, must_create=False):
+        await super().asave(must_create)
+        local_cache.set(self.session_key, self._session)
+
+    def delete(self, session_key=None):
+        key = self.session_key if session_key is None else session_key
+        super().delete(session_key)
+        if key:
+            local_cache.delete(key)
+
+    async def adelete(self, session_key=None):
+        key = self.session_key if session_key is None else session_key
+        await super().adelete(session_key)
+        if key:
+            local_cache.delete(key)
@@ -0,0 +1,35 @@
+# shop/sessions/cleanup.py
+
+from django.contrib.sessions.backends.base import VALID_KEY_CHARS
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+# Deleting expired sessions a batch at a time, so no single statement locks many rows or
+# holds a long transaction. Session keys are random over VALID_KEY_CHARS, so splitting
+# that alphabet into contiguous ranges gives shards of about equal size, each a range scan
+# of the primary key that separate cron jobs or workers can purge side by side.
+
+KEY_CHARS = ''.join(sorted(VALID_KEY_CHARS))
+
+
+def shard_filter(shard, shards):
+    # Lookups selecting the session keys of shard `shard` (0-based) of `shards`
+    if not 0 <= shard < shards <= len(KEY_CHARS):
+        raise ValueError(f'Shard must be in 0..{shards - 1} and shards at most {len(KEY_CHARS)}.')
+    start = shard * len(KEY_CHARS) // shards
+    end = (shard + 1) * len(KEY_CHARS) // shards
+    lookups = {'session_key__gte': KEY_CHARS[start]}
+    if end < len(KEY_CHARS):
+        lookups['session_key__lt'] = KEY_CHARS[end]
+    return lookups
+
+
+def purge_expired(batch_size=1000, shard=0, shards=1):
+    # Deletes the shard's expired sessions; yields the number deleted per batch
+    expired = Session.objects.filter(expire_date__lt=timezone.now(), **shard_filter(shard, shards)).order_by()
+    while True:
+        keys = list(expired.values_list('session_key', flat=True)[:batch_size])
+        if not keys:
+            return
+        deleted, _ = Session.objects.filter(session_key__in=keys).delete()
+        yield deleted
@@ -0,0 +1,79 @@
+# shop/sessions/hybrid.py
+
+from django.contrib.auth import SESSION_KEY
+from django.core import signing
+
+from .cached_db import SessionStore as CachedDBStore
+
+# Sessions of visitors who aren't logged in live in a signed cookie, like Django's
+# signed_cookies backend, so anonymous browsing never reads or writes the django_session
+# table. Once a session holds a logged-in user it moves into the table (behind the caches
+# of cached_db.py) under a fresh random key, where logging out or changing the password
+# really ends it. The cookie value tells the two apart: signed data contains ':' and
+# table keys never do.
+
+SALT = 'shop.sessions.hybrid'
+
+
+def is_signed(session_key):
+    return bool(session_key) and ':' in session_key
+
+
+class SessionStore(CachedDBStore):
+    def _in_table(self):
+        return SESSION_KEY in self._session
+
+    def _load_signed(self):
+        try:
+            return signing.loads(self.session_key, salt=SALT, serializer=self.serializer,
+                                 max_age=self.get_session_cookie_age())
+        except Exception:
+            # Expired, tampered with or malformed: start a new session
+            self._session_key = None
+            return {}
+
+    def _save_signed(self):
+        self._session_key = signing.dumps(self._session, salt=SALT, serializer=self.serializer, compress=True)
+
+    def load(self):
+        if is_signed(self.session_key):
+            return self._load_signed()
+        return super().load()
+
+    async def aload(self):
+        if is_signed(self.session_key):
+            return self._load_signed()
+        return await super().aload()
+
+    def create(self):
+        if self._in_table():
+            return super().create()
+        self.modified = True  # The cookie value is made on save
+
+    async def acreate(self):
+        if self._in_table():
+            return await super().acreate()
+        self.modified = True
+
+    def save(self, must_create=False):
+        if not self._in_table():
+            return self._save_signed()
+        if is_signed(self.session_key):
+            self._session_key = None  # Just logged in: the table makes up a new key
+        super().save(must_create)
+
+    async def asave(self, must_create=False):
+        if not self._in_table():
+            return self._save_signed()
+        if is_signed(self.session_key):
+            self._session_key = None
+        await super().asave(must_create)
+
+    def delete(self, session_key=None):
+        # A signed session has nothing stored server-side to delete
+        if not is_signed(self.session_key if session_key is None else session_key):
+            super().delete(session_key)
+
+    async def adelete(self, session_key=None):
+        if not is_signed(self.session_key if session_key is None else session_key):
+            await super().adelete(session_key)
@@ -0,0 +1,121 @@
+# shop/signals.py
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_version_on_commit
+from .cart import merge_anonymous_cart
+from . import facets, images, search, snapshots
+from .models import Product, Category, Slide
+
+
+# Catalog cache invalidation: any change to these models retires the cached pages and
+# fragments built from them (see shop/cache.py)
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, **kwargs):
+    bump_version_on_commit('product')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    bump_version_on_commit('category')
+
+
+@receiver([post_save, post_delete], sender=Slide)
+def invalidate_slide_cache(sender, **kwargs):
+    bump_version_on_commit('slide')
+
+
+# Move whatever a visitor put in their cookie cart into their Cart when they log in
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    if request is not None:
+        merge_anonymous_cart(request, user)
+
+
+# Keep the full-text search index in step with the catalog
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    # The category name is part of each product's document
+    if not created and not raw:
+        search.index_products(instance.products.select_related('category'))
+
+
+# Keep the precomputed facet counts in step: remember which facet row a product counted
+# towards before the save, then move it to the row it counts towards now
+@receiver(pre_save, sender=Product)
+def remember_facet_key(sender, instance, raw=False, **kwargs):
+    instance._old_facet_key = None
+    if instance.pk and not raw:
+        old = (Product.objects.filter(pk=instance.pk)
+               .values_list('category_id', 'price', 'stock', 'available').first())
+        if old:
+            instance._old_facet_key = facets.facet_key(*old)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.record_change(getattr(instance, '_old_facet_key', None), facets.product_facet_key(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_facet_count(sender, instance, **kwargs):
+    facets.record_change(facets.product_facet_key(instance), None)
+
+
+# Re-render the static snapshots showing a changed product, category or slide (see shop/snapshots.py)
+@receiver(post_save, sender=Product)
+def snapshot_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        snapshots.schedule_product(instance, getattr(instance, '_old_facet_key', None),
+                                   facets.product_facet_key(instance))
+
+
+@receiver(post_delete, sender=Product)
+def unsnapshot_product(sender, instance, **kwargs):
+    snapshots.schedule_product(instance, facets.product_facet_key(instance), None)
+
+
+@receiver(post_save, sender=Category)
+def snapshot_category(sender, instance, created, raw=False, **kwargs):
+    # Product pages show their category's name; every listing page lists the categories
+    if settings.SHOP_SNAPSHOTS and not raw:
+        product_ids = [] if created else list(instance.products.values_list('id', flat=True))
+        snapshots.schedule(product_ids=product_ids, all_listings=True)
+
+
+@receiver(post_delete, sender=Category)
+@receiver([post_save, post_delete], sender=Slide)
+def snapshot_listings(sender, **kwargs):
+    if not kwargs.get('raw'):
+        snapshots.schedule(all_listings=True)
+
+
+# Resized WebP/JPEG copies of uploaded images (see shop/images.py)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Slide)
+def make_image_renditions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.update_renditions(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Slide)
+def delete_image_renditions(sender, instance, **kwargs):
+    renditions = instance.renditions or {}
+    transaction.on_commit(lambda: images.delete_renditions(renditions))
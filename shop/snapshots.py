@@ -0,0 +1,301 @@
+# shop/snapshots.py
+
+import inspect
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections, transaction
+from django.http import Http404, HttpRequest, HttpResponse
+from django.middleware.csrf import get_token
+from django.urls import Resolver404, resolve, reverse
+
+from .cache import CSRF_PLACEHOLDER
+from .facets import facet_key, product_facet_key
+from .models import Category, Product
+
+# Static HTML snapshots of the anonymous catalog (SHOP_SNAPSHOTS): the product list, each
+# category page and each product page, pre-rendered to SHOP_SNAPSHOT_DIR. SnapshotMiddleware
+# answers anonymous GETs for those URLs from the files, so catalog traffic never reaches the
+# views. Pages with a query string (facets, cursors, infinite scroll) are still rendered.
+#
+# `manage.py snapshot_catalog` rebuilds every page over a process pool. Between rebuilds,
+# saving or deleting a Product, Category or Slide (shop/signals.py) and stock changes queue
+# the pages showing them, as a small file in SHOP_SNAPSHOT_DIR.queue once the transaction
+# commits; no page is rendered in the request that made the change. `manage.py
+# snapshot_catalog --changed` re-renders the queued pages, each once however often it was
+# queued; run it with --every to keep doing so. Snapshots live on one machine's disk: the
+# queue is drained there, and a deploy with several web servers needs each to rebuild its own.
+
+SNAPSHOT_VIEWS = ('shop:product_list', 'shop:product_list_by_category', 'shop:product_detail')
+
+_pending = threading.local()
+
+
+def page_file(match):
+    # The file a resolved catalog URL is kept in, relative to the snapshot directory
+    if match.view_name == 'shop:product_list':
+        return 'index.html'
+    if match.view_name == 'shop:product_list_by_category':
+        return os.path.join('category', f"{match.kwargs['category_slug']}.html")
+    return os.path.join('product', str(match.kwargs['id']), f"{match.kwargs['slug']}.html")
+
+
+def render_page(url):
+    # The page an anonymous visitor gets at `url`, with CSRF_PLACEHOLDER for the token,
+    # or None if there is no such page. Calls the view itself, past its caching decorators.
+    match = resolve(url)
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = url
+    request.resolver_match = match
+    request.user = AnonymousUser()
+    try:
+        response = inspect.unwrap(match.func)(request, *match.args, **match.kwargs)
+    except Http404:
+        return None
+    response.context_data['csrf_token'] = CSRF_PLACEHOLDER
+    return response.render().content
+
+
+def write_page(directory, url):
+    path = os.path.join(directory, page_file(resolve(url)))
+    content = render_page(url)
+    if content is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so the middleware never serves half a page
+    with open(f'{path}.tmp', 'wb') as file:
+        file.write(content)
+    os.replace(f'{path}.tmp', path)
+    return True
+
+
+def write_pages(directory, urls):
+    # Runs in the rebuild's worker processes
+    return sum(write_page(directory, url) for url in urls)
+
+
+def listing_urls(category_slugs=None):
+    if category_slugs is None:
+        category_slugs = Category.objects.values_list('slug', flat=True)
+    return [reverse('shop:product_list')] + [
+        reverse('shop:product_list_by_category', args=[slug]) for slug in category_slugs
+    ]
+
+
+def queue_dir():
+    return f"{settings.SHOP_SNAPSHOT_DIR.rstrip(os.sep)}.queue"
+
+
+def queued_files():
+    directory = queue_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json'))
+
+
+def rebuild(workers=None, batch_size=50):
+    # Renders every page into a new directory and swaps it in. Yields pages written so far.
+    directory = settings.SHOP_SNAPSHOT_DIR.rstrip(os.sep)
+    building, retired = f'{directory}.new', f'{directory}.old'
+    # Changes queued before the rebuild starts are in its pages
+    covered = queued_files()
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    urls = listing_urls() + [
+        reverse('shop:product_detail', args=[id, slug])
+        for id, slug in Product.objects.filter(available=True).values_list('id', 'slug').iterator()
+    ]
+    batches = [urls[start:start + batch_size] for start in range(0, len(urls), batch_size)]
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        for future in as_completed([pool.submit(write_pages, building, batch) for batch in batches]):
+            written += future.result()
+            yield written
+
+    # Two renames: the directory is missing for a moment, when requests fall through to the views
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, retired)
+    os.rename(building, directory)
+    shutil.rmtree(retired, ignore_errors=True)
+    for path in covered:
+        os.remove(path)
+
+
+def refresh(product_ids=(), category_ids=(), all_listings=False):
+    # Re-renders the given products' pages, the product list and the pages of the given
+    # categories (or all of them), in this process
+    directory = settings.SHOP_SNAPSHOT_DIR
+    if all_listings:
+        slugs = set(Category.objects.values_list('slug', flat=True))
+        # Pages of renamed or deleted categories
+        category_dir = os.path.join(directory, 'category')
+        for filename in os.listdir(category_dir) if os.path.isdir(category_dir) else ():
+            if filename.endswith('.html') and filename[:-len('.html')] not in slugs:
+                os.remove(os.path.join(category_dir, filename))
+        urls = listing_urls(slugs)
+    elif category_ids:
+        urls = listing_urls(Category.objects.filter(id__in=category_ids).values_list('slug', flat=True))
+    else:
+        urls = []
+
+    # A product's page goes if it changed slug or became unavailable
+    for product_id in product_ids:
+        shutil.rmtree(os.path.join(directory, 'product', str(product_id)), ignore_errors=True)
+    urls += [
+        reverse('shop:product_detail', args=[id, slug])
+        for id, slug in Product.objects.filter(id__in=product_ids, available=True).values_list('id', 'slug')
+    ]
+    for url in urls:
+        write_page(directory, url)
+
+
+def refresh_queued():
+    # Re-renders the pages queued by schedule(), merged; returns how many changes that was.
+    # Pages are replaced whole, so overlapping runs only do some work twice.
+    paths = queued_files()
+    products, categories, all_listings = set(), set(), False
+    for path in paths:
+        try:
+            with open(path) as file:
+                work = json.load(file)
+        except (OSError, ValueError):
+            continue
+        products.update(work['products'])
+        categories.update(work['categories'])
+        all_listings |= work['all_listings']
+    if paths:
+        refresh(products, categories, all_listings)
+    for path in paths:
+        os.remove(path)
+    return len(paths)
+
+
+def _flush():
+    pending = getattr(_pending, 'work', None)
+    _pending.work = None
+    if pending is None:
+        return
+    directory = queue_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{time.time_ns()}-{uuid.uuid4().hex}.json')
+    # Write then rename, so refresh_queued() never reads half an entry
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump({
+            'products': sorted(pending['products']),
+            'categories': sorted(pending['categories']),
+            'all_listings': pending['all_listings'],
+        }, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def schedule(product_ids=(), category_ids=(), all_listings=False):
+    # Queues pages for refresh_queued() once the transaction commits. Changes within one
+    # transaction make one entry; any left by a rollback go in the next one and just render again.
+    if not settings.SHOP_SNAPSHOTS:
+        return
+    pending = getattr(_pending, 'work', None)
+    if pending is None:
+        pending = _pending.work = {'products': set(), 'categories': set(), 'all_listings': False}
+    pending['products'].update(product_ids)
+    pending['categories'].update(category_ids)
+    pending['all_listings'] |= all_listings
+    transaction.on_commit(_flush, robust=True)  # A failed write is logged, not raised
+
+
+def schedule_product(product, old_key, new_key):
+    # For a product whose facet key (shop/facets.py) went from old_key to new_key. Its card
+    # may be on the product list and its categories' pages; when it joins or leaves a
+    # category's count, every listing page's category facet changes.
+    if old_key is None and new_key is None:
+        schedule(product_ids=[product.pk])
+    elif old_key is None or new_key is None or old_key[0] != new_key[0]:
+        schedule(product_ids=[product.pk], all_listings=True)
+    else:
+        schedule(product_ids=[product.pk], category_ids=[product.category_id])
+
+
+def schedule_stock_changes(products, new_stock):
+    # For bulk stock updates that bypass post_save, like facets.record_stock_changes().
+    # Pages show no stock counts, so only products that sell out or come back change them.
+    for product in products:
+        old_key = product_facet_key(product)
+        new_key = facet_key(product.category_id, product.price, new_stock[product.pk], product.available)
+        if old_key != new_key:
+            schedule_product(product, old_key, new_key)
+
+
+def snapshot_path(request):
+    # The snapshot file for a request, if it is one snapshots answer
+    if request.method != 'GET' or request.GET:
+        return None
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    if match.view_name not in SNAPSHOT_VIEWS:
+        return None
+    request.resolver_match = match
+    return os.path.join(settings.SHOP_SNAPSHOT_DIR, page_file(match))
+
+
+def snapshot_response(request, path):
+    try:
+        with open(path, 'rb') as file:
+            content = file.read()
+    except FileNotFoundError:
+        return None
+    return HttpResponse(content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode()))
+
+
+class SnapshotMiddleware:
+    # Serves snapshots to visitors who aren't logged in and have no flash messages waiting.
+    # Goes after MessageMiddleware; CsrfViewMiddleware sets the cookie for the token swapped in.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        path = snapshot_path(request) if settings.SHOP_SNAPSHOTS else None
+        if path:
+            response = self.serve(request, path)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        path = snapshot_path(request) if settings.SHOP_SNAPSHOTS else None
+        if path:
+            # The user and any messages may come from the session, which is read synchronously
+            response = await sync_to_async(self.serve)(request, path)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def serve(self, request, path):
+        if request.user.is_authenticated or len(messages.get_messages(request)):
+            return None
+        return snapshot_response(request, path)
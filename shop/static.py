@@ -0,0 +1,54 @@
+# shop/static.py
+
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    # WhiteNoise's hashed and compressed storage. A file missing from the manifest (e.g.
+    # before `manage.py build_assets` and `manage.py collectstatic`) fails the page with a
+    # 500, as in Django, when SHOP_STATIC_MANIFEST_STRICT is set, so development and CI
+    # catch it. Otherwise it gets its plain URL and an error is logged: the page comes
+    # without its stylesheet and scripts, but it is still served.
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError as error:
+            if settings.SHOP_STATIC_MANIFEST_STRICT:
+                raise
+            logger.error("%s Run `manage.py build_assets` and `manage.py collectstatic`.", error)
+            return name
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    # WhiteNoise's middleware is sync only, so under ASGI Django would run every request
+    # through a thread to get past it. This one serves static files the same way but lets
+    # everything else stay on the event loop; under WSGI it is plain WhiteNoise.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
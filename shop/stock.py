@@ -0,0 +1,102 @@
+# shop/stock.py
+
+import random
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .cache import bump_version_on_commit
+from .facets import record_stock_changes
+from .models import Product, StockShard
+from .snapshots import schedule_stock_changes
+
+# Sharded stock for hot products. Every checkout of a product normally updates its one
+# Product row, so during a sale checkouts of a best-seller queue on that row lock. With
+# Product.stock_shards = N its stock is split over N StockShard rows instead: a checkout
+# takes its quantity from a shard picked at random, so up to N of them proceed at once.
+#
+# The shards are the truth; Product.stock is a cached total for templates, listings and
+# facets. It is written when a product runs out, by set_stock() and by
+# `manage.py rebalance_stock`, which also evens out the shards so any one of them can
+# usually cover a checkout alone.
+
+
+def split(total, shards):
+    # `total` spread as evenly as possible over `shards` counters
+    share, extra = divmod(total, shards)
+    return [share + (1 if index < extra else 0) for index in range(shards)]
+
+
+def load_live_stock(products):
+    # Replaces the cached stock of sharded products with their shard total, in one query
+    sharded = [product for product in products if product.stock_shards]
+    if sharded:
+        totals = dict(
+            StockShard.objects.filter(product__in=sharded).order_by()
+            .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        for product in sharded:
+            product.stock = totals.get(product.id) or 0
+    return products
+
+
+def set_stock(product, total=None):
+    # Lays `total` (default: the live total) out over product.stock_shards counters, or
+    # folds the shards back into Product.stock when stock_shards is 0. `product` should
+    # hold the stock currently saved in its row.
+    with transaction.atomic():
+        shards = list(StockShard.objects.select_for_update().filter(product=product).order_by('index'))
+        if total is None:
+            total = sum(shard.quantity for shard in shards) if shards else product.stock
+        StockShard.objects.filter(product=product, index__gte=product.stock_shards).delete()
+        if product.stock_shards:
+            StockShard.objects.bulk_create(
+                [
+                    StockShard(product=product, index=index, quantity=quantity)
+                    for index, quantity in enumerate(split(total, product.stock_shards))
+                ],
+                update_conflicts=True,
+                unique_fields=['product', 'index'],
+                update_fields=['quantity'],
+            )
+        if total != product.stock:
+            Product.objects.filter(pk=product.pk).update(stock=total, updated=timezone.now())  # update() skips auto_now
+            record_stock_changes([product], {product.pk: total})
+            schedule_stock_changes([product], {product.pk: total})
+            bump_version_on_commit('product')
+            product.stock = total
+    return total
+
+
+def take(product, quantity):
+    # Removes `quantity` from a sharded product's stock, raising ValueError if there isn't
+    # enough. Call inside a transaction. Returns the stock left.
+    shards = product.stock_shards
+    start = random.randrange(shards)
+    for offset in range(shards):
+        index = (start + offset) % shards
+        # Conditional, so a shard never goes negative and no lock is held while choosing
+        if StockShard.objects.filter(product=product, index=index, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity):
+            break
+    else:
+        # No single shard has enough (rebalancing keeps this rare): lock them all and
+        # take what each has
+        counters = list(StockShard.objects.select_for_update().filter(product=product).order_by('index'))
+        if sum(counter.quantity for counter in counters) < quantity:
+            raise ValueError(f"Not enough stock for {product.name}.")
+        remaining = quantity
+        for counter in counters:
+            taken = min(counter.quantity, remaining)
+            if taken:
+                StockShard.objects.filter(pk=counter.pk).update(quantity=F('quantity') - taken)
+                remaining -= taken
+            if not remaining:
+                break
+
+    left = StockShard.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+    if not left:
+        # Sold out: the cached total must say so for listings and "Out of Stock" buttons
+        Product.objects.filter(pk=product.pk).update(stock=0, updated=timezone.now())
+    return left
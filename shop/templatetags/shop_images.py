@@ -0,0 +1,32 @@
+# shop/templatetags/shop_images.py
+
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+def _srcset(variants):
+    return ', '.join(f'{default_storage.url(name)} {width}w' for name, width in variants)
+
+
+@register.simple_tag
+def picture(instance, spec, alt='', css_class='', placeholder='', sizes=None, loading='lazy'):
+    # {% picture product 'card' alt=product.name css_class='w-full h-48 object-cover' %}
+    # A <picture> with WebP and JPEG/PNG srcsets from instance.renditions (see shop/images.py).
+    # Objects without renditions yet get their original image, then `placeholder`.
+    rendition = (instance.renditions or {}).get(spec) if instance else None
+    if not rendition or not rendition['fallback']:
+        src = instance.image.url if instance and instance.image else placeholder
+        return format_html('<img src="{}" alt="{}" class="{}" loading="{}">', src, alt, css_class, loading)
+
+    sizes = sizes or f"{rendition['width']}px"
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" loading="{}" decoding="async">'
+        '</picture>',
+        _srcset(rendition['webp']), sizes,
+        default_storage.url(rendition['fallback'][0][0]), _srcset(rendition['fallback']), sizes,
+        rendition['width'], rendition['height'], alt, css_class, loading,
+    )
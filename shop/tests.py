@@ -1,3 +1,1453 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, login, logout
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import facets, images, metrics, reservations, search, snapshots, stock
+from .cache import CSRF_PLACEHOLDER, bump_version, get_versions
+from .cart import ANONYMOUS_CART_COOKIE, AnonymousCart
+from .checkout import place_order
+from .models import (
+    Cart, CartItem, Category, CustomUser, Order, OrderItem, Product, ProductFacetCount, Slide, StockReservation,
+    StockShard, Wishlist, WishlistItem,
+)
+from .pagination import encode_cursor
+from .querylog import NPlusOneError, inspect_queries
+from .queryplan import SUPPORTED_VENDORS, capture_queries, explain, full_scans, main_table
+from .routers import PIN_COOKIE, ReplicaRouter, RequestState, _request_state, read_from_replica
+from .sessions.cleanup import KEY_CHARS, purge_expired, shard_filter
+from .sessions.hybrid import SessionStore as HybridSessionStore
+
+SHIPPING = {
+    'first_name': 'Test', 'last_name': 'Customer', 'email': 'test@example.com',
+    'address': '1 Test Road', 'postal_code': '1000', 'city': 'Dhaka',
+}
+
+# Static file URLs without the manifest collectstatic writes, for every test: pages render
+# them, and WhiteNoise looks up every collected file each time a test client starts
+PLAIN_STATIC_FILES = override_settings(STORAGES={
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+# MetricsMiddleware records every test request; its files go here rather than into the checkout
+METRICS_DIR = override_settings(
+    SHOP_METRICS_DIR=os.path.join(tempfile.gettempdir(), f'myshop-test-metrics-{os.getpid()}'))
+
+
+def setUpModule():
+    PLAIN_STATIC_FILES.enable()
+    METRICS_DIR.enable()
+
+
+def tearDownModule():
+    METRICS_DIR.disable()
+    PLAIN_STATIC_FILES.disable()
+    shutil.rmtree(METRICS_DIR.options['SHOP_METRICS_DIR'], ignore_errors=True)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        cls.product = Product.objects.create(category=category, name='Last one', slug='last-one',
+                                             price=Decimal('10.00'), stock=1)
+        cls.users = [CustomUser.objects.create_user(f'customer{i}', password='password') for i in range(2)]
+
+    def cart_for(self, user):
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, price=self.product.price, quantity=1)
+        return cart
+
+    def assertSoldOnce(self, losing_cart):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        # The losing checkout is rolled back whole, leaving the customer's cart as it was
+        self.assertTrue(losing_cart.items.exists())
+
+    def test_competing_checkouts_sell_the_last_unit_once(self):
+        first, second = (self.cart_for(user) for user in self.users)
+        place_order(first, self.users[0], SHIPPING)
+        with self.assertRaisesMessage(ValueError, 'Not enough stock for Last one'):
+            place_order(second, self.users[1], SHIPPING)
+        self.assertSoldOnce(second)
+
+    def test_short_row_count_rolls_back(self):
+        # The second checkout read the stock before the first one's UPDATE, as it can on a
+        # database without row locks, so its own conditional UPDATE matches no row
+        first, second = (self.cart_for(user) for user in self.users)
+        stale = Product.objects.get(pk=self.product.pk)
+        place_order(first, self.users[0], SHIPPING)
+        with mock.patch('shop.reservations.lock_products', return_value={stale.id: stale}), \
+                self.assertRaisesMessage(ValueError, 'just sold out'):
+            place_order(second, self.users[1], SHIPPING)
+        self.assertSoldOnce(second)
+
+    def test_only_selling_out_retires_cached_pages(self):
+        category = Category.objects.get()
+        plenty = Product.objects.create(category=category, name='Plenty', slug='plenty', price=Decimal('5.00'), stock=5)
+        cart = Cart.objects.create(user=self.users[0])
+        CartItem.objects.create(cart=cart, product=plenty, price=plenty.price, quantity=2)
+        versions = get_versions('product')
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(cart, self.users[0], SHIPPING)
+        self.assertEqual(get_versions('product'), versions)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.cart_for(self.users[1]), self.users[1], SHIPPING)
+        self.assertNotEqual(get_versions('product'), versions)
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        cls.products = [
+            Product.objects.create(category=category, name=f'Product {i}', slug=f'product-{i}',
+                                   price=Decimal(price), stock=10)
+            for i, price in enumerate(('10.50', '3.25'))
+        ]
+        cls.user = CustomUser.objects.create_superuser(username='admin', password='password',
+                                                       email='admin@example.com')
+
+    def place(self):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        for quantity, product in enumerate(self.products, start=2):
+            CartItem.objects.create(cart=cart, product=product, price=product.price, quantity=quantity)
+        return place_order(cart, self.user, SHIPPING)
+
+    def assertTotalsMatchItems(self, order, total_cost, item_count):
+        order.refresh_from_db()
+        self.assertEqual((order.total_cost, order.item_count), (Decimal(total_cost), item_count))
+        self.assertFalse(Order.objects.out_of_sync().exists())
+
+    def test_checkout_stores_the_item_totals(self):
+        # 2 x 10.50 + 3 x 3.25
+        self.assertTotalsMatchItems(self.place(), '30.75', 5)
+
+    def test_admin_item_edit_refreshes_totals(self):
+        order = self.place()
+        first, second = order.items.order_by('id')
+        self.client.force_login(self.user)
+        data = {
+            **SHIPPING, 'user': self.user.id, 'status': 'Pending',
+            'items-TOTAL_FORMS': 3, 'items-INITIAL_FORMS': 2, 'items-MIN_NUM_FORMS': 0, 'items-MAX_NUM_FORMS': 1000,
+            # The first line goes up to 4, the second is deleted and a new one added
+            'items-0-id': first.id, 'items-0-order': order.id, 'items-0-product': first.product_id,
+            'items-0-price': first.price, 'items-0-quantity': 4,
+            'items-1-id': second.id, 'items-1-order': order.id, 'items-1-product': second.product_id,
+            'items-1-price': second.price, 'items-1-quantity': second.quantity, 'items-1-DELETE': 'on',
+            'items-2-order': order.id, 'items-2-product': second.product_id,
+            'items-2-price': '1.00', 'items-2-quantity': 1,
+        }
+        response = self.client.post(reverse('admin:shop_order_change', args=[order.id]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertTotalsMatchItems(order, '43.00', 5)
+
+    def test_reconcile_fixes_drifted_rows(self):
+        order, other = self.place(), self.place()
+        Order.objects.filter(id=order.id).update(total_cost=Decimal('1.00'), item_count=99)
+        out = StringIO()
+        call_command('reconcile_order_totals', '--dry-run', stdout=out)
+        self.assertIn('1 order(s) have stale totals', out.getvalue())
+        call_command('reconcile_order_totals', '--batch-size', 1, stdout=StringIO())
+        self.assertTotalsMatchItems(order, '30.75', 5)
+        self.assertTotalsMatchItems(other, '30.75', 5)
+
+
+class AnonymousCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        cls.products = [
+            Product.objects.create(category=category, name=f'Product {i}', slug=f'product-{i}',
+                                   price=Decimal('10.00'), stock=stock)
+            for i, stock in enumerate([5, 3, 0])
+        ]
+        cls.user = CustomUser.objects.create_user('customer', password='password')
+
+    def request_with_cart(self, lines=None, cookie=None):
+        if cookie is None:
+            cart = AnonymousCart(RequestFactory().get('/'))
+            cart.lines = lines
+            response = HttpResponse()
+            cart.update_response(response)
+            cookie = response.cookies[ANONYMOUS_CART_COOKIE].value
+        request = RequestFactory().get('/')
+        request.COOKIES[ANONYMOUS_CART_COOKIE] = cookie
+        return request
+
+    def test_adding_writes_nothing(self):
+        # JSON callers get the message in the reply, others a cookie-stored flash message.
+        # No session, and no stock reservation either: cookie carts hold stock from login.
+        for headers in ({'HTTP_ACCEPT': 'application/json'}, {}):
+            with self.subTest(headers=headers), CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('shop:cart_add', args=[self.products[0].id]), **headers)
+            self.assertEqual(response.json()['status'], 'success')
+            self.assertFalse([query for query in queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))])
+        lines = AnonymousCart(self.request_with_cart(cookie=self.client.cookies[ANONYMOUS_CART_COOKIE].value)).lines
+        self.assertEqual(lines, {self.products[0].id: (2, Decimal('10.00'))})
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_adding_respects_other_carts_holds(self):
+        product = self.products[1]
+        reservations.hold('cart:other', {product.id: 2})
+        url = reverse('shop:cart_add', args=[product.id])
+        response = self.client.post(url, {'quantity': 2}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertIn('Available: 1', response.json()['message'])
+        self.assertEqual(self.client.post(url, HTTP_ACCEPT='application/json').json()['status'], 'success')
+
+    def test_tampered_cookie_is_ignored(self):
+        cookie = self.request_with_cart({self.products[0].id: (2, Decimal('10.00'))}).COOKIES[ANONYMOUS_CART_COOKIE]
+        self.assertEqual(AnonymousCart(self.request_with_cart(cookie=cookie)).lines,
+                         {self.products[0].id: (2, Decimal('10.00'))})
+        tampered = cookie.replace('"10.00"', '"0.01"')
+        self.assertNotEqual(tampered, cookie)
+        self.assertEqual(AnonymousCart(self.request_with_cart(cookie=tampered)).lines, {})
+        self.assertEqual(AnonymousCart(self.request_with_cart(cookie='not-signed')).lines, {})
+
+    def test_summary_runs_no_queries(self):
+        request = self.request_with_cart({
+            self.products[0].id: (2, Decimal('10.00')), self.products[1].id: (1, Decimal('2.50')),
+        })
+        self.client.cookies[ANONYMOUS_CART_COOKIE] = request.COOKIES[ANONYMOUS_CART_COOKIE]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shop:cart_summary'))
+        self.assertEqual(len(queries), 0, [query['sql'] for query in queries])
+        self.assertEqual(response.json(), {'status': 'success', 'line_count': 2, 'item_count': 3, 'total_price': '22.50'})
+
+    @override_settings(SHOP_ANONYMOUS_CART_MAX_LINES=1)
+    def test_max_lines(self):
+        url = reverse('shop:cart_add', args=[self.products[0].id])
+        self.assertEqual(self.client.post(url, HTTP_ACCEPT='application/json').json()['status'], 'success')
+        # More of a product already in the cart is fine, another product is not
+        self.assertEqual(self.client.post(url, HTTP_ACCEPT='application/json').json()['status'], 'success')
+        response = self.client.post(reverse('shop:cart_add', args=[self.products[1].id]), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertIn('Your cart is full', response.json()['message'])
+        self.assertNotIn(self.products[1].id, StockReservation.objects.values_list('product_id', flat=True))
+
+    def test_merged_on_login(self):
+        first, second, sold_out = self.products
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=first, price=Decimal('8.00'), quantity=1)
+        request = self.request_with_cart({
+            first.id: (2, Decimal('10.00')), second.id: (10, Decimal('10.00')), sold_out.id: (1, Decimal('10.00')),
+        })
+        with CaptureQueriesContext(connection) as queries:
+            user_logged_in.send(sender=CustomUser, request=request, user=self.user)
+        cart_writes = [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))
+                       and '"shop_cartitem"' in query['sql']]
+        self.assertEqual(len(cart_writes), 1)
+        # Quantities add up and keep the price already in the Cart, capped at the stock;
+        # sold out products are dropped
+        self.assertEqual(
+            {item.product_id: (item.quantity, item.price) for item in cart.items.all()},
+            {first.id: (3, Decimal('8.00')), second.id: (3, Decimal('10.00'))},
+        )
+        self.assertEqual(dict(StockReservation.objects.values_list('product_id', 'quantity')),
+                         {first.id: 3, second.id: 3})
+        self.assertFalse(StockReservation.objects.exclude(holder=f'cart:{cart.pk}').exists())
+        self.assertEqual(request._anonymous_cart.lines, {})
+
+
+class ReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        cls.product = Product.objects.create(category=category, name='Product', slug='product',
+                                             price=Decimal('10.00'), stock=10)
+        cls.user = CustomUser.objects.create_user('customer', password='password')
+
+    def test_available_stock_excludes_other_holders(self):
+        reservations.hold('cart:1', {self.product.id: 3})
+        reservations.hold('cart:2', {self.product.id: 4})
+        StockReservation.objects.create(product=self.product, holder='cart:3', quantity=2,
+                                        expires_at=timezone.now() - timedelta(seconds=1))
+        # A holder's own hold and expired holds don't count against it
+        self.assertEqual(reservations.available_stock([self.product], 'cart:1'), {self.product.id: 6})
+        self.assertEqual(reservations.available_stock([self.product], 'cart:4'), {self.product.id: 3})
+        reservations.hold('cart:2', {self.product.id: 0})
+        self.assertEqual(reservations.available_stock([self.product], 'cart:4'), {self.product.id: 7})
+
+    def test_release_expired(self):
+        now = timezone.now()
+        for holder, expires_at in (('cart:1', now - timedelta(hours=1)), ('cart:2', now - timedelta(seconds=1)),
+                                   ('cart:3', now + timedelta(minutes=5))):
+            StockReservation.objects.create(product=self.product, holder=holder, quantity=1, expires_at=expires_at)
+        self.assertEqual(list(reservations.release_expired(batch_size=1)), [1, 1])
+        self.assertEqual(list(StockReservation.objects.values_list('holder', flat=True)), ['cart:3'])
+
+    def test_checkout_releases_holds(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, price=self.product.price, quantity=2)
+        holder = reservations.cart_holder(cart)
+        reservations.hold(holder, {self.product.id: 2})
+        reservations.hold('cart:other', {self.product.id: 8})
+        place_order(cart, self.user, SHIPPING)
+        self.assertEqual(list(StockReservation.objects.values_list('holder', flat=True)), ['cart:other'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+
+class StockShardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        cls.product = Product.objects.create(category=category, name='Product', slug='product',
+                                             price=Decimal('10.00'), stock=10)
+
+    def set_shards(self, shards):
+        self.product.stock_shards = shards
+        self.product.save(update_fields=['stock_shards'])
+        return stock.set_stock(self.product)
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by('index').values_list('quantity', flat=True))
+
+    def test_set_stock_lays_out_and_folds(self):
+        self.assertEqual(self.set_shards(3), 10)
+        self.assertEqual(self.shards(), [4, 3, 3])
+        self.assertEqual(self.set_shards(2), 10)
+        self.assertEqual(self.shards(), [5, 5])
+        self.assertEqual(stock.set_stock(self.product, 7), 7)
+        self.assertEqual(self.shards(), [4, 3])
+        self.assertEqual(self.set_shards(0), 7)
+        self.assertEqual(self.shards(), [])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+
+    def test_take_from_one_shard(self):
+        self.set_shards(3)
+        with mock.patch('shop.stock.random.randrange', return_value=1):
+            self.assertEqual(stock.take(self.product, 2), 8)
+        self.assertEqual(self.shards(), [4, 1, 3])
+
+    def test_take_across_shards(self):
+        self.set_shards(3)
+        StockShard.objects.filter(product=self.product, index=0).update(quantity=2)
+        # No shard holds 5, so the fallback locks them all and takes 2 + 3
+        self.assertEqual(stock.take(self.product, 5), 3)
+        self.assertEqual(self.shards(), [0, 0, 3])
+        with self.assertRaisesMessage(ValueError, 'Not enough stock for Product'):
+            stock.take(self.product, 4)
+        self.assertEqual(self.shards(), [0, 0, 3])
+        self.assertEqual(stock.take(self.product, 3), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+    def test_product_page_reads_live_stock(self):
+        self.set_shards(2)
+        StockShard.objects.filter(product=self.product).update(quantity=0)
+        response = self.client.get(self.product.get_absolute_url())
+        self.assertContains(response, 'Currently Out of Stock')
+        StockShard.objects.filter(product=self.product, index=0).update(quantity=3)
+        cache.clear()
+        response = self.client.get(self.product.get_absolute_url())
+        self.assertContains(response, 'In Stock')
+        self.assertNotContains(response, 'available)')
+
+    def test_rebalance_stock(self):
+        self.set_shards(2)
+        StockShard.objects.filter(product=self.product, index=0).update(quantity=0)
+        out = StringIO()
+        call_command('rebalance_stock', stdout=out)
+        self.assertIn('Product: 10 -> 5', out.getvalue())
+        self.assertEqual(self.shards(), [3, 2])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        stock.take(self.product, 1)
+        # The cached total lags behind until the next rebalance; load_live_stock reads the shards
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertEqual(stock.load_live_stock([self.product])[0].stock, 4)
+
+
+@override_settings(SESSION_ENGINE='shop.sessions.hybrid')
+class HybridSessionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('customer', password='password')
+
+    def anonymous_session(self):
+        session = HybridSessionStore()
+        session['recently_viewed'] = [1, 2]
+        session.save()
+        return session.session_key
+
+    def test_anonymous_sessions_stay_in_the_cookie(self):
+        with CaptureQueriesContext(connection) as queries:
+            key = self.anonymous_session()
+            self.assertEqual(HybridSessionStore(key)['recently_viewed'], [1, 2])
+        self.assertEqual(len(queries), 0)
+        self.assertFalse(Session.objects.exists())
+
+    def test_login_moves_to_a_fresh_table_key_and_logout_ends_it(self):
+        key = self.anonymous_session()
+        request = RequestFactory().get('/')
+        request.session = HybridSessionStore(key)
+        login(request, self.user, backend='django.contrib.auth.backends.ModelBackend')
+        request.session.save()
+        table_key = request.session.session_key
+        self.assertNotIn(':', table_key)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [table_key])
+        self.assertEqual(HybridSessionStore(table_key)['recently_viewed'], [1, 2])
+
+        logout(request)
+        self.assertFalse(Session.objects.exists())
+        self.assertNotIn(SESSION_KEY, HybridSessionStore(table_key).load())
+
+    def test_tampered_cookie_is_rejected(self):
+        key = self.anonymous_session()
+        session = HybridSessionStore(key[:-1] + ('A' if key[-1] != 'A' else 'B'))
+        self.assertEqual(session.load(), {})
+        self.assertIsNone(session.session_key)
+
+
+class PurgeSessionsTests(TestCase):
+    def test_shards_split_the_keys_at_their_boundaries(self):
+        now = timezone.now()
+        middle = KEY_CHARS[len(KEY_CHARS) // 2]
+        keys = [KEY_CHARS[0] * 32, KEY_CHARS[len(KEY_CHARS) // 2 - 1] + 'z' * 31, middle * 32, KEY_CHARS[-1] * 32]
+        Session.objects.bulk_create([
+            Session(session_key=key, session_data='', expire_date=now - timedelta(days=1)) for key in keys
+        ] + [Session(session_key=middle + 'live', session_data='', expire_date=now + timedelta(days=1))])
+
+        self.assertEqual(shard_filter(0, 2), {'session_key__gte': KEY_CHARS[0], 'session_key__lt': middle})
+        self.assertEqual(shard_filter(1, 2), {'session_key__gte': middle})
+        self.assertEqual(list(purge_expired(batch_size=1, shard=0, shards=2)), [1, 1])
+        self.assertEqual(set(Session.objects.values_list('session_key', flat=True)), {keys[2], keys[3], middle + 'live'})
+        self.assertEqual(sum(purge_expired(shard=1, shards=2)), 2)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [middle + 'live'])
+        with self.assertRaises(ValueError):
+            list(purge_expired(shard=2, shards=2))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        overrides = override_settings(SHOP_METRICS_DIR=directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def write_worker(self, pid, age=0):
+        path = os.path.join(settings.SHOP_METRICS_DIR, f'{pid}.json')
+        with open(path, 'w') as file:
+            json.dump({'views': {'shop:cart_view GET': {
+                'count': 1, 'duration_sum': 0.1, 'duration_buckets': [], 'queries': 2, 'query_buckets': [],
+                'db_time': 0.01, 'template_time': 0.02, 'statuses': {'200': 1},
+            }}, 'pools': {'default': {'pool_size': 4, 'requests_num': 10}}}, file)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_exited_workers(self):
+        running, exited, expired = 100001, 100002, 100003
+        self.write_worker(running)
+        self.write_worker(exited, age=60)
+        expired_path = self.write_worker(expired, age=settings.SHOP_METRICS_RETENTION + 1)
+        # A fresh registry, so this process's own file adds nothing
+        with mock.patch('shop.metrics.registry', metrics.Registry()), \
+                mock.patch('shop.metrics.is_running', lambda pid: pid in (running, os.getpid())):
+            collected = metrics.collect()
+        # Counters keep the exited worker's totals, gauges only count running workers
+        self.assertEqual(collected['views']['shop:cart_view GET']['count'], 2)
+        self.assertEqual(collected['pools']['default'], {'pool_size': 4, 'requests_num': 20})
+        self.assertFalse(os.path.exists(expired_path))
+
+    def test_endpoint(self):
+        category = Category.objects.create(name='Category', slug='category')
+        Product.objects.create(category=category, name='Product', slug='product', price=Decimal('10.00'), stock=1)
+        staff = CustomUser.objects.create_user('staff', password='password', is_staff=True)
+        with mock.patch('shop.metrics.registry', metrics.Registry()):
+            self.assertEqual(self.client.get(reverse('shop:product_list')).status_code, 200)
+            # Staff only
+            self.assertEqual(self.client.get(reverse('shop:metrics')).status_code, 302)
+            self.client.force_login(staff)
+            response = self.client.get(reverse('shop:metrics'))
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        labels = 'view="shop:product_list",method="GET"'
+        self.assertEqual(samples[f'shop_request_duration_seconds_bucket{{{labels},le="+Inf"}}'], 1)
+        self.assertEqual(samples[f'shop_request_duration_seconds_count{{{labels}}}'], 1)
+        self.assertGreater(samples[f'shop_request_duration_seconds_sum{{{labels}}}'], 0)
+        self.assertEqual(samples[f'shop_requests_total{{{labels},status="200"}}'], 1)
+        self.assertGreater(samples[f'shop_db_queries_per_request_sum{{{labels}}}'], 0)
+        self.assertGreater(samples[f'shop_template_render_seconds_total{{{labels}}}'], 0)
+        # The template time is part of the request's
+        self.assertLess(samples[f'shop_template_render_seconds_total{{{labels}}}'],
+                        samples[f'shop_request_duration_seconds_sum{{{labels}}}'])
+        # The redirect of the anonymous request counts too, under its own status
+        self.assertEqual(samples['shop_requests_total{view="shop:metrics",method="GET",status="302"}'], 1)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        phones = Category.objects.create(name='Phones', slug='phones')
+        kitchen = Category.objects.create(name='Kitchen', slug='kitchen')
+        cls.galaxy = Product.objects.create(category=phones, name='Galaxy Phone', slug='galaxy',
+                                            description='A smartphone.', price=Decimal('500.00'), stock=5)
+        cls.case = Product.objects.create(category=phones, name='Phone Case', slug='case',
+                                          description='Fits the Galaxy.', price=Decimal('10.00'), stock=5)
+        cls.kettle = Product.objects.create(category=kitchen, name='Kettle', slug='kettle',
+                                            description='Boils water while you are on the phone.',
+                                            price=Decimal('30.00'), stock=5)
+        Product.objects.create(category=phones, name='Old Phone', slug='old', description='Retired.',
+                               price=Decimal('5.00'), stock=5, available=False)
+        cls.user = CustomUser.objects.create_user('customer', password='password')
+
+    def setUp(self):
+        if search.vendor() != 'sqlite':
+            self.skipTest('Ranking is checked on the SQLite index')
+
+    def test_matching_and_ranking(self):
+        # Name matches rank above description matches; unavailable products aren't indexed
+        ids = search.search_product_ids('phone')
+        self.assertEqual(set(ids[:2]), {self.galaxy.id, self.case.id})
+        self.assertEqual(ids[2:], [self.kettle.id])
+        # Every term must match, each as a prefix; category names count too
+        self.assertEqual(search.search_product_ids('gal pho'), [self.galaxy.id, self.case.id])
+        self.assertEqual(search.search_product_ids('kitchen'), [self.kettle.id])
+        self.assertEqual(search.search_product_ids('"; DROP'), [])
+        self.assertEqual(search.search_product_ids('  '), [])
+        self.assertEqual(search.search_product_ids('phone', limit=1, offset=2), [self.kettle.id])
+
+    def test_index_follows_changes(self):
+        self.galaxy.name = 'Nebula'
+        self.galaxy.save()
+        self.assertEqual(search.search_product_ids('nebula'), [self.galaxy.id])
+        self.assertEqual(search.search_product_ids('galaxy'), [self.case.id])
+        self.case.available = False
+        self.case.save()
+        self.assertEqual(search.search_product_ids('galaxy'), [])
+        self.kettle.delete()
+        self.assertEqual(search.search_product_ids('phone'), [self.galaxy.id])
+
+    def test_rebuild_index(self):
+        search.clear_index()
+        self.assertEqual(search.search_product_ids('phone'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', '--batch-size', '2', stdout=out)
+        self.assertIn('Indexed 3 product(s).', out.getvalue())
+        self.assertEqual(len(search.search_product_ids('phone')), 3)
+
+    @override_settings(SHOP_PRODUCTS_PER_PAGE=2)
+    def test_paging(self):
+        self.client.force_login(self.user)
+        url = reverse('shop:product_search')
+        response = self.client.get(url, {'q': 'phone'})
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertEqual(response.context['next_page_url'], f'{url}?q=phone&page=2')
+        response = self.client.get(url, {'q': 'phone', 'page': 2, 'fragment': 1})
+        self.assertEqual([product.id for product in response.context['products']], [self.kettle.id])
+        self.assertNotIn('X-Next-Page', response)
+        response = self.client.get(url, {'q': 'phone', 'fragment': 1})
+        self.assertEqual(response['X-Next-Page'], f'{url}?q=phone&page=2')
+        # Page numbers that aren't numbers start over
+        self.assertEqual(len(self.client.get(url, {'q': 'phone', 'page': 'x'}).context['products']), 2)
+
+
+class FacetCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.kitchen = Category.objects.create(name='Kitchen', slug='kitchen')
+        cls.last_one = Product.objects.create(category=cls.phones, name='Last one', slug='last-one',
+                                              price=Decimal('100.00'), stock=1)
+        Product.objects.create(category=cls.phones, name='Cheap', slug='cheap', price=Decimal('50.00'), stock=3)
+        Product.objects.create(category=cls.kitchen, name='Kettle', slug='kettle', price=Decimal('700.00'), stock=2)
+        cls.user = CustomUser.objects.create_user('customer', password='password')
+
+    def counts(self):
+        return {(row.category_id, row.price_bucket, row.in_stock): row.count
+                for row in ProductFacetCount.objects.filter(count__gt=0)}
+
+    def assertCounts(self, expected):
+        self.assertEqual(self.counts(), expected)
+        # The incremental deltas agree with a full recount
+        facets.rebuild()
+        self.assertEqual(self.counts(), expected)
+
+    def test_counts_follow_the_catalog(self):
+        phones, kitchen = self.phones.id, self.kitchen.id
+        self.assertCounts({(phones, 0, True): 2, (kitchen, 1, True): 1})
+
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.last_one, price=self.last_one.price, quantity=1)
+        place_order(cart, self.user, SHIPPING)
+        self.assertCounts({(phones, 0, True): 1, (phones, 0, False): 1, (kitchen, 1, True): 1})
+
+        product = Product.objects.get(pk=self.last_one.pk)
+        product.stock = 4
+        product.save()
+        self.assertCounts({(phones, 0, True): 2, (kitchen, 1, True): 1})
+
+        product.category = self.kitchen
+        product.save()
+        self.assertCounts({(phones, 0, True): 1, (kitchen, 0, True): 1, (kitchen, 1, True): 1})
+
+        product.available = False
+        product.save()
+        self.assertCounts({(phones, 0, True): 1, (kitchen, 1, True): 1})
+
+    def test_filter_products(self):
+        Product.objects.filter(pk=self.last_one.pk).update(stock=0)
+        def names(bucket, in_stock_only):
+            products = facets.filter_products(Product.objects.order_by('name'), bucket, in_stock_only)
+            return [product.name for product in products]
+
+        self.assertEqual(names(0, False), ['Cheap', 'Last one'])
+        self.assertEqual(names(0, True), ['Cheap'])
+        self.assertEqual(names(1, False), ['Kettle'])
+        self.assertEqual(names(None, True), ['Cheap', 'Kettle'])
+        self.assertEqual(names(3, False), [])
+
+
+@override_settings(SHOP_IMAGE_RENDITIONS={'product': {'thumb': (8, 8), 'card': (40, 30)}, 'slide': {}})
+class ImageRenditionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Category', slug='category')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        overrides = override_settings(MEDIA_ROOT=directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def upload(self, name, mode='RGB', size=(100, 60)):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, 'PNG' if name.endswith('.png') else 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def product(self, image=None):
+        return Product.objects.create(category=self.category, name='Product', slug='product',
+                                      price=Decimal('10.00'), stock=1, image=image)
+
+    def render(self, product, placeholder=''):
+        return Template("{% load shop_images %}{% picture product 'card' alt='Alt' placeholder=placeholder %}").render(
+            Context({'product': product, 'placeholder': placeholder}))
+
+    def test_upload_makes_renditions(self):
+        product = self.product(self.upload('photo.jpg'))
+        product.refresh_from_db()
+        self.assertEqual(product.renditions['source'], product.image.name)
+        card = product.renditions['card']
+        self.assertEqual((card['width'], card['height']), (40, 30))
+        # 100x60 is big enough for 2x of the card (80x60)
+        self.assertEqual([width for name, width in card['webp']], [40, 80])
+        self.assertEqual([width for name, width in card['fallback']], [40, 80])
+        for name, width in card['webp'] + card['fallback'] + product.renditions['thumb']['fallback']:
+            with default_storage.open(name) as file, Image.open(file) as image:
+                self.assertEqual(image.width, width)
+        self.assertTrue(card['webp'][0][0].endswith('.webp'))
+        self.assertTrue(card['fallback'][0][0].endswith('.jpg'))
+        self.assertEqual(images.rendition_url(product, 'card'), default_storage.url(card['fallback'][0][0]))
+
+    def test_transparent_upload_falls_back_to_png(self):
+        product = self.product(self.upload('logo.png', mode='RGBA', size=(50, 40)))
+        card = product.renditions['card']
+        # Too small for 2x
+        self.assertEqual([width for name, width in card['fallback']], [40])
+        self.assertTrue(card['fallback'][0][0].endswith('.png'))
+
+    def test_new_image_replaces_renditions(self):
+        product = self.product(self.upload('first.jpg'))
+        old = images.rendition_names(product.renditions)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self.upload('second.jpg')
+            product.save()
+        self.assertEqual(product.renditions['source'], product.image.name)
+        self.assertTrue(all(default_storage.exists(name) for name in images.rendition_names(product.renditions)))
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+    def test_picture_tag(self):
+        product = self.product(self.upload('photo.jpg'))
+        card = product.renditions['card']
+        html = self.render(product)
+        self.assertInHTML(
+            '<picture><source type="image/webp" srcset="{} 40w, {} 80w" sizes="40px">'
+            '<img src="{}" srcset="{} 40w, {} 80w" sizes="40px" width="40" height="30" alt="Alt" class=""'
+            ' loading="lazy" decoding="async"></picture>'.format(
+                *(default_storage.url(name) for name, width in card['webp']),
+                default_storage.url(card['fallback'][0][0]),
+                *(default_storage.url(name) for name, width in card['fallback'])),
+            html)
+
+    def test_picture_tag_without_renditions(self):
+        product = self.product(self.upload('photo.jpg'))
+        # Not made yet (e.g. before `manage.py generate_renditions`): the original image
+        Product.objects.filter(id=product.id).update(renditions={})
+        product.refresh_from_db()
+        self.assertInHTML(f'<img src="{product.image.url}" alt="Alt" class="" loading="lazy">', self.render(product))
+        self.assertEqual(images.rendition_url(product, 'card'), product.image.url)
+        # No image at all: the placeholder
+        Product.objects.filter(id=product.id).update(image='')
+        product.refresh_from_db()
+        self.assertInHTML('<img src="/none.png" alt="Alt" class="" loading="lazy">',
+                          self.render(product, placeholder='/none.png'))
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Category', slug='category')
+        cls.product = Product.objects.create(category=cls.category, name='Product', slug='product',
+                                             price=Decimal('10.00'), stock=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def csrf_token(self, response):
+        return re.search(rb'name="csrfmiddlewaretoken" value="([^"]+)"', response.content).group(1).decode()
+
+    def test_hit_skips_the_view(self):
+        url = self.product.get_absolute_url()
+        self.assertTrue(self.client.get(url).templates)
+        # Bypasses the signals, so only a cache miss would show it
+        Product.objects.filter(id=self.product.id).update(name='Stale')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.templates)
+        self.assertContains(response, 'Product')
+        self.assertNotContains(response, 'Stale')
+
+    def test_each_visitor_gets_their_own_csrf_token(self):
+        url = self.product.get_absolute_url()
+        first, second = Client(enforce_csrf_checks=True), Client(enforce_csrf_checks=True)
+        first_response, second_response = first.get(url), second.get(url)
+        self.assertFalse(second_response.templates)
+        self.assertNotContains(second_response, CSRF_PLACEHOLDER)
+        first_token, second_token = self.csrf_token(first_response), self.csrf_token(second_response)
+        self.assertNotEqual(first_token, second_token)
+        add_url = reverse('shop:cart_add', args=[self.product.id])
+        # Each token only passes with its own visitor's cookie
+        self.assertEqual(second.post(add_url, {'quantity': 1, 'csrfmiddlewaretoken': first_token}).status_code, 403)
+        self.assertNotEqual(second.post(add_url, {'quantity': 1, 'csrfmiddlewaretoken': second_token}).status_code, 403)
+
+    def test_product_save_invalidates(self):
+        url = self.product.get_absolute_url()
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed'
+            self.product.save()
+        response = self.client.get(url)
+        self.assertTrue(response.templates)
+        self.assertContains(response, 'Renamed')
+
+    def test_category_save_invalidates(self):
+        url = reverse('shop:product_list')
+        self.assertContains(self.client.get(url), 'Category')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Renamed'
+            self.category.save()
+        response = self.client.get(url)
+        self.assertTrue(response.templates)
+        self.assertContains(response, 'Renamed')
+
+
+@override_settings(SHOP_PRODUCTS_PER_PAGE=2, SHOP_ORDERS_PER_PAGE=2)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        # Repeated names: only the id tie-breaker tells them apart
+        cls.products = Product.objects.bulk_create([
+            Product(category=category, name=f'Product {i // 2}', slug=f'product-{i}', price=Decimal('10.00'), stock=1)
+            for i in range(5)
+        ])
+        cls.user = CustomUser.objects.create_user('customer', password='password')
+        created = timezone.now()
+        cls.orders = Order.objects.bulk_create([
+            Order(user=cls.user, total_cost=Decimal('10.00'), item_count=0, **SHIPPING) for _ in range(5)
+        ])
+        Order.objects.update(created=created)
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url, key):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [item.id for item in response.context[key]]
+            url = response.context['next_page_url']
+        return seen
+
+    def test_listing_cursor_round_trip(self):
+        expected = list(Product.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(self.walk(reverse('shop:product_list'), 'products'), expected)
+
+    def test_order_history_cursor_round_trip(self):
+        self.client.force_login(self.user)
+        # Same created time throughout, so the newest-first order falls back to the ids
+        expected = sorted((order.id for order in self.orders), reverse=True)
+        self.assertEqual(self.walk(reverse('shop:order_history'), 'orders'), expected)
+
+    def test_bad_cursors_start_over(self):
+        url = reverse('shop:product_list')
+        first_page = [product.id for product in self.client.get(url).context['products']]
+        for cursor in ('garbage', '!!!', encode_cursor(['Product 0']), encode_cursor([None, None]),
+                       encode_cursor(['Product 0', 'x']), encode_cursor(['Product 0', 10 ** 30]),
+                       encode_cursor({'name': 'Product 0'})):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([product.id for product in response.context['products']], first_page)
+
+    def test_fragment(self):
+        response = self.client.get(reverse('shop:product_list'))
+        next_url = response.context['next_page_url']
+        fragment = self.client.get(next_url + '&fragment=1')
+        self.assertTemplateUsed(fragment, 'shop/partials/product_cards.html')
+        self.assertTemplateNotUsed(fragment, 'shop/base.html')
+        self.assertEqual([product.id for product in fragment.context['products']],
+                         list(Product.objects.order_by('name', 'id').values_list('id', flat=True)[2:4]))
+        # The next link drops fragment=1 so it works as a plain link too
+        self.assertNotIn('fragment', fragment['X-Next-Page'])
+        last = self.client.get(fragment['X-Next-Page'] + '&fragment=1')
+        self.assertEqual(len(last.context['products']), 1)
+        self.assertNotIn('X-Next-Page', last)
+
+
+class LoadTestCommandTests(TestCase):
+    def seed(self, **options):
+        options = {'categories': 2, 'products': 20, 'users': 5, 'carts': 2, 'wishlists': 2, 'orders': 10,
+                   'seed': 1, **options}
+        call_command('seed_shop', *[f'--{name.replace("_", "-")}={value}' for name, value in options.items()],
+                     stdout=StringIO())
+
+    def benchmark(self, *args):
+        out = StringIO()
+        call_command('benchmark_shop', '--warmup=0', '--requests=3', *args, stdout=out, stderr=StringIO())
+        return json.loads(out.getvalue())
+
+    def test_seed_shop(self):
+        self.seed()
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(CustomUser.objects.count(), 5)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertEqual(Cart.objects.count(), 2)
+        # Stored totals agree with the items, and the indexes were rebuilt
+        self.assertFalse(Order.objects.out_of_sync().exists())
+        self.assertTrue(ProductFacetCount.objects.exists())
+        product = Product.objects.first()
+        self.assertIn(product.id, search.search_product_ids(product.name.split()[0]))
+
+    def test_benchmark_shop(self):
+        self.seed()
+        Product.objects.update(stock=1000)
+        orders = Order.objects.count()
+        report = self.benchmark()
+        self.assertEqual(set(report['scenarios']), {'product_list', 'product_detail', 'cart_add', 'checkout_view',
+                                                    'order_history'})
+        for name, scenario in report['scenarios'].items():
+            with self.subTest(scenario=name):
+                self.assertEqual((scenario['requests'], scenario['errors']), (3, 0))
+        # Rolled back
+        self.assertEqual(Order.objects.count(), orders)
+        self.assertFalse(Product.objects.exclude(stock=1000).exists())
+
+    def test_benchmark_counts_refused_adds_as_errors(self):
+        self.seed(products=1)
+        Product.objects.update(stock=1, available=True)
+        # The second and third adds of the only unit are answered {"status": "error"}
+        report = self.benchmark('--scenarios', 'cart_add')
+        self.assertEqual(report['scenarios']['cart_add']['errors'], 2)
+
+
+# Each test requests a page with a little data, adds a lot more and requests it again: the
+# number of queries must not change. inspect_queries() also fails a request that repeats a
+# query (see shop/querylog.py), which is how N+1s usually show up before they grow.
+class QueryCountTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Tests', slug='tests')
+        cls.products = Product.objects.bulk_create([
+            Product(category=cls.category, name=f'Product {i:03}', slug=f'product-{i}', description='A product.',
+                    price=Decimal('100.00') + i, stock=1000)
+            for i in range(200)
+        ])
+        cls.user = CustomUser.objects.create_user(username='customer', password='password')
+        cls.admin = CustomUser.objects.create_superuser(username='admin', password='password',
+                                                        email='admin@example.com')
+
+    def count_queries(self, url, method='get', data=None, user=None, inspect=True):
+        self.client.force_login(user or self.user)
+        with ExitStack() as stack:
+            queries = stack.enter_context(CaptureQueriesContext(connection))
+            if inspect:
+                stack.enter_context(inspect_queries(f'{method.upper()} {url}'))
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400)
+        return len(queries)
+
+    def assertConstantQueries(self, url, grow, method='get', data=None, user=None, before=None):
+        # `before` (if given) runs ahead of each request, e.g. to refill a cart that checkout empties
+        if before:
+            before()
+        small = self.count_queries(url, method, data, user)
+        grow()
+        if before:
+            before()
+        large = self.count_queries(url, method, data, user)
+        self.assertEqual(small, large, f'{method.upper()} {url} ran {small} queries, then {large} with more data')
+
+    def add_cart_items(self, count, user=None):
+        cart, created = Cart.objects.get_or_create(user=user or self.user)
+        start = cart.items.count()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, price=product.price, quantity=1)
+            for product in self.products[start:start + count]
+        ])
+        return cart
+
+    def add_orders(self, count, items=3):
+        orders = Order.objects.bulk_create([
+            Order(user=self.user, total_cost=Decimal('300.00'), item_count=items, **SHIPPING) for _ in range(count)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, price=product.price, quantity=1)
+            for order in orders for product in self.products[:items]
+        ])
+
+    def add_wishlist_items(self, count):
+        wishlist, created = Wishlist.objects.get_or_create(user=self.user)
+        start = wishlist.items.count()
+        WishlistItem.objects.bulk_create([
+            WishlistItem(wishlist=wishlist, product=product) for product in self.products[start:start + count]
+        ])
+
+
+class QueryCountTests(QueryCountTestCase):
+    def test_cart_view(self):
+        self.add_cart_items(1)
+        self.assertConstantQueries(reverse('shop:cart_view'), lambda: self.add_cart_items(49))
+
+    def test_checkout_view(self):
+        self.add_cart_items(1)
+        self.assertConstantQueries(reverse('shop:checkout_view'), lambda: self.add_cart_items(49))
+
+    def test_checkout_view_placing_order(self):
+        lines = [1]
+        self.assertConstantQueries(reverse('shop:checkout_view'), lambda: lines.append(50), method='post',
+                                   data=SHIPPING, before=lambda: self.add_cart_items(lines[-1]))
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 2)
+
+    def test_order_history(self):
+        self.add_orders(1)
+        self.assertConstantQueries(reverse('shop:order_history'), lambda: self.add_orders(199))
+
+    def test_order_history_summary(self):
+        self.add_orders(1)
+        self.assertConstantQueries(reverse('shop:order_history') + '?view=summary', lambda: self.add_orders(199))
+
+    def test_order_items(self):
+        self.add_orders(1, items=1)
+        order = Order.objects.get(user=self.user)
+        self.assertConstantQueries(
+            reverse('shop:order_items', args=[order.id]),
+            lambda: OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, price=product.price, quantity=1)
+                for product in self.products[1:50]
+            ]))
+
+    def test_wishlist_view(self):
+        self.add_wishlist_items(1)
+        self.assertConstantQueries(reverse('shop:wishlist_view'), lambda: self.add_wishlist_items(99))
+
+    def test_cart_total_price(self):
+        cart = self.add_cart_items(50)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.get_total_price(), sum(product.price for product in self.products[:50]))
+
+
+class AdminChangelistQueryCountTests(QueryCountTestCase):
+    # The changelist runs the same COUNT(*) twice when unfiltered (result and full result
+    # count), so only the totals are compared here
+    def count_changelist_queries(self, model):
+        return self.count_queries(reverse(f'admin:shop_{model}_changelist'), user=self.admin, inspect=False)
+
+    def add_customers(self, count):
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'customer-{CustomUser.objects.count()}-{i}') for i in range(count)
+        ])
+        for user in users:
+            self.add_cart_items(2, user)
+        wishlists = Wishlist.objects.bulk_create([Wishlist(user=user) for user in users])
+        WishlistItem.objects.bulk_create([
+            WishlistItem(wishlist=wishlist, product=product) for wishlist in wishlists for product in self.products[:2]
+        ])
+        StockReservation.objects.bulk_create([
+            StockReservation(holder=f'cart:{user.pk}', product=self.products[0], quantity=1,
+                             expires_at=timezone.now() + timedelta(minutes=15))
+            for user in users
+        ])
+        self.add_orders(count)
+        Slide.objects.bulk_create([Slide(title=f'Slide {i}', image='slides/test.jpg') for i in range(count)])
+
+    def test_changelists(self):
+        models = ('product', 'category', 'slide', 'order', 'cart', 'wishlist', 'wishlistitem', 'stockreservation',
+                  'customuser')
+        self.add_customers(1)
+        counts = {model: self.count_changelist_queries(model) for model in models}
+        self.add_customers(60)
+        for model in models:
+            with self.subTest(model=model):
+                self.assertEqual(self.count_changelist_queries(model), counts[model])
+
+
+class CartBatchTests(QueryCountTestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def batch(self, operations):
+        body = operations if isinstance(operations, str) else json.dumps({'operations': operations})
+        return self.client.post(reverse('shop:cart_batch'), body, content_type='application/json')
+
+    def lines(self):
+        return dict(self.cart.items.values_list('product_id', 'quantity'))
+
+    def assertRefused(self, operations, message):
+        before = (self.lines(), list(StockReservation.objects.values_list('product_id', 'quantity')))
+        response = self.batch(operations)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertIn(message, response.json()['message'])
+        self.assertEqual((self.lines(), list(StockReservation.objects.values_list('product_id', 'quantity'))), before)
+
+    def test_applies_operations_in_order(self):
+        first, second, third = self.products[:3]
+        self.add_cart_items(2)
+        response = self.batch([
+            {'op': 'add', 'product_id': third.id, 'quantity': 2},
+            {'op': 'add', 'product_id': third.id},
+            {'op': 'update', 'product_id': first.id, 'quantity': 5},
+            {'op': 'remove', 'product_id': second.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(), {first.id: 5, third.id: 3})
+        self.assertEqual(response.json()['cart']['item_count'], 8)
+        self.assertEqual(dict(StockReservation.objects.values_list('product_id', 'quantity')), {first.id: 5, third.id: 3})
+
+    def test_all_or_nothing(self):
+        first, second = self.products[:2]
+        self.add_cart_items(1)
+        # The first operations are fine, the last is not: none of them apply
+        self.assertRefused([
+            {'op': 'add', 'product_id': second.id},
+            {'op': 'remove', 'product_id': first.id},
+            {'op': 'add', 'product_id': second.id, 'quantity': 1000},
+        ], f'Not enough stock for "{second.name}"')
+
+    def test_bad_requests(self):
+        product = self.products[0]
+        self.add_cart_items(1)
+        for body, message in (
+            ('not json', 'Expected a JSON body'),
+            (json.dumps({'operations': []}), 'must be a non-empty list'),
+            ([{'op': 'explode', 'product_id': product.id}], '"op" must be one of'),
+            ([{'op': 'add', 'product_id': 'x'}], 'must be integers'),
+            # JSON numbers too big for a float, or Infinity, come out as float('inf')
+            ('{"operations": [{"op": "add", "product_id": %d, "quantity": 1e400}]}' % product.id, 'must be integers'),
+            (json.dumps({'operations': [{'op': 'add', 'product_id': product.id, 'quantity': float('inf')}]}),
+             'must be integers'),
+            ([{'op': 'add', 'product_id': product.id, 'quantity': 10 ** 20}], 'out of range'),
+            ([{'op': 'update', 'product_id': product.id, 'quantity': -10 ** 20}], 'out of range'),
+            ([{'op': 'add', 'product_id': 10 ** 20}], 'out of range'),
+            ([{'op': 'add', 'product_id': product.id, 'quantity': 0}], 'at least 1'),
+            ([{'op': 'add', 'product_id': 999999}], 'Product 999999 does not exist'),
+        ):
+            with self.subTest(body=body):
+                self.assertRefused(body, message)
+
+    def test_missing_lines(self):
+        # Like cart_update_quantity and cart_remove, which answer 404 for these
+        other = self.products[1]
+        self.add_cart_items(1)
+        for op in ('update', 'remove'):
+            with self.subTest(op=op):
+                self.assertRefused([{'op': op, 'product_id': other.id, 'quantity': 2}],
+                                   f'"{other.name}" is not in the cart')
+        # A line added earlier in the same batch counts
+        self.assertEqual(self.batch([{'op': 'add', 'product_id': other.id},
+                                     {'op': 'update', 'product_id': other.id, 'quantity': 3}]).status_code, 200)
+        self.assertEqual(self.lines()[other.id], 3)
+
+    def test_constant_queries(self):
+        def count(size):
+            # Adds new lines, updates and removes existing ones: `size` of each
+            self.cart.items.all().delete()
+            existing = self.products[:2 * size]
+            self.add_cart_items(2 * size)
+            operations = (
+                [{'op': 'add', 'product_id': product.id} for product in self.products[100:100 + size]]
+                + [{'op': 'update', 'product_id': product.id, 'quantity': 2} for product in existing[:size]]
+                + [{'op': 'remove', 'product_id': product.id} for product in existing[size:]]
+            )
+            with CaptureQueriesContext(connection) as queries, inspect_queries('POST cart_batch'):
+                self.assertEqual(self.batch(operations).status_code, 200)
+            return len(queries)
+
+        self.assertEqual(count(1), count(25))
+
+
+class QueryInspectorTests(TestCase):
+    @override_settings(SHOP_N_PLUS_ONE_THRESHOLD=1)
+    def test_threshold_of_one_reports_every_query(self):
+        with self.assertLogs('shop.queries', 'WARNING') as logs:
+            with inspect_queries('one query', raise_errors=False) as inspector:
+                Product.objects.count()
+        [(key, count, origin)] = inspector.repeated()
+        self.assertEqual(count, 1)
+        self.assertIn('shop/tests.py', origin)
+        self.assertIn('(from shop/tests.py', logs.output[0])
+
+    def test_repeats_raise(self):
+        with self.assertRaisesMessage(NPlusOneError, '2 x SELECT'), self.assertLogs('shop.queries', 'WARNING'):
+            with inspect_queries('two queries'):
+                Product.objects.filter(pk=1).exists()
+                Product.objects.filter(pk=2).exists()
+
+
+# Each hot page's queries on the listed tables must read them through an index: no full
+# table scan and no sorting rows that an index could return in order. The planner's choice
+# is checked on whichever database the tests run against (SQLite or PostgreSQL).
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Tests', slug='tests')
+        cls.products = Product.objects.bulk_create([
+            Product(category=cls.category, name=f'Product {i:03}', slug=f'product-{i}', description='A product.',
+                    price=Decimal('100.00') + i, stock=i % 3, available=i % 10 != 0)
+            for i in range(60)
+        ])
+        Slide.objects.bulk_create([Slide(title=f'Slide {i}', image='slides/test.jpg', order=i) for i in range(3)])
+        cls.user = CustomUser.objects.create_user(username='customer', password='password')
+        orders = Order.objects.bulk_create([
+            Order(user=cls.user, total_cost=Decimal('100.00'), item_count=1, **SHIPPING) for _ in range(30)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=cls.products[1], price=Decimal('100.00'), quantity=1) for order in orders
+        ])
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, price=product.price, quantity=1) for product in cls.products[1:4]
+        ])
+        wishlist = Wishlist.objects.create(user=cls.user)
+        WishlistItem.objects.bulk_create([WishlistItem(wishlist=wishlist, product=product)
+                                          for product in cls.products[1:4]])
+
+    def setUp(self):
+        if connection.vendor not in SUPPORTED_VENDORS:
+            self.skipTest(f'No query plan support for {connection.vendor}')
+        cache.clear()  # Catalog pages would otherwise come from the cache without any queries
+        self.client.force_login(self.user)
+
+    def assertIndexedQueries(self, url, tables):
+        with capture_queries() as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        checked = 0
+        for sql, params in queries:
+            if main_table(sql) not in tables:
+                continue
+            checked += 1
+            steps = explain(sql, params)
+            self.assertEqual(full_scans(steps, tables), [], f'GET {url} ran\n  {sql}\nwith the plan {steps}')
+        self.assertTrue(checked, f'GET {url} ran no queries on {tables}')
+        return response
+
+    def test_product_list(self):
+        for query in ('', '?in_stock=1', '?price=0'):
+            with self.subTest(query=query):
+                response = self.assertIndexedQueries(reverse('shop:product_list') + query,
+                                                     ('shop_product', 'shop_slide'))
+        # The next page's keyset condition too
+        self.assertIndexedQueries(response.context['next_page_url'], ('shop_product',))
+
+    def test_product_list_by_category(self):
+        response = self.assertIndexedQueries(reverse('shop:product_list_by_category', args=[self.category.slug]),
+                                             ('shop_product', 'shop_category'))
+        self.assertIndexedQueries(response.context['next_page_url'], ('shop_product',))
+
+    def test_product_detail(self):
+        product = self.products[1]
+        self.assertIndexedQueries(reverse('shop:product_detail', args=[product.id, product.slug]), ('shop_product',))
+
+    def test_order_history(self):
+        for query in ('', '?view=summary'):
+            with self.subTest(query=query):
+                response = self.assertIndexedQueries(reverse('shop:order_history') + query,
+                                                     ('shop_order', 'shop_orderitem'))
+        self.assertIndexedQueries(response.context['next_page_url'], ('shop_order',))
+
+    def test_order_items(self):
+        order = Order.objects.filter(user=self.user).first()
+        self.assertIndexedQueries(reverse('shop:order_items', args=[order.id]), ('shop_orderitem',))
+
+    def test_cart_view(self):
+        self.assertIndexedQueries(reverse('shop:cart_view'), ('shop_cart', 'shop_cartitem'))
+
+    def test_wishlist_view(self):
+        self.assertIndexedQueries(reverse('shop:wishlist_view'), ('shop_wishlist', 'shop_wishlistitem'))
+
+
+# Routing only: nothing here runs a query on 'replica_0', which the test database doesn't have
+@override_settings(SHOP_DATABASE_REPLICAS=['replica_0'])
+@mock.patch('shop.routers.replica_aliases', lambda: ['replica_0'])
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        cls.product = Product.objects.create(category=category, name='Product', slug='product',
+                                             price=Decimal('10.00'), stock=5)
+
+    def read_alias(self, pinned=False):
+        state = RequestState(pinned)
+        token = _request_state.set(state)
+        try:
+            return read_from_replica(lambda request: Product.objects.all().db)(None)
+        finally:
+            _request_state.reset(token)
+
+    def test_reads_inside_replica_views(self):
+        self.assertEqual(self.read_alias(), 'replica_0')
+        self.assertEqual(Product.objects.all().db, 'default')
+        self.assertEqual(self.read_alias(pinned=True), 'default')
+
+    def test_one_replica_per_request(self):
+        state = RequestState(pinned=False)
+        token = _request_state.set(state)
+        try:
+            with mock.patch('shop.routers.replica_aliases', lambda: ['replica_0', 'replica_1']), \
+                    mock.patch('shop.routers.random.choice', side_effect=lambda replicas: replicas[-1]) as choice:
+                view = read_from_replica(lambda request: [Product.objects.all().db, Category.objects.all().db])
+                self.assertEqual(view(None) + view(None), ['replica_1'] * 4)
+        finally:
+            _request_state.reset(token)
+        self.assertEqual(choice.call_count, 1)
+        self.assertEqual(state.replica, 'replica_1')
+
+    def test_lagging_replica_fills_no_caches(self):
+        cache.clear()
+        url = reverse('shop:product_list')
+        # The test database plays the replica: it hasn't got the rename whose commit on the
+        # primary just bumped the version
+        bump_version('product')
+        with mock.patch.object(ReplicaRouter, 'db_for_read', lambda self, model, **hints: 'default'):
+            response = self.client.get(url)
+            self.assertContains(response, 'Product')
+            self.assertNotIn('ETag', response)
+            # Once it catches up its pages show the rename: nothing stale was cached
+            Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+            response = self.client.get(url)
+            self.assertContains(response, 'Renamed')
+            self.assertNotIn('ETag', response)
+        # Pages read from the primary are cached and tagged as usual
+        self.client.cookies[PIN_COOKIE] = '1'
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        Product.objects.filter(pk=self.product.pk).update(name='Not yet')
+        self.assertContains(self.client.get(url), 'Renamed')
+
+    def test_writes_pin_to_primary(self):
+        response = self.client.get(reverse('shop:cart_view'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        response = self.client.post(reverse('shop:cart_add', args=[self.product.id]))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.SHOP_REPLICA_PIN_SECONDS)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Category', slug='category')
+        cls.product = Product.objects.create(category=cls.category, name='Product', slug='product',
+                                             price=Decimal('10.00'), stock=5)
+        cls.other = Product.objects.create(category=cls.category, name='Other', slug='other',
+                                           price=Decimal('10.00'), stock=5)
+        cls.user = CustomUser.objects.create_user('customer', 'customer@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertRevalidates(self, url, change, last_modified=True):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual('Last-Modified' in response, last_modified)
+        # While the page is unchanged the browser's copy is confirmed without rendering it
+        revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.templates, [])
+        change()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_product_detail(self):
+        url = self.product.get_absolute_url()
+        self.assertRevalidates(url, lambda: Product.objects.filter(pk=self.product.pk).update(
+            stock=4, updated=timezone.now() + timedelta(seconds=1)))
+        self.assertRevalidates(url, lambda: Category.objects.filter(pk=self.category.pk).update(
+            name='Renamed', updated=timezone.now() + timedelta(seconds=2)))
+
+    def test_product_list(self):
+        url = reverse('shop:product_list')
+
+        def delete():
+            # A deleted product leaves no newer timestamp behind; the catalog version changes
+            with self.captureOnCommitCallbacks(execute=True):
+                self.other.delete()
+
+        def rename_category():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.category.name = 'Renamed'
+                self.category.save()
+
+        # The version tokens carry no time, so the listing has no Last-Modified
+        for change in (delete, rename_category, lambda: bump_version('slide')):
+            self.assertRevalidates(url, change, last_modified=False)
+        # The version tokens are all it takes to answer a revalidation
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_varies_by_user(self):
+        url = self.product.get_absolute_url()
+        anonymous = self.client.get(url)
+        self.client.force_login(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+        self.assertIn('private', response['Cache-Control'])
+
+
+class SnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Category', slug='category')
+        cls.product = Product.objects.create(category=cls.category, name='Product', slug='product',
+                                             price=Decimal('10.00'), stock=5)
+        cls.user = CustomUser.objects.create_user('customer', 'customer@example.com', 'password')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        overrides = override_settings(SHOP_SNAPSHOTS=True, SHOP_SNAPSHOT_DIR=directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(shutil.rmtree, snapshots.queue_dir(), ignore_errors=True)
+        snapshots.refresh(product_ids=[self.product.id], all_listings=True)
+
+    def test_served_without_views(self):
+        for url in (reverse('shop:product_list'), reverse('shop:product_list_by_category', args=['category']),
+                    self.product.get_absolute_url()):
+            with self.subTest(url=url), self.assertNumQueries(0):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(CSRF_PLACEHOLDER.encode(), response.content)
+                self.assertIn(b'Product', response.content)
+        # Visitors with a query string or logged in get the views
+        self.assertTrue(self.client.get(reverse('shop:product_list') + '?in_stock=1').templates)
+        self.client.force_login(self.user)
+        self.assertTrue(self.client.get(self.product.get_absolute_url()).templates)
+
+    def test_changes_refresh_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed'
+            self.product.save()
+        # Queued, not rendered, by the change
+        self.assertNotIn(b'Renamed', self.client.get(self.product.get_absolute_url()).content)
+        out = StringIO()
+        call_command('snapshot_catalog', '--changed', stdout=out)
+        self.assertIn('1 queued change(s)', out.getvalue())
+        self.assertIn(b'Renamed', self.client.get(self.product.get_absolute_url()).content)
+        self.assertIn(b'Renamed', self.client.get(reverse('shop:product_list')).content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.available = False
+            self.product.save()
+        self.assertEqual(snapshots.refresh_queued(), 1)
+        self.assertEqual(snapshots.refresh_queued(), 0)
+        response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(response.status_code, 404)
+
+    def test_checkout_queues_without_rendering(self):
+        self.product.stock = 1
+        self.product.save()
+        snapshots.refresh_queued()
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, price=self.product.price, quantity=1)
+        with mock.patch('shop.snapshots.render_page') as render_page, \
+                self.captureOnCommitCallbacks(execute=True):
+            place_order(cart, self.user, SHIPPING)
+        render_page.assert_not_called()
+        # Selling out takes the product off its category's in-stock listings
+        self.assertEqual(len(snapshots.queued_files()), 1)
+        with mock.patch('shop.snapshots.refresh') as refresh:
+            snapshots.refresh_queued()
+        refresh.assert_called_once_with({self.product.id}, {self.category.id}, False)
+
+
+class AssetTests(QueryCountTestCase):
+    def test_pages_use_built_bundles(self):
+        self.add_cart_items(1)  # Checkout sends an empty cart back to the cart page
+        self.client.force_login(self.user)
+        for url in (reverse('shop:product_list'), self.products[0].get_absolute_url(), reverse('shop:cart_view'),
+                    reverse('shop:checkout_view'), reverse('shop:order_history'), reverse('shop:wishlist_view')):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTemplateUsed(response, 'shop/base.html')
+                self.assertContains(response, f'href="{settings.STATIC_URL}shop/dist/app.css"', count=1)
+                self.assertContains(response, f'src="{settings.STATIC_URL}shop/dist/app.js"', count=1)
+                self.assertNotContains(response, 'cdn.tailwindcss.com')
+                self.assertNotContains(response, '<style>')
+
+    def test_missing_manifest(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        # The real storage, before collectstatic has written a manifest
+        storage = override_settings(STORAGES=settings.STORAGES | {'staticfiles': {
+            'BACKEND': 'shop.static.ManifestStaticFilesStorage'}}, STATIC_ROOT=static_root)
+        # Development and CI: the page fails
+        with storage, override_settings(SHOP_STATIC_MANIFEST_STRICT=True), \
+                self.assertRaisesMessage(ValueError, "Missing staticfiles manifest entry for 'shop/dist/app.css'"):
+            self.client.get(reverse('shop:product_list'))
+        # Production: plain URLs and an error logged rather than a 500
+        with storage, override_settings(SHOP_STATIC_MANIFEST_STRICT=False), \
+                self.assertLogs('shop.static', 'ERROR') as logs:
+            response = self.client.get(reverse('shop:product_list'))
+        self.assertContains(response, f'href="{settings.STATIC_URL}shop/dist/app.css"', count=1)
+        self.assertIn("Missing staticfiles manifest entry for 'shop/dist/app.css'", logs.output[0])
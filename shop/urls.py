@@ -1,7 +1,11 @@
 # shop/urls.py
 
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# The AJAX cart and wishlist endpoints, sync or async (shop/async_views.py) per SHOP_ASYNC_VIEWS
+ajax_views = async_views if settings.SHOP_ASYNC_VIEWS else views
 
 app_name = 'shop' # Defines the application namespace
 
@@ -10,20 +14,29 @@ urlpatterns = [
 
     # Cart Pages/Actions
     path('cart/', views.cart_view, name='cart_view'),
-    path('cart/add/<int:product_id>/', views.cart_add, name='cart_add'),
-    path('cart/remove/<int:product_id>/', views.cart_remove, name='cart_remove'),
-    path('cart/update-quantity/<int:product_id>/', views.cart_update_quantity, name='cart_update_quantity'),
+    path('cart/add/<int:product_id>/', ajax_views.cart_add, name='cart_add'),
+    path('cart/remove/<int:product_id>/', ajax_views.cart_remove, name='cart_remove'),
+    path('cart/update-quantity/<int:product_id>/', ajax_views.cart_update_quantity, name='cart_update_quantity'),
+    path('cart/summary/', async_views.cart_summary, name='cart_summary'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
 
     # Checkout Page
     path('checkout/', views.checkout_view, name='checkout_view'),
 
     # Order History Page
     path('orders/', views.order_history, name='order_history'),
+    path('orders/<int:order_id>/items/', views.order_items, name='order_items'),
 
     # Wishlist Pages
     path('wishlist/', views.wishlist_view, name='wishlist_view'),
-    path('wishlist/add/<int:product_id>/', views.wishlist_add, name='wishlist_add'),
-    path('wishlist/remove/<int:product_id>/', views.wishlist_remove, name='wishlist_remove'),
+    path('wishlist/add/<int:product_id>/', ajax_views.wishlist_add, name='wishlist_add'),
+    path('wishlist/remove/<int:product_id>/', ajax_views.wishlist_remove, name='wishlist_remove'),
+
+    # Request metrics for Prometheus (staff only)
+    path('metrics/', views.metrics_view, name='metrics'),
+
+    # Product search
+    path('search/', views.product_search, name='product_search'),
 
     # Homepage - lists all products
     path('', views.product_list, name='product_list'),
@@ -1,50 +1,210 @@
 # shop/views.py
 
+import json
+
 from django.shortcuts import render, get_object_or_404, redirect
 from .models import Product, Category, Slide, Order, OrderItem, Wishlist, WishlistItem, Cart, CartItem, \
     CustomUser  # Import all models
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, JsonResponse
 from django.views.decorators.http import require_POST
-from django.db import transaction  # For atomic order creation
 from django.contrib import messages  # For displaying messages to the user
-
-
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.template.response import TemplateResponse
+from .cart import apply_cart_operations, get_cart, CartOperationError, DatabaseCart
+from .checkout import place_order
+from .conditional import catalog_freshness, conditional_page, product_freshness
+from .facets import build_facets, filter_products, parse_price_bucket
+from .images import rendition_url
+from .cache import cache_catalog_page, get_versions, CATALOG_NAMESPACES
+from .pagination import paginate_keyset
+from .routers import read_from_replica, replica_in_use
+from . import metrics, reservations
+from .search import search_product_ids
+from .stock import load_live_stock
+
+# Keyset order for catalog listings: Meta.ordering ('name',) plus 'id' as a tie-breaker
+PRODUCT_LIST_ORDERING = ('name', 'id')
+# Keyset order for order history: newest first, matching Order.Meta.ordering
+ORDER_HISTORY_ORDERING = ('-created', '-id')
+
+
+def catalog_context():
+    # Shared by the catalog pages. categories and slides are lazy querysets: they only hit
+    # the DB when their template fragments miss the cache, which is keyed on these versions.
+    return {
+        'categories': Category.objects.all(),
+        'slides': Slide.objects.filter(is_active=True).order_by('order'),
+        'catalog_versions': get_versions(*CATALOG_NAMESPACES),
+        # 0 reads the fragment cache without writing to it, as pages from a replica must
+        'catalog_cache_timeout': 0 if replica_in_use() else settings.SHOP_CATALOG_CACHE_TIMEOUT,
+    }
+
+
+@read_from_replica
+@conditional_page(catalog_freshness)
+@cache_catalog_page('product', 'category', 'slide')
 def product_list(request, category_slug=None):
     category = None
-    categories = Category.objects.all()
     products = Product.objects.filter(available=True)
-    slides = Slide.objects.filter(is_active=True).order_by('order')
 
     if category_slug:
         category = get_object_or_404(Category, slug=category_slug)
         products = products.filter(category=category)
 
-    return render(request, 'shop/product_list.html', {
+    # Facet filters; the cursor links below carry them along in the query string
+    price_bucket = parse_price_bucket(request.GET.get('price'))
+    in_stock_only = request.GET.get('in_stock') == '1'
+    products = filter_products(products, price_bucket, in_stock_only)
+
+    page = paginate_keyset(products, PRODUCT_LIST_ORDERING, request.GET.get('cursor'),
+                           per_page=settings.SHOP_PRODUCTS_PER_PAGE)
+    next_page_url = None
+    if page.has_next:
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        query.pop('fragment', None)
+        next_page_url = f'{request.path}?{query.urlencode()}'
+
+    # Infinite scroll asks for just the next batch of product cards
+    if request.GET.get('fragment'):
+        response = TemplateResponse(request, 'shop/partials/product_cards.html', {'products': page})
+        if next_page_url:
+            response['X-Next-Page'] = next_page_url
+        return response
+
+    return TemplateResponse(request, 'shop/product_list.html', {
+        **catalog_context(),
         'category': category,
-        'categories': categories,
+        'products': page,
+        'next_page_url': next_page_url,
+        'facets': build_facets(request, category, price_bucket, in_stock_only),
+    })
+
+
+# Full-text search over product names, descriptions and category names (see shop/search.py)
+@cache_catalog_page('product', 'category', 'slide')
+def product_search(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page_number = 1
+    per_page = settings.SHOP_PRODUCTS_PER_PAGE
+
+    products, next_page_url = [], None
+    if query:
+        # Ask for one extra id to know whether there is a next page
+        ids = search_product_ids(query, limit=per_page + 1, offset=(page_number - 1) * per_page)
+        if len(ids) > per_page:
+            ids = ids[:per_page]
+            next_query = request.GET.copy()
+            next_query['page'] = page_number + 1
+            next_query.pop('fragment', None)
+            next_page_url = f'{request.path}?{next_query.urlencode()}'
+        found = Product.objects.in_bulk(ids)
+        products = [found[product_id] for product_id in ids if product_id in found]
+
+    if request.GET.get('fragment'):
+        response = TemplateResponse(request, 'shop/partials/product_cards.html', {'products': products})
+        if next_page_url:
+            response['X-Next-Page'] = next_page_url
+        return response
+
+    return TemplateResponse(request, 'shop/product_list.html', {
+        **catalog_context(),
+        'query': query,
         'products': products,
-        'slides': slides,
+        'next_page_url': next_page_url,
     })
 
 
+@read_from_replica
+@conditional_page(product_freshness)
+@cache_catalog_page('product', 'category')
 def product_detail(request, id, slug):
     product = get_object_or_404(Product, id=id, slug=slug, available=True)
-    return render(request, 'shop/product_detail.html', {'product': product})
+    # Product.stock lags behind for sharded stock; the page shows no count (it is cached
+    # through orders until the product sells out) but in stock / sold out must be right
+    load_live_stock([product])
+    return TemplateResponse(request, 'shop/product_detail.html', {'product': product})
 
 
 # Order History View (Requires user to be logged in)
+@read_from_replica
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created')
-    return render(request, 'shop/order_history.html', {'orders': orders})
+    # ?view=summary lists orders from their stored totals only; lines load on demand via order_items
+    summary = request.GET.get('view') == 'summary'
+    orders = Order.objects.filter(user=request.user)
+    if not summary:
+        # Two queries for the whole page: the items, joined to their products
+        orders = orders.prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+
+    page = paginate_keyset(orders, ORDER_HISTORY_ORDERING, request.GET.get('cursor'),
+                           per_page=settings.SHOP_ORDERS_PER_PAGE)
+    next_page_url = None
+    if page.has_next:
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        next_page_url = f'{request.path}?{query.urlencode()}'
+
+    return render(request, 'shop/order_history.html', {
+        'orders': page,
+        'summary': summary,
+        'next_page_url': next_page_url,
+    })
+
+
+# Line items of one order as JSON, for the summary mode of order history
+@login_required
+def order_items(request, order_id):
+    order = get_object_or_404(Order, id=order_id, user=request.user)
+    items = order.items.select_related('product').order_by('id')
+    return JsonResponse({
+        'order_id': order.id,
+        'total_cost': order.total_cost,
+        'item_count': order.item_count,
+        'items': [{
+            'product_id': item.product_id,
+            'product_name': item.product.name,
+            'product_url': item.product.get_absolute_url(),
+            'image_url': rendition_url(item.product, 'thumb'),
+            'quantity': item.quantity,
+            'price': item.price,
+            'cost': item.get_cost(),
+        } for item in items],
+    })
+
+
+# Replies of the AJAX cart and wishlist endpoints. Callers that ask for JSON (the site's own
+# fetch() calls send Accept: application/json) show `text` themselves, so it isn't also
+# stored as a flash message: that would cost a session write per click and pile up until
+# the next page load. Other callers get it on their next page too.
+FEEDBACK_LEVELS = {'success': messages.SUCCESS, 'removed': messages.SUCCESS, 'info': messages.INFO}
+
+
+def wants_json(request):
+    return ((request.accepts('application/json') and not request.accepts('text/html'))
+            or request.headers.get('X-Requested-With') == 'XMLHttpRequest')
+
+
+def feedback(request, status, text, **data):
+    if not wants_json(request):
+        messages.add_message(request, FEEDBACK_LEVELS.get(status, messages.ERROR), text)
+    return JsonResponse({'status': status, 'message': text, **data})
 
 
 # Wishlist View (Requires user to be logged in)
 @login_required
 def wishlist_view(request):
     wishlist, created = Wishlist.objects.get_or_create(user=request.user)
-    return render(request, 'shop/wishlist.html', {'wishlist': wishlist})
+    # One query for the items and their products, evaluated once for the whole template
+    wishlist_items = list(wishlist.items.select_related('product'))
+    return render(request, 'shop/wishlist.html', {'wishlist': wishlist, 'wishlist_items': wishlist_items})
 
 
 # Add to Wishlist (requires POST request and user login)
@@ -55,13 +215,8 @@ def wishlist_add(request, product_id):
     wishlist, created = Wishlist.objects.get_or_create(user=request.user)
     wishlist_item, item_created = WishlistItem.objects.get_or_create(wishlist=wishlist, product=product)
     if item_created:
-        messages.success(request, f'"{product.name}" added to your wishlist.')
-        return JsonResponse(
-            {'status': 'success', 'message': 'Product added to wishlist.', 'product_name': product.name})
-    else:
-        messages.info(request, f'"{product.name}" is already in your wishlist.')
-        return JsonResponse(
-            {'status': 'info', 'message': 'Product is already in your wishlist.', 'product_name': product.name})
+        return feedback(request, 'success', f'"{product.name}" added to your wishlist.', product_name=product.name)
+    return feedback(request, 'info', f'"{product.name}" is already in your wishlist.', product_name=product.name)
 
 
 # Remove from Wishlist (requires POST request and user login)
@@ -72,98 +227,133 @@ def wishlist_remove(request, product_id):
     wishlist = get_object_or_404(Wishlist, user=request.user)
     deleted_count, _ = WishlistItem.objects.filter(wishlist=wishlist, product=product).delete()
     if deleted_count > 0:
-        messages.success(request, f'"{product.name}" removed from your wishlist.')
-        return JsonResponse(
-            {'status': 'success', 'message': 'Product removed from wishlist.', 'product_name': product.name})
-    else:
-        messages.info(request, f'"{product.name}" was not found in your wishlist.')
-        return JsonResponse(
-            {'status': 'info', 'message': 'Product was not found in your wishlist.', 'product_name': product.name})
+        return feedback(request, 'success', f'"{product.name}" removed from your wishlist.', product_name=product.name)
+    return feedback(request, 'info', f'"{product.name}" was not found in your wishlist.', product_name=product.name)
 
 
 # CART FUNCTIONALITY
-@login_required
+# Cart views work without logging in: visitors get a signed-cookie cart (shop/cart.py)
+# that is merged into their Cart rows when they log in. Checkout still requires login.
 def cart_view(request):
-    # Get or create the user's cart
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    return render(request, 'shop/cart.html', {'cart': cart})
+    cart_items = get_cart(request).items()
+    return render(request, 'shop/cart.html', {
+        'cart_items': cart_items,
+        'cart_total': sum((item.get_cost() for item in cart_items), 0),
+    })
 
 
-@login_required
 @require_POST
 def cart_add(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
     quantity = int(request.POST.get('quantity', 1))  # Get quantity from POST, default to 1
+    return add_to_cart(request, get_cart(request), product_id, quantity)
 
-    if quantity <= 0:
-        messages.error(request, 'Quantity must be at least 1.')
-        return JsonResponse({'status': 'error', 'message': 'Quantity must be at least 1.'})
-
-    if product.stock < quantity:
-        messages.error(request, f'Not enough stock for "{product.name}". Available: {product.stock}')
-        return JsonResponse({'status': 'error', 'message': 'Not enough stock.'})
 
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_item, item_created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': quantity, 'price': product.price}  # Set initial quantity and price if new item
-    )
-
-    if not item_created:
-        # If item already exists in cart, update quantity
-        old_quantity = cart_item.quantity
-        new_total_quantity = old_quantity + quantity
-        if product.stock < new_total_quantity:
-            messages.error(request,
-                           f'Cannot add more "{product.name}". Only {product.stock - old_quantity} more available.')
-            return JsonResponse({'status': 'error', 'message': 'Cannot add more. Not enough stock.'})
-        cart_item.quantity = new_total_quantity
-        cart_item.save()
-        messages.success(request, f'{quantity} more of "{product.name}" added to cart. Total: {cart_item.quantity}.')
-    else:
-        messages.success(request, f'"{product.name}" added to cart.')
+# The body of cart_add, shared with its async version (shop/async_views.py)
+@transaction.atomic
+def add_to_cart(request, cart, product_id, quantity):
+    # The product row stays locked until the line and its stock reservation are saved
+    product = reservations.lock_products([product_id]).get(product_id)
+    if product is None:
+        raise Http404('No Product matches the given query.')
 
-    return JsonResponse({'status': 'success', 'message': 'Product added to cart.'})
+    if quantity <= 0:
+        return feedback(request, 'error', 'Quantity must be at least 1.')
+
+    # Stock held in other carts can't be added to this one
+    available = reservations.available_stock([product], cart.holder)[product.id]
+    if available < quantity:
+        return feedback(request, 'error', f'Not enough stock for "{product.name}". Available: {available}')
+
+    line = cart.get_lines([product.id]).get(product.id)
+    try:
+        if line:
+            # If item already exists in cart, update quantity (keeping the price it was added at)
+            old_quantity, price = line
+            new_total_quantity = old_quantity + quantity
+            if available < new_total_quantity:
+                return feedback(request, 'error', f'Cannot add more "{product.name}". '
+                                                  f'Only {max(available - old_quantity, 0)} more available.')
+            cart.save_lines({product.id: (new_total_quantity, price)})
+            text = f'{quantity} more of "{product.name}" added to cart. Total: {new_total_quantity}.'
+        else:
+            new_total_quantity = quantity
+            cart.save_lines({product.id: (quantity, product.price)})
+            text = f'"{product.name}" added to cart.'
+    except CartOperationError as e:
+        return feedback(request, 'error', str(e))
+
+    reservations.hold(cart.holder, {product.id: new_total_quantity})
+    return feedback(request, 'success', text)
 
 
-@login_required
 @require_POST
-def cart_remove(request, product_id):
+def cart_remove(request, product_id, status='success'):
     product = get_object_or_404(Product, id=product_id)
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_item = get_object_or_404(CartItem, cart=cart, product=product)
+    cart = get_cart(request)
+    if product.id not in cart.get_lines([product.id]):
+        raise Http404('Product is not in the cart.')
 
-    cart_item.delete()
-    messages.success(request, f'"{product.name}" removed from cart.')
-    return JsonResponse({'status': 'success', 'message': 'Product removed from cart.'})
+    cart.save_lines({}, [product.id])
+    reservations.release(cart.holder, [product.id])
+    return feedback(request, status, f'"{product.name}" removed from cart.')
 
 
-@login_required
 @require_POST
 def cart_update_quantity(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
     new_quantity = int(request.POST.get('quantity', 1))  # New desired quantity
-
     if new_quantity <= 0:
-        cart_remove(request, product_id)  # If quantity is 0 or less, remove item
-        return JsonResponse({'status': 'removed', 'message': f'"{product.name}" removed from cart.'})
+        return cart_remove(request, product_id, status='removed')  # If quantity is 0 or less, remove item
+    return update_cart_quantity(request, get_cart(request), product_id, new_quantity)
 
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_item = get_object_or_404(CartItem, cart=cart, product=product)
 
-    if product.stock < new_quantity:
-        messages.error(request, f'Not enough stock for "{product.name}". Max available: {product.stock}')
-        return JsonResponse({'status': 'error', 'message': f'Not enough stock. Max: {product.stock}'})
+# The body of cart_update_quantity for quantities above 0, shared with its async version
+@transaction.atomic
+def update_cart_quantity(request, cart, product_id, new_quantity):
+    product = reservations.lock_products([product_id]).get(product_id)
+    if product is None:
+        raise Http404('No Product matches the given query.')
 
-    cart_item.quantity = new_quantity
-    cart_item.save()
-    messages.success(request, f'Quantity for "{product.name}" updated to {new_quantity}.')
-    return JsonResponse({'status': 'success', 'message': 'Quantity updated.', 'new_quantity': new_quantity,
-                         'new_item_cost': cart_item.get_cost()})
+    line = cart.get_lines([product.id]).get(product.id)
+    if line is None:
+        raise Http404('Product is not in the cart.')
+
+    available = reservations.available_stock([product], cart.holder)[product.id]
+    if available < new_quantity:
+        return feedback(request, 'error', f'Not enough stock for "{product.name}". Max available: {available}')
+
+    price = line[1]
+    cart.save_lines({product.id: (new_quantity, price)})
+    reservations.hold(cart.holder, {product.id: new_quantity})
+    return feedback(request, 'success', f'Quantity for "{product.name}" updated to {new_quantity}.',
+                    new_quantity=new_quantity, new_item_cost=price * new_quantity)
+
+
+# Apply several add/update/remove operations in one request (JSON body: {"operations": [...]})
+@require_POST
+def cart_batch(request):
+    try:
+        operations = json.loads(request.body)['operations']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Expected a JSON body with an "operations" list.'},
+                            status=400)
+
+    try:
+        state = apply_cart_operations(get_cart(request), operations)
+    except CartOperationError as e:
+        return JsonResponse({'status': 'error', 'message': str(e), 'errors': e.errors}, status=400)
+    return JsonResponse({'status': 'success', 'message': 'Cart updated.', 'cart': state})
 
 
 # CHECKOUT FUNCTIONALITY
+def checkout_context(cart, cart_items=None):
+    if cart_items is None:
+        cart_items = DatabaseCart(cart).items()
+    return {
+        'cart_items': cart_items,
+        'cart_total': sum((item.get_cost() for item in cart_items), 0),
+    }
+
+
 @login_required
 def checkout_view(request):
     cart, created = Cart.objects.get_or_create(user=request.user)
@@ -182,48 +372,37 @@ def checkout_view(request):
 
         if not all([first_name, last_name, email, address, postal_code, city]):
             messages.error(request, "Please fill in all required shipping details.")
-            return render(request, 'shop/checkout.html', {'cart': cart})
+            return render(request, 'shop/checkout.html', checkout_context(cart))
 
         try:
-            with transaction.atomic():  # Ensure atomicity: either all or none of the operations succeed
-                # Create the Order
-                order = Order.objects.create(
-                    user=request.user,
-                    first_name=first_name,
-                    last_name=last_name,
-                    email=email,
-                    address=address,
-                    postal_code=postal_code,
-                    city=city,
-                    # paid=False by default
-                    status='Pending'
-                )
-
-                # Move items from cart to OrderItems and update product stock
-                for cart_item in cart.items.all():
-                    if cart_item.product.stock < cart_item.quantity:
-                        raise ValueError(
-                            f"Not enough stock for {cart_item.product.name}. Only {cart_item.product.stock} available.")
-
-                    OrderItem.objects.create(
-                        order=order,
-                        product=cart_item.product,
-                        price=cart_item.price,  # Price at the time of order
-                        quantity=cart_item.quantity
-                    )
-                    # Decrease product stock
-                    cart_item.product.stock -= cart_item.quantity
-                    cart_item.product.save()
-
-                # Clear the cart after successful order creation
-                cart.items.all().delete()
-
-                messages.success(request, f"Your order #{order.id} has been placed successfully!")
-                return redirect('shop:order_history')  # Redirect to order history page
+            # Creates the order, moves the cart lines into it and takes the stock in one transaction
+            order = place_order(cart, request.user, {
+                'first_name': first_name,
+                'last_name': last_name,
+                'email': email,
+                'address': address,
+                'postal_code': postal_code,
+                'city': city,
+            })
+            messages.success(request, f"Your order #{order.id} has been placed successfully!")
+            return redirect('shop:order_history')  # Redirect to order history page
         except ValueError as e:
             messages.error(request, f"Order failed: {e}")
         except Exception as e:
             messages.error(request, f"An unexpected error occurred: {e}. Please try again.")
+    else:
+        # Entering checkout renews the cart's stock reservations for another SHOP_RESERVATION_TTL
+        database_cart = DatabaseCart(cart)
+        cart_items = database_cart.items()
+        for product, available in reservations.hold_cart(database_cart, cart_items):
+            messages.warning(request, f'Only {available} of "{product.name}" left. Please update your cart.')
+        return render(request, 'shop/checkout.html', checkout_context(cart, cart_items))
+
+    return render(request, 'shop/checkout.html', checkout_context(cart))
 
-    return render(request, 'shop/checkout.html', {'cart': cart})
 
+# Per-view request metrics from every worker, in the Prometheus text format (see shop/metrics.py)
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(metrics.render_prometheus(metrics.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
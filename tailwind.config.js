@@ -0,0 +1,15 @@
+// tailwind.config.js
+
+// Read by `manage.py build_assets` (Tailwind CSS v3, the version the pages were written
+// against on the CDN). Only classes found in these files make it into the stylesheet, so
+// keep class names whole in templates and scripts rather than building them from parts.
+module.exports = {
+  content: [
+    './shop/templates/**/*.html',
+    './shop/assets/js/**/*.js',
+  ],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+}